@@ -0,0 +1,147 @@
+"""
+Sincronización de Respuestas por Lotes
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+El cuestionario guarda cada cambio en una cola local del navegador (funciona
+sin conexión) y la envía en lotes compactos cuando hay red: una entrada por
+pregunta con la última respuesta. Gana el último cambio que recibe el servidor
+(el reloj del navegador no se compara con el del servidor: puede estar
+desfasado). La cola sólo guarda el cambio más reciente de cada pregunta, así
+que nunca reenvía uno anterior, y reenviar un lote ya aplicado no cambia nada
+ni incrementa la revisión. El envío final del cuestionario calcula el puntaje
+sobre lo ya guardado.
+"""
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+import catalog
+import metrics
+import models
+
+ANSWER_SYNC_MAX_DELTAS = int(os.getenv("ANSWER_SYNC_MAX_DELTAS", "200"))  # Cambios por lote
+
+metrics.describe("ciberseguria_answer_deltas_total", "Cambios de respuestas sincronizados, por resultado")
+
+
+class AnswerSyncError(Exception):
+    """Lote de cambios inválido"""
+
+
+class AssessmentCompleted(Exception):
+    """El assessment ya se envió: los cambios pendientes ya no aplican"""
+
+
+@dataclass
+class AnswerDelta:
+    question_id: int
+    respuesta: models.RespuestaEnum
+    evidencia: Optional[str]
+    ts: datetime  # Reloj del navegador: sólo ordena los cambios de un mismo lote
+
+
+@dataclass
+class SyncResult:
+    revision: int
+    applied: List[int] = field(default_factory=list)
+    ignored: List[int] = field(default_factory=list)  # Ya estaba guardada la misma respuesta
+
+    def to_dict(self) -> dict:
+        return {"revision": self.revision, "applied": self.applied, "ignored": self.ignored}
+
+
+def parse_deltas(payload, now: Optional[datetime] = None) -> List[AnswerDelta]:
+    """
+    Validar el cuerpo {"deltas": [{"question_id", "respuesta", "evidencia", "ts"}]}.
+
+    ts son milisegundos desde epoch según el reloj del navegador; sólo se usan
+    para quedarse con el cambio más reciente si una pregunta viene repetida.
+    """
+    now = now or datetime.utcnow()
+    items = payload.get("deltas") if isinstance(payload, dict) else None
+    if not isinstance(items, list):
+        raise AnswerSyncError("Se esperaba un objeto con la lista 'deltas'")
+    if len(items) > ANSWER_SYNC_MAX_DELTAS:
+        raise AnswerSyncError(f"Máximo {ANSWER_SYNC_MAX_DELTAS} cambios por lote")
+
+    latest: Dict[int, AnswerDelta] = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise AnswerSyncError("Cada cambio debe ser un objeto")
+        question_id, ts, evidencia = item.get("question_id"), item.get("ts"), item.get("evidencia")
+        if not isinstance(question_id, int) or isinstance(question_id, bool):
+            raise AnswerSyncError("question_id debe ser un entero")
+        if not isinstance(ts, (int, float)) or isinstance(ts, bool) or ts < 0:
+            raise AnswerSyncError(f"ts inválido en la pregunta {question_id}")
+        if evidencia is not None and not isinstance(evidencia, str):
+            raise AnswerSyncError(f"evidencia inválida en la pregunta {question_id}")
+        try:
+            respuesta = models.RespuestaEnum(item.get("respuesta"))
+        except ValueError:
+            raise AnswerSyncError(f"Respuesta inválida en la pregunta {question_id}")
+
+        when = min(datetime.fromtimestamp(ts / 1000, timezone.utc).replace(tzinfo=None), now)
+        delta = AnswerDelta(question_id, respuesta, evidencia or None, when)
+        if question_id not in latest or latest[question_id].ts <= when:
+            latest[question_id] = delta
+    return list(latest.values())
+
+
+def apply_deltas(db: Session, user_id: int, assessment_id: int, deltas: List[AnswerDelta]) -> Optional[SyncResult]:
+    """
+    Aplicar los cambios en el orden en que llegan (sin commit).
+
+    Retorna None si el assessment no es del usuario. Los cambios iguales a lo
+    guardado se ignoran; cualquier otro incrementa la revisión del assessment,
+    de modo que un envío final basado en una revisión anterior no se guarda
+    encima (bloqueo optimista).
+    """
+    assessment = db.query(models.Assessment).filter(
+        models.Assessment.id == assessment_id,
+        models.Assessment.user_id == user_id
+    ).first()
+    if assessment is None:
+        return None
+    if assessment.estado == "Completado":
+        raise AssessmentCompleted(assessment_id)
+
+    valid_ids = {question.id for question in catalog.get_assessment_catalog(db, assessment).questions}
+    unknown = sorted(delta.question_id for delta in deltas if delta.question_id not in valid_ids)
+    if unknown:
+        raise AnswerSyncError(f"Preguntas fuera del catálogo del diagnóstico: {unknown[:10]}")
+
+    existing = {
+        answer.question_id: answer
+        for answer in db.query(models.Answer).filter(
+            models.Answer.assessment_id == assessment_id,
+            models.Answer.question_id.in_([delta.question_id for delta in deltas])
+        )
+    }
+
+    now = datetime.utcnow()
+    result = SyncResult(revision=assessment.revision)
+    for delta in deltas:
+        answer = existing.get(delta.question_id)
+        if answer is not None and (answer.respuesta, answer.evidencia_adjunta) == (delta.respuesta, delta.evidencia):
+            result.ignored.append(delta.question_id)
+            continue
+        if answer is None:
+            answer = models.Answer(assessment_id=assessment_id, question_id=delta.question_id)
+            db.add(answer)
+        answer.respuesta = delta.respuesta
+        answer.evidencia_adjunta = delta.evidencia
+        answer.updated_at = now
+        result.applied.append(delta.question_id)
+
+    if result.applied:
+        db.query(models.Assessment).filter(models.Assessment.id == assessment_id).update(
+            {models.Assessment.revision: models.Assessment.revision + 1}, synchronize_session=False
+        )
+        result.revision += 1
+
+    metrics.increment("ciberseguria_answer_deltas_total", len(result.applied), result="applied")
+    metrics.increment("ciberseguria_answer_deltas_total", len(result.ignored), result="ignored")
+    return result
@@ -2,7 +2,11 @@
 Sistema de Autenticación y Seguridad
 CiberSegurIA - Diagnóstico SGSI Express MVP
 """
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+import hmac
+import os
+import secrets
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -10,13 +14,19 @@ from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from database import get_db
+import metrics
 import models
+import revocation
+import tracing
 
 # Configuración de seguridad
 SECRET_KEY = "ciberseguria-2025-mvp-secretkey-changeme-production"  # CAMBIAR EN PRODUCCIÓN
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 horas
 
+# Token para integraciones de auditoría/BI (exportaciones de todos los clientes)
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
 # Context para hashing de passwords
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -47,6 +57,70 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+@dataclass(frozen=True)
+class TokenUser:
+    """Usuario de un token de API: los claims que usan las rutas, sin consultar la base"""
+    id: int
+    rut: str
+    nombre_empresa: str
+    es_consultor: bool
+    token_version: int
+    jti: str
+    expires_at: datetime
+
+    @classmethod
+    def from_claims(cls, payload: dict) -> "TokenUser":
+        return cls(
+            id=int(payload["sub"]),
+            rut=payload["rut"],
+            nombre_empresa=payload["empresa"],
+            es_consultor=bool(payload["consultor"]),
+            token_version=int(payload["ver"]),
+            jti=payload["jti"],
+            expires_at=datetime.utcfromtimestamp(payload["exp"]),
+        )
+
+
+def create_user_token(user: models.User) -> str:
+    """Token de API con los claims del usuario y su versión de token vigente"""
+    return create_access_token({
+        "sub": str(user.id),
+        "rut": user.rut,
+        "empresa": user.nombre_empresa,
+        "consultor": bool(user.es_consultor),
+        "ver": user.token_version,
+        "jti": secrets.token_hex(8),
+    })
+
+
+def revoke_user_tokens(db: Session, user_id: int):
+    """
+    Invalidar todos los tokens de API del usuario (sin commit): sube su versión
+    de token y registra la revocación para los demás procesos.
+    """
+    user = db.get(models.User, user_id)
+    user.token_version = (user.token_version or 1) + 1
+    revocation.record(
+        db, user_id,
+        expires_at=datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+        token_version=user.token_version
+    )
+
+
+def change_password(db: Session, user_id: int, hashed_password: str):
+    """Guardar la nueva contraseña y revocar los tokens emitidos con la anterior (sin commit)"""
+    db.get(models.User, user_id).hashed_password = hashed_password
+    revoke_user_tokens(db, user_id)
+
+
+def is_admin_request(request: Request) -> bool:
+    """Verificar el header X-Admin-Token contra ADMIN_API_TOKEN"""
+    token = request.headers.get("X-Admin-Token")
+    if not ADMIN_API_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), ADMIN_API_TOKEN.encode())
+
+
 def authenticate_user(db: Session, rut: str, password: str):
     """Autenticar usuario por RUT y password"""
     user = db.query(models.User).filter(models.User.rut == rut).first()
@@ -58,30 +132,32 @@ def authenticate_user(db: Session, rut: str, password: str):
 
 
 def get_current_user_from_token(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-):
-    """Obtener usuario actual desde token JWT (para API)"""
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> TokenUser:
+    """
+    Obtener usuario actual desde token JWT (para API).
+
+    Firma, expiración y claims bastan para identificarlo; la revocación se
+    revisa en la lista en memoria (revocation.py), sin consultar users.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudo validar las credenciales",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("sub")
-        if user_id is None:
+    with tracing.span("auth.token_user"):
+        try:
+            payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+            token_user = TokenUser.from_claims(payload)
+        except (JWTError, KeyError, TypeError, ValueError):
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
 
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user is None:
-        raise credentials_exception
+        if revocation.revocations.is_revoked(token_user.id, token_user.token_version, token_user.jti):
+            metrics.increment("ciberseguria_tokens_rejected_total")
+            raise credentials_exception
 
-    return user
+    return token_user
 
 
 async def get_current_user_from_session(
@@ -89,16 +165,17 @@ async def get_current_user_from_session(
     db: Session = Depends(get_db)
 ):
     """Obtener usuario actual desde sesión de cookies (para templates)"""
-    user_id = request.session.get("user_id")
+    with tracing.span("auth.session_user"):
+        user_id = request.session.get("user_id")
 
-    if not user_id:
-        raise HTTPException(
-            status_code=status.HTTP_303_SEE_OTHER,
-            detail="No autenticado",
-            headers={"Location": "/login"}
-        )
+        if not user_id:
+            raise HTTPException(
+                status_code=status.HTTP_303_SEE_OTHER,
+                detail="No autenticado",
+                headers={"Location": "/login"}
+            )
 
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+        user = db.query(models.User).filter(models.User.id == user_id).first()
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_303_SEE_OTHER,
@@ -107,3 +184,17 @@ async def get_current_user_from_session(
         )
 
     return user
+
+
+async def get_current_consultant_from_session(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """Usuario de sesión que debe estar habilitado como consultor"""
+    user = await get_current_user_from_session(request, db)
+    if not user.es_consultor:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Acceso sólo para consultores"
+        )
+    return user
@@ -0,0 +1,251 @@
+"""
+Benchmark de Generación de Reportes PDF
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Crea assessments sintéticos (30, 300 y 3000 controles por defecto, con
+evidencias largas) en una base SQLite temporal y mide cada sección de
+PDFReportGenerator (_load_data, cada _create_* y doc.build) más el pico de
+memoria con tracemalloc. Los tiempos salen de los spans de tracing.py, es
+decir, de la misma instrumentación que se usa en producción (detailed_results
+es el tiempo del anexo dentro de doc.build).
+
+Ejecutar con:
+    python benchmark_pdf.py --guardar-base          # Registrar la línea base
+    python benchmark_pdf.py                         # Comparar contra la base
+    python benchmark_pdf.py --tamanos 30 300 --tolerancia 0.5
+
+Termina con código 1 si alguna métrica empeora más que la tolerancia.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+BENCHMARK_SIZES = (30, 300, 3000)
+BENCHMARK_BASELINE = os.getenv("BENCHMARK_BASELINE", "benchmark_baseline.json")
+BENCHMARK_TOLERANCE = 0.25  # 25% sobre la línea base
+BENCHMARK_MIN_MS = 5.0  # Secciones más rápidas que esto no se comparan (ruido)
+
+_RESPUESTAS = ("SI", "PARCIAL", "NO", "NA")
+_PALABRAS = (
+    "política", "respaldo", "firewall", "auditoría", "incidente", "acceso", "cifrado",
+    "proveedor", "capacitación", "registro", "revisión", "continuidad", "riesgo", "control",
+)
+_REFERENCIAS = (
+    "ISO 27001:2022 A.5.{n} | Art. 4 Ley 21.663",
+    "ISO 27001:2022 A.8.{n}",
+    "ISO 27001:2022 A.5.{n} | Art. 8 Ley 21.096",
+    "ISO 27001:2022 Cláusula 6.{n} | Art. 7 Ley 21.663",
+)
+
+
+def _texto(rng: random.Random, largo: int) -> str:
+    """Texto sintético de ~largo caracteres (sin marcas XML, como lo escribe un usuario)"""
+    palabras = []
+    total = 0
+    while total < largo:
+        palabra = rng.choice(_PALABRAS)
+        palabras.append(palabra)
+        total += len(palabra) + 1
+    return " ".join(palabras).capitalize() + "."
+
+
+def build_dataset(db, controles: int, largo_evidencia: int, seed: int = 42) -> int:
+    """Crear catálogo, empresa y assessment completado con `controles` respuestas"""
+    import catalog
+    import models
+
+    rng = random.Random(seed + controles)
+    dominios = max(1, min(14, controles // 10))
+    questions = [{
+        "dominio": f"A.{5 + i % dominios} Dominio sintético {i % dominios + 1}",
+        "subdominio": f"Subdominio {i % 7 + 1}",
+        "pregunta": f"¿Control sintético {i + 1}? " + _texto(rng, 120),
+        "descripcion": _texto(rng, 200),
+        "peso": rng.randint(1, 5),
+        "orden": i,
+        "referencia_legal": _REFERENCIAS[i % len(_REFERENCIAS)].format(n=i % 37 + 1),
+    } for i in range(controles)]
+    version = catalog.create_version(db, f"benchmark-{controles}", questions)
+
+    user = models.User(
+        nombre_empresa=f"Benchmark {controles} SpA",
+        rut=f"{controles}-K",
+        email_contacto=f"benchmark{controles}@example.com",
+        hashed_password="-",
+    )
+    assessment = models.Assessment(
+        user=user, estado="Completado", puntaje_final=50.0, catalog_version_id=version.id
+    )
+    db.add_all([user, assessment])
+    db.flush()
+
+    question_ids = [q.id for q in db.query(models.Question.id).filter(
+        models.Question.catalog_version_id == version.id
+    )]
+    db.add_all([models.Answer(
+        assessment_id=assessment.id,
+        question_id=question_id,
+        respuesta=models.RespuestaEnum[rng.choice(_RESPUESTAS)],
+        evidencia_adjunta=_texto(rng, largo_evidencia) if rng.random() < 0.8 else None,
+    ) for question_id in question_ids])
+    db.commit()
+    return assessment.id
+
+
+def _run_once(db, assessment_id: int, output_dir: str) -> Dict[str, float]:
+    """Generar un PDF y retornar los ms de cada span pdf.* (más el total)"""
+    import pdf_generator
+    import tracing
+
+    db.expire_all()
+    generator = pdf_generator.PDFReportGenerator(assessment_id, db)
+    output_path = os.path.join(output_dir, f"reporte_{assessment_id}.pdf")
+    started = time.perf_counter()
+    with tracing.capture() as trace:
+        generator.generate_pdf(output_path)
+
+    timings = {"total": (time.perf_counter() - started) * 1000}
+    for span in trace.spans:
+        if span["name"].startswith("pdf."):
+            timings[span["name"][4:]] = span["duration_ms"]
+    timings["pages"] = generator.build_stats["pages"]
+    timings["bytes"] = generator.build_stats["bytes"]
+    return timings
+
+
+def _peak_memory(db, assessment_id: int, output_dir: str) -> float:
+    """Pico de memoria (MB) de una generación, medido aparte para no distorsionar los tiempos"""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        _run_once(db, assessment_id, output_dir)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def run_benchmark(sizes: List[int], repeticiones: int, largo_evidencia: int) -> Dict:
+    """Ejecutar el benchmark completo en una base temporal"""
+    workdir = tempfile.mkdtemp(prefix="ciberseguria_bench_")
+    # La base temporal debe configurarse antes de importar database
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.pop("DATABASE_REPLICA_URL", None)
+
+    import models  # noqa: F401 (registra las tablas)
+    from database import Base, SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    results = {}
+    try:
+        for size in sizes:
+            assessment_id = build_dataset(db, size, largo_evidencia)
+            _run_once(db, assessment_id, workdir)  # Calentar cachés (estilos, logo, catálogo)
+
+            runs = [_run_once(db, assessment_id, workdir) for _ in range(repeticiones)]
+            medians = {key: round(statistics.median(run[key] for run in runs), 2) for key in runs[0]}
+            medians["peak_mb"] = round(_peak_memory(db, assessment_id, workdir), 2)
+            results[str(size)] = medians
+            print(
+                f"{size:>5} controles: {medians['total']:9.1f} ms, {medians['peak_mb']:7.1f} MB, "
+                f"{int(medians['pages'])} páginas",
+                file=sys.stderr
+            )
+    finally:
+        db.close()
+        engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeticiones": repeticiones,
+        "largo_evidencia": largo_evidencia,
+        "results": results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Listar las métricas que empeoraron más que la tolerancia respecto de la base"""
+    regressions = []
+    for size, metrics_now in current["results"].items():
+        metrics_base = baseline.get("results", {}).get(size)
+        if not metrics_base:
+            continue
+        for key, value in metrics_now.items():
+            base = metrics_base.get(key)
+            if base is None or key in ("pages", "bytes"):
+                continue
+            if key != "peak_mb" and max(base, value) < BENCHMARK_MIN_MS:
+                continue
+            if base > 0 and value > base * (1 + tolerance):
+                regressions.append(
+                    f"{size} controles / {key}: {value:.1f} vs base {base:.1f} (+{(value / base - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def _print_table(report: Dict, baseline: Dict = None):
+    for size, values in report["results"].items():
+        base = (baseline or {}).get("results", {}).get(size, {})
+        print(f"\n== {size} controles ==")
+        for key, value in values.items():
+            delta = ""
+            if base.get(key):
+                delta = f"  ({(value / base[key] - 1) * 100:+.0f}%)"
+            print(f"  {key:<20} {value:>12.2f}{delta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de generación de reportes PDF")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=list(BENCHMARK_SIZES),
+                        help="Cantidades de controles a medir")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Ejecuciones por tamaño (se usa la mediana)")
+    parser.add_argument("--largo-evidencia", type=int, default=1500, help="Caracteres de cada evidencia")
+    parser.add_argument("--base", default=BENCHMARK_BASELINE, help="Archivo JSON de línea base")
+    parser.add_argument("--guardar-base", action="store_true", help="Guardar el resultado como nueva línea base")
+    parser.add_argument("--tolerancia", type=float, default=BENCHMARK_TOLERANCE,
+                        help="Empeoramiento máximo aceptado (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    logging.getLogger("ciberseguria.pdf").setLevel(logging.WARNING)
+    report = run_benchmark(args.tamanos, args.repeticiones, args.largo_evidencia)
+
+    if args.guardar_base:
+        with open(args.base, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        _print_table(report)
+        print(f"\nLínea base guardada en {args.base}")
+        return
+
+    if not os.path.exists(args.base):
+        _print_table(report)
+        print(f"\nNo existe {args.base}: ejecutar con --guardar-base para registrarla")
+        return
+
+    with open(args.base, encoding="utf-8") as fh:
+        baseline = json.load(fh)
+    _print_table(report, baseline)
+
+    regressions = compare(report, baseline, args.tolerancia)
+    if regressions:
+        print(f"\n❌ Regresiones sobre {args.tolerancia * 100:.0f}%:")
+        for line in regressions:
+            print(f"  - {line}")
+        sys.exit(1)
+    print(f"\n✅ Sin regresiones sobre {args.tolerancia * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Catálogos Versionados de Preguntas
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Cada versión del catálogo es inmutable: sus preguntas, pesos, orden y mapeos a
+los marcos normativos (ISO 27001, Ley 21.663, Ley 21.096) se compilan una vez
+en un índice JSON guardado en CatalogVersion.indice. Los assessments quedan
+asociados a una versión, así que un re-seed crea una versión nueva y nunca
+altera resultados anteriores.
+
+Cada proceso carga el índice de una versión la primera vez que la necesita y
+lo reutiliza en el cuestionario, el cálculo de puntaje y los reportes.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import models
+from database import ReadSessionLocal
+
+# Segundos antes de volver a consultar cuál es la versión vigente
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+
+# Marcos normativos soportados: código -> nombre
+FRAMEWORKS = {
+    "ISO27001": "ISO/IEC 27001:2022",
+    "LEY21663": "Ley Marco de Ciberseguridad 21.663",
+    "LEY21096": "Ley 21.096 Protección de Datos Personales",
+}
+
+CatalogQuestion = namedtuple(
+    "CatalogQuestion",
+    ["id", "dominio", "subdominio", "pregunta", "descripcion", "peso", "orden", "referencia_legal"]
+)
+
+# Control de un marco cubierto por una pregunta: ("ISO27001", "A.5.1")
+ControlRef = namedtuple("ControlRef", ["framework", "control"])
+
+
+class CatalogError(Exception):
+    """Versión de catálogo inexistente o sin preguntas"""
+
+
+class Catalog:
+    """Índice inmutable de una versión del catálogo"""
+
+    def __init__(
+        self,
+        version: int,
+        etiqueta: str,
+        questions: Tuple[CatalogQuestion, ...],
+        mappings: Optional[Dict[int, Tuple[ControlRef, ...]]] = None
+    ):
+        self.version = version
+        self.etiqueta = etiqueta
+        self.questions = questions
+        self.by_id: Dict[int, CatalogQuestion] = {q.id: q for q in questions}
+
+        by_domain: Dict[str, List[CatalogQuestion]] = {}
+        for q in questions:
+            by_domain.setdefault(q.dominio, []).append(q)
+        self.by_domain: Dict[str, Tuple[CatalogQuestion, ...]] = {
+            dominio: tuple(qs) for dominio, qs in by_domain.items()
+        }
+        self.domains: Tuple[str, ...] = tuple(self.by_domain)
+
+        # Mapeos cruzados: pregunta -> controles y marco -> preguntas
+        self.mappings: Dict[int, Tuple[ControlRef, ...]] = mappings or {}
+        by_framework: Dict[str, List[int]] = {}
+        for q in questions:
+            for ref in self.mappings.get(q.id, ()):
+                by_framework.setdefault(ref.framework, []).append(q.id)
+        self.by_framework: Dict[str, Tuple[int, ...]] = {
+            codigo: tuple(ids) for codigo, ids in by_framework.items()
+        }
+
+    def __len__(self):
+        return len(self.questions)
+
+    def to_json(self) -> str:
+        """Serializar el índice (se guarda en CatalogVersion.indice)"""
+        return json.dumps({
+            "questions": [list(q) for q in self.questions],
+            "mappings": {str(qid): [list(ref) for ref in refs] for qid, refs in self.mappings.items()},
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, version: int, etiqueta: str, data: str) -> "Catalog":
+        raw = json.loads(data)
+        return cls(
+            version,
+            etiqueta,
+            tuple(CatalogQuestion(*q) for q in raw["questions"]),
+            {int(qid): tuple(ControlRef(*ref) for ref in refs) for qid, refs in raw["mappings"].items()}
+        )
+
+
+# ============================================================================
+# Mapeos desde referencia_legal
+# ============================================================================
+
+_ISO_REF = re.compile(r"(A\.\d+(?:\.\d+)*|Cláusula\s+[\d.]+)")
+_ART_REF = re.compile(r"Art\.\s*[\d\-]+")
+
+
+def parse_referencias(referencia_legal: Optional[str]) -> Tuple[ControlRef, ...]:
+    """
+    Extraer los controles de cada marco desde el texto de referencia legal.
+
+    "ISO 27001:2022 A.5.1 | Art. 4 Ley 21.663" ->
+        (ControlRef("ISO27001", "A.5.1"), ControlRef("LEY21663", "Art. 4"))
+    """
+    refs = []
+    for part in (referencia_legal or "").split("|"):
+        if "27001" in part:
+            codigo, match = "ISO27001", _ISO_REF.search(part)
+        elif "21.663" in part:
+            codigo, match = "LEY21663", _ART_REF.search(part)
+        elif "21.096" in part:
+            codigo, match = "LEY21096", _ART_REF.search(part)
+        else:
+            continue
+
+        ref = ControlRef(codigo, match.group(0) if match else "General")
+        if ref not in refs:
+            refs.append(ref)
+    return tuple(refs)
+
+
+# ============================================================================
+# Creación de versiones
+# ============================================================================
+
+def ensure_frameworks(db: Session) -> Dict[str, models.Framework]:
+    """Crear los marcos normativos que falten; retorna código -> Framework"""
+    existing = {f.codigo: f for f in db.query(models.Framework).all()}
+    for codigo, nombre in FRAMEWORKS.items():
+        if codigo not in existing:
+            framework = models.Framework(codigo=codigo, nombre=nombre)
+            db.add(framework)
+            existing[codigo] = framework
+    db.flush()
+    return existing
+
+
+def _compile_version(db: Session, version: models.CatalogVersion, questions: Iterable[models.Question]):
+    """Crear los mapeos de las preguntas y guardar el índice precompilado"""
+    frameworks = ensure_frameworks(db)
+
+    ordered = sorted(questions, key=lambda q: (q.dominio, q.orden, q.id))
+    mappings = {}
+    for question in ordered:
+        refs = parse_referencias(question.referencia_legal)
+        if not question.mappings:
+            for ref in refs:
+                question.mappings.append(models.ControlMapping(
+                    framework_id=frameworks[ref.framework].id,
+                    control_ref=ref.control
+                ))
+        if refs:
+            mappings[question.id] = refs
+
+    index = Catalog(
+        version.id,
+        version.etiqueta,
+        tuple(CatalogQuestion(
+            q.id, q.dominio, q.subdominio, q.pregunta, q.descripcion, q.peso, q.orden, q.referencia_legal
+        ) for q in ordered),
+        mappings
+    )
+    version.indice = index.to_json()
+
+
+def _set_vigente(db: Session, version: models.CatalogVersion):
+    db.query(models.CatalogVersion).filter(
+        models.CatalogVersion.id != version.id
+    ).update({models.CatalogVersion.vigente: False})
+    version.vigente = True
+
+
+def create_version(db: Session, etiqueta: str, questions: List[dict]) -> models.CatalogVersion:
+    """
+    Crear una versión nueva del catálogo y dejarla vigente.
+
+    Las versiones anteriores se conservan para los assessments que las usan.
+    """
+    version = models.CatalogVersion(etiqueta=etiqueta)
+    db.add(version)
+    db.flush()
+
+    rows = [models.Question(catalog_version_id=version.id, **data) for data in questions]
+    db.add_all(rows)
+    db.flush()
+
+    _compile_version(db, version, rows)
+    _set_vigente(db, version)
+    db.commit()
+    invalidate()
+    return version
+
+
+def adopt_legacy_catalog(db: Session):
+    """
+    Migrar una base anterior al versionado: las preguntas sin versión pasan a
+    una versión "legacy" y los assessments sin versión quedan asociados a la
+    versión vigente (idempotente).
+    """
+    legacy = db.query(models.Question).filter(models.Question.catalog_version_id.is_(None)).all()
+    if legacy:
+        version = models.CatalogVersion(etiqueta="legacy")
+        db.add(version)
+        db.flush()
+        for question in legacy:
+            question.catalog_version_id = version.id
+        _compile_version(db, version, legacy)
+        if not db.query(models.CatalogVersion).filter(models.CatalogVersion.vigente.is_(True)).count():
+            version.vigente = True
+        db.flush()
+
+    vigente = db.query(models.CatalogVersion.id).filter(models.CatalogVersion.vigente.is_(True)).scalar()
+    if vigente is not None:
+        db.query(models.Assessment).filter(
+            models.Assessment.catalog_version_id.is_(None)
+        ).update({models.Assessment.catalog_version_id: vigente})
+
+    db.commit()
+
+
+# ============================================================================
+# Caché por proceso
+# ============================================================================
+
+_lock = threading.Lock()
+_versions: Dict[int, Catalog] = {}  # Índices inmutables: nunca expiran
+_current_id: Optional[int] = None
+_current_checked_at = 0.0
+
+
+def _load_version(db: Session, version_id: int) -> Catalog:
+    version = db.query(models.CatalogVersion).filter(models.CatalogVersion.id == version_id).first()
+    if version is None:
+        raise CatalogError(f"Versión de catálogo {version_id} no existe")
+
+    if version.indice:
+        return Catalog.from_json(version.id, version.etiqueta, version.indice)
+
+    # Versión sin índice (no debería ocurrir): compilar en memoria sin guardar
+    rows = db.query(
+        models.Question.id,
+        models.Question.dominio,
+        models.Question.subdominio,
+        models.Question.pregunta,
+        models.Question.descripcion,
+        models.Question.peso,
+        models.Question.orden,
+        models.Question.referencia_legal
+    ).filter(
+        models.Question.catalog_version_id == version_id
+    ).order_by(models.Question.dominio, models.Question.orden, models.Question.id).all()
+    questions = tuple(CatalogQuestion(*row) for row in rows)
+    return Catalog(
+        version.id, version.etiqueta, questions,
+        {q.id: parse_referencias(q.referencia_legal) for q in questions}
+    )
+
+
+def _current_version_id(db: Session) -> int:
+    global _current_id, _current_checked_at
+
+    if _current_id is not None and time.monotonic() - _current_checked_at < CATALOG_CACHE_TTL:
+        return _current_id
+
+    version_id = db.query(models.CatalogVersion.id).filter(
+        models.CatalogVersion.vigente.is_(True)
+    ).order_by(models.CatalogVersion.id.desc()).limit(1).scalar()
+    if version_id is None:
+        raise CatalogError("No hay un catálogo vigente (ejecute python seed.py)")
+
+    _current_id = version_id
+    _current_checked_at = time.monotonic()
+    return version_id
+
+
+def _get(db: Session, version_id: Optional[int]) -> Catalog:
+    if version_id is None:
+        version_id = _current_version_id(db)
+
+    catalog = _versions.get(version_id)
+    if catalog is None:
+        with _lock:
+            catalog = _versions.get(version_id)
+            if catalog is None:
+                catalog = _load_version(db, version_id)
+                _versions[version_id] = catalog
+    return catalog
+
+
+def get_catalog(db: Optional[Session] = None, version_id: Optional[int] = None) -> Catalog:
+    """
+    Obtener el índice de una versión del catálogo (por defecto, la vigente).
+
+    Sólo la primera consulta de cada versión lee la base de datos.
+    """
+    if version_id is not None and version_id in _versions:
+        return _versions[version_id]
+
+    if db is None:
+        own_db = ReadSessionLocal()
+        try:
+            return _get(own_db, version_id)
+        finally:
+            own_db.close()
+    return _get(db, version_id)
+
+
+def get_assessment_catalog(db: Session, assessment: models.Assessment) -> Catalog:
+    """Catálogo con que se evalúa (y se reporta) un assessment"""
+    return get_catalog(db, assessment.catalog_version_id)
+
+
+def invalidate():
+    """Volver a consultar la versión vigente en el próximo acceso"""
+    global _current_id
+    with _lock:
+        _current_id = None
+
+
+def warm():
+    """Precargar el catálogo vigente (hook de arranque del worker)"""
+    try:
+        return get_catalog()
+    except CatalogError:
+        return None
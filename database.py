@@ -2,29 +2,163 @@
 Configuración de Base de Datos - SQLAlchemy + SQLite
 CiberSegurIA - Diagnóstico SGSI Express MVP
 """
-from sqlalchemy import create_engine
+import os
+import time
+
+from fastapi import Depends, Request
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+# URL de la base de datos principal (escrituras) y de la réplica opcional (lecturas)
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ciberseguria.db")
+SQLALCHEMY_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") or None
+
+# Parámetros del pool de conexiones
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Shards por organización (ver sharding.py): la base principal queda con
+# usuarios y catálogo, y los assessments de cada cliente van en su archivo
+SHARDING_ENABLED = os.getenv("SHARDING_ENABLED", "0") == "1"
+
+# Segundos tras una escritura en que las lecturas de esa sesión van a la principal
+DB_READ_AFTER_WRITE_SECONDS = float(os.getenv("DB_READ_AFTER_WRITE_SECONDS", "5"))
+
+
+def is_memory_sqlite(url: str) -> bool:
+    return url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url
+
+
+def create_db_engine(url: str, read_only: bool = False, pool_size: int = DB_POOL_SIZE,
+                     max_overflow: int = DB_MAX_OVERFLOW):
+    """Crear engine según la URL, aplicando la configuración de pool"""
+    kwargs = {}
+
+    if url.startswith("sqlite"):
+        # check_same_thread=False para SQLite
+        kwargs["connect_args"] = {"check_same_thread": False}
 
-# SQLite Database URL
-SQLALCHEMY_DATABASE_URL = "sqlite:///./ciberseguria.db"
+    if not is_memory_sqlite(url):
+        kwargs.update(
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=not url.startswith("sqlite")
+        )
 
-# Crear engine con check_same_thread=False para SQLite
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
+    new_engine = create_engine(url, **kwargs)
+
+    if read_only and url.startswith("sqlite"):
+        # La réplica local rechaza escrituras, igual que una réplica real
+        @event.listens_for(new_engine, "connect")
+        def _set_query_only(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA query_only = ON")
+            cursor.close()
+
+    return new_engine
+
+
+# Engine principal (escrituras) y de lectura (réplica si está configurada)
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
+if SQLALCHEMY_REPLICA_URL:
+    read_engine = create_db_engine(SQLALCHEMY_REPLICA_URL, read_only=True)
+else:
+    read_engine = engine
 
 # SessionLocal para crear sesiones de BD
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 # Base para los modelos
 Base = declarative_base()
 
-# Dependency para obtener la sesión de BD en FastAPI
-def get_db():
+
+def add_missing_columns(connection):
+    """
+    Agregar a las tablas existentes las columnas e índices nuevos del modelo.
+
+    create_all sólo crea tablas completas; este paso cubre los campos que se
+    agregan a tablas ya creadas en instalaciones anteriores.
+    """
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=connection.dialect)}"
+            if column.server_default is not None:
+                default = column.server_default.arg
+                default = getattr(default, "text", default)
+                ddl += f" DEFAULT {default if str(default).lstrip('-').isdigit() else repr(str(default))}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            connection.exec_driver_sql(ddl)
+
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def init_db():
+    """Crear las tablas, columnas e índices que no existan (idempotente)"""
+    import models  # noqa: F401  (registra los modelos en Base.metadata)
+    import catalog
+    import search
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        add_missing_columns(connection)
+        # Índices de texto completo y sus triggers
+        search.install(connection)
+
+    # Preguntas y assessments creados antes del versionado del catálogo
     db = SessionLocal()
+    try:
+        catalog.adopt_legacy_catalog(db)
+    finally:
+        db.close()
+
+
+def mark_recent_write(request: Request):
+    """Marcar la sesión del navegador para leer de la principal durante un tiempo"""
+    if read_engine is not engine:
+        request.session["rw_until"] = time.time() + DB_READ_AFTER_WRITE_SECONDS
+
+
+def _tenant_session(request: Request):
+    """Sesión del shard de la organización de la request (None sin shards)"""
+    if not SHARDING_ENABLED:
+        return None
+    import sharding
+    return sharding.session_for_request(request)
+
+
+# Dependency para obtener la sesión de BD en FastAPI
+def get_db(request: Request):
+    db = _tenant_session(request) or SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+# Dependency de sólo lectura: usa la réplica salvo justo después de una escritura.
+# Sin réplica (o con shards) reutiliza la sesión de get_db: dos conexiones del
+# mismo pool por request agotan el pool con la mitad de requests concurrentes,
+# y el checkout que espera bloquea el event loop. Es async para no pasar por el
+# threadpool cuando get_current_user_from_session ya tomó su conexión.
+async def get_read_db(request: Request, db: Session = Depends(get_db)):
+    if SHARDING_ENABLED or read_engine is engine or request.session.get("rw_until", 0) > time.time():
+        yield db
+        return
+    replica = ReadSessionLocal()
+    try:
+        yield replica
+    finally:
+        replica.close()
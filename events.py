@@ -0,0 +1,320 @@
+"""
+Eventos de Diagnósticos y Reportes (Server-Sent Events)
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+En vez de recargar el portafolio o el reporte para ver si un cliente terminó
+su diagnóstico, el navegador abre /api/events y recibe:
+
+- assessment.completed: un diagnóstico se envió por primera vez
+- assessment.score_changed: un reenvío cambió el puntaje
+- report.ready: se generó el PDF de una revisión del reporte
+
+Cada evento llega al dueño del assessment y a su consultor. El bus vive en el
+proceso: cada suscriptor tiene un buffer acotado (EVENTS_QUEUE_SIZE); si se
+llena se descartan los eventos más antiguos y el suscriptor recibe "resync"
+para que recargue su vista.
+
+El backend de distribución es intercambiable (EVENTS_BACKEND):
+
+- memory: sólo el proceso actual (un worker)
+- sqlite: un archivo compartido (EVENTS_SQLITE_PATH) que hace de broker local
+  entre workers; cada worker lee las filas nuevas cada EVENTS_POLL_SECONDS
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import AsyncIterator, Callable, Optional, Set
+
+import metrics
+
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "memory")  # memory o sqlite
+EVENTS_SQLITE_PATH = os.getenv("EVENTS_SQLITE_PATH", "events.db")
+EVENTS_POLL_SECONDS = float(os.getenv("EVENTS_POLL_SECONDS", "0.5"))
+EVENTS_RETENTION_SECONDS = float(os.getenv("EVENTS_RETENTION_SECONDS", "300"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))  # Eventos por suscriptor
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "1000"))  # Por proceso
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+logger = logging.getLogger("ciberseguria.events")
+
+metrics.describe("ciberseguria_events_published_total", "Eventos publicados, por tipo")
+metrics.describe("ciberseguria_events_dropped_total", "Eventos descartados por buffer de suscriptor lleno")
+metrics.describe("ciberseguria_event_subscriptions_total", "Suscripciones a /api/events, por resultado")
+
+
+class TooManySubscribers(Exception):
+    """Se alcanzó EVENTS_MAX_SUBSCRIBERS en este proceso"""
+
+
+@dataclass
+class Event:
+    tipo: str
+    user_id: int  # Dueño del assessment
+    consultor_id: Optional[int]  # Consultor a cargo al momento del evento
+    data: dict = field(default_factory=dict)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False, default=str)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "Event":
+        return cls(**json.loads(raw))
+
+    def visible_to(self, user_id: int) -> bool:
+        return user_id in (self.user_id, self.consultor_id)
+
+
+class Subscription:
+    """Buffer acotado de un cliente SSE: descarta lo más antiguo al llenarse"""
+
+    def __init__(self, user_id: int, maxsize: int = EVENTS_QUEUE_SIZE):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0  # Descartados desde la última vez que se avisó
+
+    def offer(self, event: Optional[Event]):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            metrics.increment("ciberseguria_events_dropped_total")
+        self.queue.put_nowait(event)
+
+
+# ============================================================================
+# Backends
+# ============================================================================
+
+class MemoryBroker:
+    """Entrega directa dentro del proceso"""
+
+    def __init__(self):
+        self._deliver: Optional[Callable[[Event], None]] = None
+
+    async def start(self, deliver: Callable[[Event], None]):
+        self._deliver = deliver
+
+    async def stop(self):
+        self._deliver = None
+
+    def publish(self, event: Event):
+        if self._deliver is not None:
+            self._deliver(event)
+
+
+class SQLiteBroker:
+    """
+    Broker local entre workers: una tabla de sólo inserción en un archivo
+    SQLite (WAL). Cada worker lee las filas posteriores a la última vista y,
+    desde la misma tarea, borra cada tanto las más antiguas que
+    EVENTS_RETENTION_SECONDS.
+
+    publish() no toca el archivo: la inserción queda en un hilo escritor
+    propio, así un lock del archivo no detiene el event loop de la request.
+    """
+
+    def __init__(self, path: str = EVENTS_SQLITE_PATH, poll_seconds: float = EVENTS_POLL_SECONDS,
+                 retention_seconds: float = EVENTS_RETENTION_SECONDS):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.retention_seconds = retention_seconds
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._writer: Optional[sqlite3.Connection] = None  # Sólo desde el hilo escritor
+        self._task: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, payload TEXT NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS ix_events_created ON events (created)")
+        return connection
+
+    async def start(self, deliver: Callable[[Event], None]):
+        loop = asyncio.get_running_loop()
+        reader = await loop.run_in_executor(None, self._connect)
+        # Sólo los eventos publicados desde ahora
+        last_id = reader.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        self._task = loop.create_task(self._poll(reader, last_id, deliver), name="events-poll")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executor is not None:
+            # Escribir lo pendiente antes de cerrar la conexión
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def publish(self, event: Event):
+        if self._executor is None:
+            # Un solo hilo: conserva el orden de publicación y la conexión escritora
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="events-writer")
+        self._executor.submit(self._insert, time.time(), event.to_json())
+
+    def _insert(self, created: float, payload: str):
+        try:
+            if self._writer is None:
+                self._writer = self._connect()
+            self._writer.execute("INSERT INTO events (created, payload) VALUES (?, ?)", (created, payload))
+        except sqlite3.Error:
+            # Un evento perdido sólo atrasa la vista
+            logger.warning("No se pudo escribir el evento en %s", self.path, exc_info=True)
+
+    def _prune(self, reader: sqlite3.Connection):
+        reader.execute("DELETE FROM events WHERE created < ?", (time.time() - self.retention_seconds,))
+
+    async def _poll(self, reader: sqlite3.Connection, last_id: int, deliver: Callable[[Event], None]):
+        loop = asyncio.get_running_loop()
+        query = "SELECT id, payload FROM events WHERE id > ? ORDER BY id LIMIT 500"
+        # Limpieza unas pocas veces por período de retención, no en cada evento
+        prune_every = max(self.retention_seconds / 4, self.poll_seconds)
+        next_prune = 0.0
+        try:
+            while True:
+                if time.monotonic() >= next_prune:
+                    next_prune = time.monotonic() + prune_every
+                    try:
+                        await loop.run_in_executor(None, self._prune, reader)
+                    except sqlite3.Error:
+                        logger.warning("No se pudieron borrar los eventos antiguos de %s", self.path, exc_info=True)
+                try:
+                    rows = await loop.run_in_executor(None, lambda: reader.execute(query, (last_id,)).fetchall())
+                except sqlite3.Error:
+                    logger.warning("No se pudieron leer los eventos de %s", self.path, exc_info=True)
+                    rows = []
+                for row_id, payload in rows:
+                    last_id = row_id
+                    deliver(Event.from_json(payload))
+                if len(rows) < 500:
+                    await asyncio.sleep(self.poll_seconds)
+        finally:
+            reader.close()
+
+
+BROKERS = {
+    "memory": MemoryBroker,
+    "sqlite": SQLiteBroker,
+}
+
+
+# ============================================================================
+# Bus del proceso
+# ============================================================================
+
+class EventBus:
+    """Suscriptores del proceso y su backend de distribución"""
+
+    def __init__(self, broker=None, max_subscribers: int = EVENTS_MAX_SUBSCRIBERS):
+        self.broker = broker if broker is not None else BROKERS[EVENTS_BACKEND]()
+        self.max_subscribers = max_subscribers
+        self._subscribers: Set[Subscription] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._started = False
+
+    async def start(self):
+        if self._started:
+            return
+        self._loop = asyncio.get_running_loop()
+        await self.broker.start(self._deliver)
+        self._started = True
+
+    async def stop(self):
+        """Detener el backend y cerrar los streams abiertos"""
+        if not self._started:
+            return
+        await self.broker.stop()
+        for subscription in list(self._subscribers):
+            subscription.offer(None)
+        self._started = False
+
+    def publish(self, event: Event):
+        """Publicar un evento ya confirmado en la base (no bloquea a los suscriptores)"""
+        metrics.increment("ciberseguria_events_published_total", tipo=event.tipo)
+        try:
+            self.broker.publish(event)
+        except Exception:
+            # Un evento perdido sólo atrasa la vista: no debe fallar la request
+            logger.warning("No se pudo publicar el evento %s", event.tipo, exc_info=True)
+
+    def _deliver(self, event: Event):
+        if self._loop is not None and not self._on_loop():
+            self._loop.call_soon_threadsafe(self._deliver, event)
+            return
+        for subscription in list(self._subscribers):
+            if event.visible_to(subscription.user_id):
+                subscription.offer(event)
+
+    def _on_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    async def subscribe(self, user_id: int) -> Subscription:
+        await self.start()
+        if len(self._subscribers) >= self.max_subscribers:
+            metrics.increment("ciberseguria_event_subscriptions_total", resultado="rechazada")
+            raise TooManySubscribers()
+        subscription = Subscription(user_id)
+        self._subscribers.add(subscription)
+        metrics.increment("ciberseguria_event_subscriptions_total", resultado="abierta")
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+
+def format_sse(event_type: str, data: dict) -> str:
+    """Mensaje SSE (una línea data: con JSON)"""
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def stream(subscription: Subscription, is_disconnected: Callable,
+                 heartbeat: float = EVENTS_HEARTBEAT_SECONDS) -> AsyncIterator[str]:
+    """Mensajes SSE de una suscripción hasta que el cliente se desconecte o el bus se detenga"""
+    # El navegador reintenta a los 5 s si se corta la conexión
+    yield "retry: 5000\n\n"
+    # La espera se retoma tras cada heartbeat (cancelarla podría perder un evento)
+    getter: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if getter is None:
+                getter = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait({getter}, timeout=heartbeat)
+            if not done:
+                if await is_disconnected():
+                    return
+                # Comentario SSE: mantiene viva la conexión a través de proxies
+                yield ": ping\n\n"
+                continue
+
+            event, getter = getter.result(), None
+            if event is None:
+                return
+            if subscription.dropped:
+                yield format_sse("resync", {"perdidos": subscription.dropped})
+                subscription.dropped = 0
+            yield format_sse(event.tipo, {"user_id": event.user_id, **event.data})
+    finally:
+        if getter is not None:
+            getter.cancel()
+
+
+bus = EventBus()
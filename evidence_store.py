@@ -0,0 +1,329 @@
+"""
+Almacenamiento de Evidencias por Contenido (Content-Addressed)
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Los archivos de evidencia se guardan en disco bajo su hash SHA-256:
+<EVIDENCE_DIR>/blobs/ab/cdef... Un mismo archivo subido varias veces se
+almacena una sola vez. Las subidas multipart se procesan por bloques: cada
+bloque se hashea y escribe directo al disco, y el límite de tamaño se aplica
+mientras llegan los datos.
+"""
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional
+
+import multipart
+from multipart.multipart import parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+# Configuración
+EVIDENCE_DIR = os.getenv("EVIDENCE_DIR", "evidence_store")
+EVIDENCE_MAX_BYTES = int(os.getenv("EVIDENCE_MAX_BYTES", str(10 * 1024 * 1024)))  # 10 MB por archivo
+EVIDENCE_MAX_FILES = int(os.getenv("EVIDENCE_MAX_FILES", "10"))
+EVIDENCE_MAX_FIELD_BYTES = 4096
+THUMBNAIL_SIZE = 240
+# Píxeles máximos a decodificar para una miniatura (PNG, GIF o TIFF se decodifican completos)
+THUMBNAIL_MAX_PIXELS = int(os.getenv("THUMBNAIL_MAX_PIXELS", str(16 * 1024 * 1024)))
+
+
+class EvidenceError(Exception):
+    """Error de validación al recibir una evidencia"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class EvidenceTooLarge(EvidenceError):
+    def __init__(self, max_bytes: int):
+        super().__init__(
+            f"El archivo excede el tamaño máximo permitido ({max_bytes // (1024 * 1024)} MB)",
+            status_code=413
+        )
+
+
+@dataclass
+class StoredBlob:
+    """Resultado de almacenar un archivo"""
+    digest: str
+    filename: str
+    content_type: str
+    size: int
+    field_name: str
+
+
+def sanitize_filename(filename: str) -> str:
+    """Nombre de archivo sólo para mostrar: sin rutas y con largo acotado"""
+    name = filename.replace("\\", "/").rsplit("/", 1)[-1].strip()
+    return (name or "archivo")[:255]
+
+
+class BlobWriter:
+    """Escribe un blob a un archivo temporal mientras calcula su hash"""
+
+    def __init__(self, store: "BlobStore", max_bytes: int):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self._tmp_path = tempfile.mkstemp(dir=store.tmp_dir)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise EvidenceTooLarge(self.max_bytes)
+        self._hash.update(data)
+        self._file.write(data)
+
+    def commit(self) -> str:
+        """Mover el temporal a su ruta definitiva (o descartarlo si ya existía)"""
+        self._file.close()
+        digest = self._hash.hexdigest()
+        final_path = self.store.path_for(digest)
+
+        if os.path.exists(final_path):
+            os.remove(self._tmp_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(self._tmp_path, final_path)
+
+        return digest
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class BlobStore:
+    """Almacén de blobs direccionado por SHA-256"""
+
+    def __init__(self, root: str = EVIDENCE_DIR):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.thumb_dir = os.path.join(root, "thumbs")
+        for directory in (self.blob_dir, self.tmp_dir, self.thumb_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, digest: str) -> str:
+        if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+            raise ValueError(f"Digest inválido: {digest!r}")
+        return os.path.join(self.blob_dir, digest[:2], digest[2:])
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path_for(digest))
+
+    def writer(self, max_bytes: Optional[int] = None) -> BlobWriter:
+        return BlobWriter(self, EVIDENCE_MAX_BYTES if max_bytes is None else max_bytes)
+
+    def thumbnail(self, digest: str, size: int = THUMBNAIL_SIZE) -> Optional[str]:
+        """
+        Ruta de una miniatura PNG del blob, generándola una sola vez.
+
+        Retorna None si el blob no es una imagen decodificable o si, aun
+        reducida, supera THUMBNAIL_MAX_PIXELS (el anexo sólo lista el archivo).
+        """
+        thumb_path = os.path.join(self.thumb_dir, f"{digest}_{size}.png")
+        if os.path.exists(thumb_path):
+            return thumb_path
+
+        from PIL import Image as PILImage
+
+        try:
+            with PILImage.open(self.path_for(digest)) as img:
+                # draft() permite a JPEG decodificar a escala reducida
+                img.draft("RGB", (size, size))
+                # open() sólo leyó la cabecera: decidir antes de decodificar
+                width, height = img.size
+                if width * height > THUMBNAIL_MAX_PIXELS:
+                    return None
+                img.thumbnail((size, size))
+                if img.mode not in ("RGB", "RGBA", "L"):
+                    img = img.convert("RGBA")
+                fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, suffix=".png")
+                try:
+                    with os.fdopen(fd, "wb") as fh:
+                        img.save(fh, format="PNG", optimize=True)
+                    os.replace(tmp_path, thumb_path)
+                except Exception:
+                    # Disco lleno o error del codificador: no dejar el temporal
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+        except (OSError, ValueError, PILImage.DecompressionBombError):
+            return None
+
+        return thumb_path
+
+
+_store: Optional[BlobStore] = None
+
+
+def get_store() -> BlobStore:
+    """Almacén por defecto del proceso"""
+    global _store
+    if _store is None:
+        _store = BlobStore()
+    return _store
+
+
+class _StreamingUpload:
+    """Callbacks de python-multipart que envían cada archivo directo al BlobStore"""
+
+    def __init__(self, store: BlobStore, charset: str, max_bytes: int, max_files: int):
+        self.store = store
+        self.charset = charset
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.fields: Dict[str, str] = {}
+        self.blobs: List[StoredBlob] = []
+        self.pending: List[tuple] = []
+        self._writers: List[BlobWriter] = []
+        self._reset_part()
+        self._files = 0
+
+    def _reset_part(self):
+        self._header_name = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._field_name = ""
+        self._filename: Optional[str] = None
+        self._data = b""
+        self._writer: Optional[BlobWriter] = None
+
+    def _decode(self, value: bytes) -> str:
+        try:
+            return value.decode(self.charset)
+        except UnicodeDecodeError:
+            return value.decode("latin-1")
+
+    def on_part_begin(self):
+        self._reset_part()
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if b"name" not in options:
+            raise EvidenceError('El encabezado Content-Disposition debe incluir "name"')
+        self._field_name = self._decode(options[b"name"])
+
+        if b"filename" in options:
+            self._files += 1
+            if self._files > self.max_files:
+                raise EvidenceError(f"Máximo {self.max_files} archivos por solicitud")
+            self._filename = sanitize_filename(self._decode(options[b"filename"]))
+            self._writer = self.store.writer(self.max_bytes)
+            self._writers.append(self._writer)
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        chunk = data[start:end]
+        if self._writer is not None:
+            # Se escribe fuera del callback (en un threadpool) para no bloquear el loop
+            self.pending.append((self._writer, chunk))
+        else:
+            self._data += chunk
+            if len(self._data) > EVIDENCE_MAX_FIELD_BYTES:
+                raise EvidenceError("Campo de formulario demasiado largo")
+
+    def on_part_end(self):
+        if self._writer is None:
+            self.fields[self._field_name] = self._decode(self._data)
+            return
+
+        content_type = self._decode(self._headers.get(b"content-type", b"application/octet-stream"))
+        blob = StoredBlob(
+            digest="",
+            filename=self._filename or "archivo",
+            content_type=content_type.split(";", 1)[0].strip() or "application/octet-stream",
+            size=0,
+            field_name=self._field_name
+        )
+        self.blobs.append(blob)
+        # Marcador de fin de archivo: se confirma tras escribir sus bloques
+        self.pending.append((self._writer, blob))
+
+    def flush(self):
+        """Escribir los bloques pendientes y confirmar los archivos terminados"""
+        pending, self.pending = self.pending, []
+        for writer, item in pending:
+            if isinstance(item, StoredBlob):
+                item.digest = writer.commit()
+                item.size = writer.size
+                self._writers.remove(writer)
+            else:
+                writer.write(item)
+
+    def abort(self):
+        for writer in self._writers:
+            writer.abort()
+        self._writers.clear()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+
+async def receive_multipart(
+    content_type: str,
+    stream: AsyncIterator[bytes],
+    store: Optional[BlobStore] = None,
+    max_bytes: Optional[int] = None,
+    max_files: Optional[int] = None
+):
+    """
+    Procesar un cuerpo multipart/form-data guardando los archivos en el BlobStore.
+
+    Retorna (campos, blobs). Lanza EvidenceError (o EvidenceTooLarge) si la
+    solicitud es inválida; en ese caso se eliminan los temporales.
+    """
+    store = store or get_store()
+    max_bytes = EVIDENCE_MAX_BYTES if max_bytes is None else max_bytes
+    max_files = EVIDENCE_MAX_FILES if max_files is None else max_files
+    ctype, params = parse_options_header(content_type.encode("latin-1"))
+    if ctype != b"multipart/form-data" or b"boundary" not in params:
+        raise EvidenceError("Se esperaba multipart/form-data", status_code=415)
+
+    charset = params.get(b"charset", b"utf-8").decode("latin-1")
+    handler = _StreamingUpload(store, charset, max_bytes, max_files)
+    parser = multipart.MultipartParser(params[b"boundary"], handler.callbacks())
+
+    try:
+        async for chunk in stream:
+            parser.write(chunk)
+            if handler.pending:
+                await run_in_threadpool(handler.flush)
+        parser.finalize()
+        if handler.pending:
+            await run_in_threadpool(handler.flush)
+    except Exception:
+        handler.abort()
+        raise
+
+    if any(not blob.digest for blob in handler.blobs):
+        handler.abort()
+        raise EvidenceError("Carga multipart incompleta")
+
+    return handler.fields, handler.blobs
@@ -0,0 +1,258 @@
+"""
+Exportación Masiva de Assessments (CSV / JSONL / XLSX)
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Genera una fila plana por respuesta (assessment + empresa + pregunta +
+respuesta). Las filas se leen en bloques con yield_per y se escriben en
+bloques, así que la memoria se mantiene constante sin importar el volumen.
+
+Uso desde línea de comandos:
+    python export.py --formato csv --salida export.csv [--desde 2025-01-01]
+                     [--hasta 2025-12-31] [--user-id 3] [--estado Completado]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterator, Optional, Sequence
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import models
+from database import SHARDING_ENABLED, ReadSessionLocal
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+EXPORT_COLUMNS = [
+    "assessment_id", "fecha", "estado", "puntaje_final",
+    "user_id", "nombre_empresa", "rut",
+    "question_id", "dominio", "subdominio", "pregunta", "peso", "referencia_legal",
+    "respuesta", "evidencia_adjunta", "respondido_en",
+]
+
+# Filas por lote leído de la BD y filas por bloque escrito
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+
+
+class ExportError(Exception):
+    """Error de parámetros de exportación"""
+
+
+@dataclass
+class ExportFilters:
+    """Filtros de exportación (todos opcionales)"""
+    desde: Optional[date] = None
+    hasta: Optional[date] = None
+    user_id: Optional[int] = None
+    estado: Optional[str] = None
+
+
+def build_export_query(filters: ExportFilters):
+    """Consulta Core plana: assessments + usuarios + respuestas + preguntas"""
+    stmt = (
+        select(
+            models.Assessment.id,
+            models.Assessment.fecha,
+            models.Assessment.estado,
+            models.Assessment.puntaje_final,
+            models.User.id,
+            models.User.nombre_empresa,
+            models.User.rut,
+            models.Question.id,
+            models.Question.dominio,
+            models.Question.subdominio,
+            models.Question.pregunta,
+            models.Question.peso,
+            models.Question.referencia_legal,
+            models.Answer.respuesta,
+            models.Answer.evidencia_adjunta,
+            # Las respuestas se actualizan en su lugar: vale el último cambio
+            func.coalesce(models.Answer.updated_at, models.Answer.created_at),
+        )
+        .join(models.User, models.User.id == models.Assessment.user_id)
+        .outerjoin(models.Answer, models.Answer.assessment_id == models.Assessment.id)
+        .outerjoin(models.Question, models.Question.id == models.Answer.question_id)
+        .order_by(models.Assessment.id, models.Answer.id)
+    )
+
+    if filters.desde:
+        stmt = stmt.where(models.Assessment.fecha >= datetime.combine(filters.desde, datetime.min.time()))
+    if filters.hasta:
+        stmt = stmt.where(models.Assessment.fecha < datetime.combine(filters.hasta + timedelta(days=1), datetime.min.time()))
+    if filters.user_id is not None:
+        stmt = stmt.where(models.Assessment.user_id == filters.user_id)
+    if filters.estado:
+        stmt = stmt.where(models.Assessment.estado == filters.estado)
+
+    return stmt
+
+
+def _serialize(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="seconds")
+    if isinstance(value, models.RespuestaEnum):
+        return value.value
+    return value
+
+
+def iter_export_rows(db: Session, filters: ExportFilters, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[tuple]:
+    """Iterar filas ya serializadas, leyendo de a `chunk_rows` desde la BD"""
+    stmt = build_export_query(filters).execution_options(yield_per=chunk_rows)
+    for row in db.execute(stmt):
+        yield tuple(_serialize(value) for value in row)
+
+
+def iter_csv(rows: Iterator[tuple], chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM para que Excel detecte UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_COLUMNS)
+
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    yield buffer.getvalue().encode("utf-8")
+
+
+def iter_jsonl(rows: Iterator[tuple], chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False))
+        if len(lines) >= chunk_rows:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def iter_xlsx(rows: Iterator[tuple], read_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    XLSX en modo write_only de openpyxl (las filas se vuelcan a disco a medida
+    que se agregan). El archivo se entrega por bloques desde un temporal.
+    """
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ExportError("La exportación XLSX requiere el paquete openpyxl (pip install openpyxl)")
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Respuestas")
+    sheet.append(EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+
+    with tempfile.TemporaryFile() as tmp:
+        workbook.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(read_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def check_format(fmt: str):
+    """Validar el formato antes de empezar a transmitir la respuesta"""
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"Formato no soportado: {fmt} (use {', '.join(EXPORT_FORMATS)})")
+    if fmt == "xlsx":
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            raise ExportError("La exportación XLSX requiere el paquete openpyxl (pip install openpyxl)")
+
+
+def _iter_sessions_rows(sessions: Sequence[Callable[[], Optional[Session]]], filters: ExportFilters,
+                        chunk_rows: int) -> Iterator[tuple]:
+    """Filas de cada sesión en orden; una fábrica que retorna None no aporta filas"""
+    for make_session in sessions:
+        db = make_session()
+        if db is None:
+            continue
+        try:
+            yield from iter_export_rows(db, filters, chunk_rows)
+        finally:
+            db.close()
+
+
+def stream_export(fmt: str, filters: ExportFilters, chunk_rows: int = EXPORT_CHUNK_ROWS,
+                  sessions: Optional[Sequence[Callable[[], Optional[Session]]]] = None) -> Iterator[bytes]:
+    """
+    Generador de bytes de la exportación completa.
+
+    Abre sus propias sesiones de lectura, ya que se consume después de que el
+    endpoint retorna (y de que se cierren las sesiones de sus dependencias).
+    sessions son las fábricas a recorrer: por defecto la base de lectura; con
+    shards, una por organización.
+    """
+    check_format(fmt)
+    rows = _iter_sessions_rows(sessions or (ReadSessionLocal,), filters, chunk_rows)
+    try:
+        if fmt == "csv":
+            yield from iter_csv(rows, chunk_rows)
+        elif fmt == "jsonl":
+            yield from iter_jsonl(rows, chunk_rows)
+        else:
+            yield from iter_xlsx(rows)
+    finally:
+        rows.close()
+
+
+def export_filename(fmt: str) -> str:
+    return f"export_sgsi_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportar assessments y respuestas")
+    parser.add_argument("--formato", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--salida", help="Archivo de salida (por defecto stdout)")
+    parser.add_argument("--desde", type=date.fromisoformat, help="Fecha inicial (YYYY-MM-DD)")
+    parser.add_argument("--hasta", type=date.fromisoformat, help="Fecha final inclusive (YYYY-MM-DD)")
+    parser.add_argument("--user-id", type=int)
+    parser.add_argument("--estado", choices=["En Progreso", "Completado"])
+    args = parser.parse_args()
+
+    filters = ExportFilters(desde=args.desde, hasta=args.hasta, user_id=args.user_id, estado=args.estado)
+
+    try:
+        sessions = None
+        if SHARDING_ENABLED:
+            import sharding
+            sessions = sharding.tenant_sessions(filters.user_id)
+        chunks = stream_export(args.formato, filters, sessions=sessions)
+        if args.salida:
+            with open(args.salida, "wb") as fh:
+                for chunk in chunks:
+                    fh.write(chunk)
+            print(f"✅ Exportación escrita en {args.salida}", file=sys.stderr)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+    except ExportError as exc:
+        print(f"❌ {exc}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
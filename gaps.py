@@ -0,0 +1,187 @@
+"""
+Consultas de Brechas (Gap Analysis)
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Controles respondidos "No" o "Parcial", ordenados por peso (criticidad), para
+un assessment o para el último diagnóstico de todos los clientes de un
+consultor. Filtros por dominio, banda de prioridad y referencia normativa; el
+orden y el top-N se resuelven en SQL sobre los índices de answers.
+"""
+from dataclasses import dataclass
+from typing import List, Optional
+
+from sqlalchemy import and_, case, exists, func, select
+from sqlalchemy.orm import Session
+
+import catalog
+import models
+from portfolio import BRECHA_RESPUESTAS, latest_completed_id
+
+GAPS_DEFAULT_LIMIT = 10
+GAPS_MAX_LIMIT = 200
+
+# Bandas de prioridad por peso (mismos cortes que el reporte PDF)
+PRIORITY_BANDS = {
+    "alta": (4, None),
+    "media": (2, 3),
+    "baja": (None, 1),
+}
+
+
+class GapQueryError(Exception):
+    """Parámetros de consulta de brechas inválidos"""
+
+
+def prioridad(peso: int) -> str:
+    """Banda de prioridad de un control según su peso"""
+    return "ALTA" if peso >= 4 else "MEDIA" if peso >= 2 else "BAJA"
+
+
+@dataclass
+class GapFilters:
+    dominio: Optional[str] = None
+    prioridad: Optional[str] = None  # alta, media o baja
+    marco: Optional[str] = None  # Código del marco (ISO27001, LEY21663, LEY21096)
+    control: Optional[str] = None  # Prefijo del control (ej. "A.8" o "Art. 4")
+    limit: int = GAPS_DEFAULT_LIMIT
+
+    def validate(self):
+        if self.prioridad is not None and self.prioridad not in PRIORITY_BANDS:
+            raise GapQueryError(f"Prioridad inválida: {self.prioridad} (alta, media o baja)")
+        if self.marco is not None and self.marco not in catalog.FRAMEWORKS:
+            raise GapQueryError(f"Marco inválido: {self.marco} ({', '.join(catalog.FRAMEWORKS)})")
+        if self.control is not None and self.marco is None:
+            raise GapQueryError("El filtro de control requiere indicar el marco")
+        if not 1 <= self.limit <= GAPS_MAX_LIMIT:
+            raise GapQueryError(f"limit debe estar entre 1 y {GAPS_MAX_LIMIT}")
+
+
+@dataclass
+class GapRow:
+    question_id: int
+    dominio: str
+    pregunta: str
+    peso: int
+    respuesta: models.RespuestaEnum
+    referencia_legal: Optional[str]
+
+    def to_dict(self) -> dict:
+        return {
+            "question_id": self.question_id,
+            "dominio": self.dominio,
+            "pregunta": self.pregunta,
+            "peso": self.peso,
+            "prioridad": prioridad(self.peso),
+            "respuesta": self.respuesta.value,
+            "referencia_legal": self.referencia_legal,
+        }
+
+
+@dataclass
+class PortfolioGapRow:
+    question_id: int
+    dominio: str
+    pregunta: str
+    peso: int
+    clientes_no: int
+    clientes_parcial: int
+
+    def to_dict(self) -> dict:
+        return {
+            "question_id": self.question_id,
+            "dominio": self.dominio,
+            "pregunta": self.pregunta,
+            "peso": self.peso,
+            "prioridad": prioridad(self.peso),
+            "clientes_no": self.clientes_no,
+            "clientes_parcial": self.clientes_parcial,
+            "clientes": self.clientes_no + self.clientes_parcial,
+        }
+
+
+def question_filters(filters: GapFilters) -> list:
+    """Condiciones sobre Question según los filtros"""
+    filters.validate()
+    conditions = []
+    if filters.dominio:
+        conditions.append(models.Question.dominio == filters.dominio)
+
+    if filters.prioridad:
+        low, high = PRIORITY_BANDS[filters.prioridad]
+        if low is not None:
+            conditions.append(models.Question.peso >= low)
+        if high is not None:
+            conditions.append(models.Question.peso <= high)
+
+    if filters.marco:
+        mapping = and_(
+            models.ControlMapping.question_id == models.Question.id,
+            models.Framework.id == models.ControlMapping.framework_id,
+            models.Framework.codigo == filters.marco,
+        )
+        if filters.control:
+            mapping = and_(mapping, models.ControlMapping.control_ref.startswith(filters.control, autoescape=True))
+        conditions.append(exists().where(mapping))
+
+    return conditions
+
+
+def top_gaps(db: Session, assessment_id: int, filters: Optional[GapFilters] = None) -> List[GapRow]:
+    """Brechas de un assessment, de mayor a menor peso (orden del catálogo en empates)"""
+    filters = filters or GapFilters()
+    stmt = (
+        select(
+            models.Question.id,
+            models.Question.dominio,
+            models.Question.pregunta,
+            models.Question.peso,
+            models.Answer.respuesta,
+            models.Question.referencia_legal,
+        )
+        .join(models.Question, models.Question.id == models.Answer.question_id)
+        .where(
+            models.Answer.assessment_id == assessment_id,
+            models.Answer.respuesta.in_(BRECHA_RESPUESTAS),
+            *question_filters(filters)
+        )
+        .order_by(
+            models.Question.peso.desc(), models.Question.dominio, models.Question.orden, models.Question.id
+        )
+        .limit(filters.limit)
+    )
+    return [GapRow(*row) for row in db.execute(stmt)]
+
+
+def top_portfolio_gaps(db: Session, consultor_id: int, filters: Optional[GapFilters] = None) -> List[PortfolioGapRow]:
+    """
+    Controles con brechas en el último diagnóstico completado de los clientes
+    del consultor: por peso y luego por cantidad de clientes afectados.
+    """
+    filters = filters or GapFilters()
+    # IN (subconsulta): SQLite materializa primero los assessments del
+    # portafolio y busca sus brechas en ix_answers_assessment_respuesta
+    latest = select(latest_completed_id(models.User.id)).where(models.User.consultor_id == consultor_id)
+    clientes_no = func.sum(case((models.Answer.respuesta == models.RespuestaEnum.NO, 1), else_=0))
+    clientes_parcial = func.sum(case((models.Answer.respuesta == models.RespuestaEnum.PARCIAL, 1), else_=0))
+    afectados = func.count(models.Answer.id)
+
+    stmt = (
+        select(
+            models.Question.id,
+            models.Question.dominio,
+            models.Question.pregunta,
+            models.Question.peso,
+            clientes_no,
+            clientes_parcial,
+        )
+        .join(models.Question, models.Question.id == models.Answer.question_id)
+        .where(
+            models.Answer.assessment_id.in_(latest),
+            models.Answer.respuesta.in_(BRECHA_RESPUESTAS),
+            *question_filters(filters)
+        )
+        .group_by(models.Question.id)
+        .order_by(models.Question.peso.desc(), afectados.desc(), models.Question.id)
+        .limit(filters.limit)
+    )
+    return [PortfolioGapRow(*row) for row in db.execute(stmt)]
@@ -0,0 +1,252 @@
+"""
+Generador de Datos Sintéticos a Gran Escala
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Carga volúmenes de producción (ej. 100k empresas, 1M assessments y decenas de
+millones de respuestas) sobre el catálogo vigente, para probar dashboard,
+portafolio, reportes y exportación a escala. Es reproducible: la misma semilla
+y los mismos parámetros generan exactamente los mismos datos.
+
+Cada empresa tiene un nivel de madurez (distribución Beta) del que salen sus
+respuestas, así que los puntajes se reparten como en clientes reales y mejoran
+levemente entre un diagnóstico y el siguiente.
+
+Ejecutar con (después de python seed.py):
+    python generate_dataset.py --usuarios 100000 --assessments 1000000 --semilla 7
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, List, Sequence, Tuple
+
+from sqlalchemy import func, select
+
+import auth
+import catalog
+import models
+from database import SessionLocal, engine, init_db
+
+DATASET_PASSWORD = "dataset123"  # Password de todas las empresas generadas
+DATASET_MAX_PARAMS = 32000  # Parámetros por INSERT (límite de SQLite >= 3.32: 32766)
+DATASET_COMMIT_USERS = 5000  # Empresas por transacción
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"  # Formato DateTime de SQLAlchemy en SQLite
+
+_SECTORES = ("Logística", "Salud", "Retail", "Minería", "Educación", "Finanzas", "Energía", "Agro", "Software")
+_FORMAS = ("SpA", "Ltda.", "S.A.", "EIRL")
+_EVIDENCIAS = (
+    "Política publicada en intranet",
+    "Respaldo diario verificado mensualmente",
+    "Registro de accesos en SIEM",
+    "Procedimiento aprobado por gerencia",
+    "En implementación con proveedor externo",
+    "Capacitación anual con registro de asistencia",
+)
+
+
+def _rut(numero: int) -> str:
+    """RUT chileno con dígito verificador válido"""
+    total, factor = 0, 2
+    for digit in reversed(str(numero)):
+        total += int(digit) * factor
+        factor = 2 if factor == 7 else factor + 1
+    dv = 11 - total % 11
+    return f"{numero}-{'0' if dv == 11 else 'K' if dv == 10 else dv}"
+
+
+def _respuesta(rng: random.Random, madurez: float) -> str:
+    """Nombre del RespuestaEnum según la madurez (0-1) de la empresa"""
+    r = rng.random()
+    if r < 0.05:
+        return "NA"
+    r = rng.random()
+    if r < madurez * 0.8:
+        return "SI"
+    if r < madurez * 0.8 + 0.25:
+        return "PARCIAL"
+    return "NO"
+
+
+def _chunks(rows: Sequence, size: int) -> Iterator[Sequence]:
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def insert_rows(conn, table, columns: Tuple[str, ...], rows: List[tuple]):
+    """
+    INSERT multi-fila: VALUES (...), (...), ... en lotes bajo el límite de
+    parámetros. En motores sin paramstyle qmark se usa executemany de Core.
+    """
+    if not rows:
+        return
+    if conn.dialect.paramstyle != "qmark":
+        conn.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+        return
+
+    per_batch = max(1, DATASET_MAX_PARAMS // len(columns))
+    placeholder = "(" + ",".join("?" * len(columns)) + ")"
+    head = f"INSERT INTO {table.name} ({','.join(columns)}) VALUES "
+    statements = {}
+    for batch in _chunks(rows, per_batch):
+        sql = statements.get(len(batch))
+        if sql is None:
+            sql = statements[len(batch)] = head + ",".join([placeholder] * len(batch))
+        conn.exec_driver_sql(sql, tuple(value for row in batch for value in row))
+
+
+class DatasetGenerator:
+    """Genera empresas, assessments y respuestas con IDs asignados en Python"""
+
+    USER_COLUMNS = ("id", "nombre_empresa", "rut", "email_contacto", "hashed_password",
+                    "created_at", "es_consultor", "consultor_id", "revision")
+    ASSESSMENT_COLUMNS = ("id", "user_id", "fecha", "puntaje_final", "estado", "catalog_version_id", "revision")
+    ANSWER_COLUMNS = ("id", "assessment_id", "question_id", "respuesta", "evidencia_adjunta", "created_at")
+
+    def __init__(self, usuarios: int, assessments: int, consultores: int, semilla: int, dias: int = 730):
+        self.usuarios = usuarios
+        self.assessments = assessments
+        self.consultores = consultores
+        self.rng = random.Random(semilla)
+        self.dias = dias
+        self.now = datetime(2025, 1, 1)  # Fijo para que la semilla reproduzca fechas
+
+    def _next_ids(self, conn):
+        def start(column):
+            return (conn.execute(select(func.max(column))).scalar() or 0) + 1
+
+        self.user_id = start(models.User.id)
+        self.assessment_id = start(models.Assessment.id)
+        self.answer_id = start(models.Answer.id)
+
+    def _assessment_counts(self) -> List[int]:
+        """Reparte el total de assessments entre empresas (1 por empresa como mínimo si alcanza)"""
+        clientes = self.usuarios - self.consultores
+        counts = [0] * clientes
+        for i in range(min(self.assessments, clientes)):
+            counts[i] = 1
+        for _ in range(self.assessments - min(self.assessments, clientes)):
+            counts[self.rng.randrange(clientes)] += 1
+        return counts
+
+    def run(self, catalog_index: catalog.Catalog):
+        questions = [(q.id, q.peso) for q in catalog_index.questions]
+        hashed_password = auth.get_password_hash(DATASET_PASSWORD)
+        started = time.monotonic()
+
+        with engine.begin() as conn:
+            self._next_ids(conn)
+
+        # Consultores primero: los clientes se asignan a ellos
+        consultor_ids = []
+        with engine.begin() as conn:
+            rows = []
+            for _ in range(self.consultores):
+                uid = self.user_id
+                self.user_id += 1
+                consultor_ids.append(uid)
+                rows.append(self._user_row(uid, hashed_password, es_consultor=True, consultor_id=None))
+            insert_rows(conn, models.User.__table__, self.USER_COLUMNS, rows)
+
+        counts = self._assessment_counts()
+        total_answers = 0
+        for block in _chunks(counts, DATASET_COMMIT_USERS):
+            users, assessments, answers = [], [], []
+            for n_assessments in block:
+                uid = self.user_id
+                self.user_id += 1
+                consultor_id = self.rng.choice(consultor_ids) if consultor_ids and self.rng.random() < 0.6 else None
+                users.append(self._user_row(uid, hashed_password, es_consultor=False, consultor_id=consultor_id))
+                self._user_assessments(uid, n_assessments, catalog_index.version, questions, assessments, answers)
+
+            with engine.begin() as conn:
+                insert_rows(conn, models.User.__table__, self.USER_COLUMNS, users)
+                insert_rows(conn, models.Assessment.__table__, self.ASSESSMENT_COLUMNS, assessments)
+                insert_rows(conn, models.Answer.__table__, self.ANSWER_COLUMNS, answers)
+
+            total_answers += len(answers)
+            elapsed = time.monotonic() - started
+            print(
+                f"  {self.user_id - 1:>9} empresas, {self.assessment_id - 1:>10} assessments, "
+                f"{total_answers:>12} respuestas ({elapsed:.0f}s)",
+                file=sys.stderr
+            )
+
+    def _user_row(self, uid: int, hashed_password: str, es_consultor: bool, consultor_id):
+        rng = self.rng
+        nombre = f"{rng.choice(_SECTORES)} {uid} {rng.choice(_FORMAS)}"
+        if es_consultor:
+            nombre = f"Consultora {uid} {rng.choice(_FORMAS)}"
+        created = self.now - timedelta(days=self.dias + rng.randrange(365), seconds=rng.randrange(86400))
+        return (
+            uid, nombre, _rut(10_000_000 + uid), f"empresa{uid}@dataset.example",
+            hashed_password, created.strftime(DATE_FORMAT), int(es_consultor), consultor_id, 1
+        )
+
+    def _user_assessments(self, uid, n_assessments, version_id, questions, assessments, answers):
+        rng = self.rng
+        madurez = rng.betavariate(2.5, 2.0)
+        fechas = sorted(rng.randrange(self.dias * 86400) for _ in range(n_assessments))
+
+        for position, offset in enumerate(fechas):
+            aid = self.assessment_id
+            self.assessment_id += 1
+            fecha = self.now - timedelta(seconds=self.dias * 86400 - offset)
+            fecha_str = fecha.strftime(DATE_FORMAT)
+
+            # El último diagnóstico puede quedar a medias
+            en_progreso = position == n_assessments - 1 and rng.random() < 0.1
+            respondidas = questions[:rng.randrange(len(questions))] if en_progreso else questions
+
+            total_score = total_weight = 0
+            for question_id, peso in respondidas:
+                respuesta = _respuesta(rng, madurez)
+                evidencia = rng.choice(_EVIDENCIAS) if respuesta != "NO" and rng.random() < 0.3 else None
+                answers.append((self.answer_id, aid, question_id, respuesta, evidencia, fecha_str))
+                self.answer_id += 1
+                if respuesta != "NA":
+                    total_weight += peso
+                    total_score += peso * (100 if respuesta == "SI" else 50 if respuesta == "PARCIAL" else 0)
+
+            puntaje = round(total_score / total_weight, 1) if total_weight and not en_progreso else 0.0
+            assessments.append((
+                aid, uid, fecha_str, puntaje, "En Progreso" if en_progreso else "Completado", version_id, 1
+            ))
+
+            # Cada diagnóstico siguiente refleja algo de mejora
+            madurez = min(1.0, madurez + rng.uniform(0, 0.08))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generar datos sintéticos a gran escala")
+    parser.add_argument("--usuarios", type=int, default=1000, help="Empresas a crear (incluye consultores)")
+    parser.add_argument("--assessments", type=int, default=3000, help="Assessments a crear en total")
+    parser.add_argument("--consultores", type=int, default=None, help="Consultores (por defecto 1%% de usuarios)")
+    parser.add_argument("--semilla", type=int, default=42, help="Semilla para reproducir el mismo dataset")
+    parser.add_argument("--dias", type=int, default=730, help="Ventana de fechas de los assessments")
+    args = parser.parse_args()
+
+    consultores = args.consultores if args.consultores is not None else max(1, args.usuarios // 100)
+    if consultores >= args.usuarios:
+        parser.error("--consultores debe ser menor que --usuarios")
+
+    init_db()
+    db = SessionLocal()
+    try:
+        catalog_index = catalog.get_catalog(db)
+    except catalog.CatalogError as exc:
+        parser.error(str(exc))
+    finally:
+        db.close()
+
+    print(
+        f"Generando {args.usuarios} empresas ({consultores} consultores) y {args.assessments} assessments "
+        f"sobre el catálogo '{catalog_index.etiqueta}' ({len(catalog_index)} preguntas)...",
+        file=sys.stderr
+    )
+    DatasetGenerator(args.usuarios, args.assessments, consultores, args.semilla, args.dias).run(catalog_index)
+    print("✅ Dataset generado", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+ETags y GET Condicional
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Las vistas derivan un ETag fuerte de los contadores de revisión de los modelos
+(User.revision, Assessment.revision) y responden 304 antes de renderizar
+templates o construir PDFs si el cliente ya tiene la versión vigente.
+"""
+import hashlib
+import os
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+# Cambia con cada despliegue de templates o del generador de PDF, para que un
+# cambio de presentación no se oculte detrás de un 304
+_DEPLOY_FILES = ("templates", "pdf_generator.py")
+
+# Los navegadores guardan la respuesta pero revalidan en cada uso
+CACHE_CONTROL = "private, no-cache"
+
+
+def _deploy_stamp() -> str:
+    latest = 0.0
+    for path in _DEPLOY_FILES:
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                latest = max(latest, os.path.getmtime(os.path.join(path, name)))
+        elif os.path.exists(path):
+            latest = max(latest, os.path.getmtime(path))
+    return str(int(latest))
+
+
+ETAG_SALT = os.getenv("ETAG_SALT") or _deploy_stamp()
+
+
+def make_etag(*parts) -> str:
+    """ETag fuerte (entre comillas) a partir de las partes que determinan la respuesta"""
+    raw = ":".join(str(part) for part in (ETAG_SALT,) + parts)
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Comparar If-None-Match con el ETag actual (comparación débil, RFC 9110)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Respuesta 304 si el cliente ya tiene esta versión; None en caso contrario"""
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=cache_headers(etag))
+    return None
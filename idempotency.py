@@ -0,0 +1,141 @@
+"""
+Envíos Idempotentes del Cuestionario
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+El formulario del cuestionario lleva una clave de idempotencia generada al
+renderizar la página. Un doble click o un reintento del proxy reenvía la misma
+clave con el mismo contenido: en vez de volver a guardar respuestas y calcular
+el puntaje, se entrega el resultado del primer envío.
+
+- Dentro del proceso, un almacén en memoria (TTL + LRU) guarda el resultado de
+  las claves recientes y hace que los duplicados que llegan mientras el primero
+  aún se procesa esperen ese mismo resultado.
+- Entre procesos, Assessment.submit_key guarda la clave del último envío
+  aplicado, de modo que un duplicado atendido por otro worker tampoco escribe.
+
+Si se reenvía la misma clave con respuestas distintas (ej. volver atrás en el
+navegador y corregir), el contenido cambia la clave y se procesa como un envío
+nuevo.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import metrics
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "600"))  # Segundos que se recuerda un resultado
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+IDEMPOTENCY_FIELD = "idempotency_key"
+
+metrics.describe("ciberseguria_submit_replayed_total", "Envíos duplicados respondidos con el resultado anterior")
+metrics.describe("ciberseguria_submit_conflicts_total", "Envíos descartados por bloqueo optimista (revision cambió)")
+
+
+class SubmissionConflict(Exception):
+    """Otro envío cambió la revisión del assessment antes del guardado final"""
+
+
+def new_key() -> str:
+    """Clave para el formulario de un cuestionario recién renderizado"""
+    return uuid.uuid4().hex
+
+
+def request_key(user_id: int, assessment_id: int, form_data) -> Optional[str]:
+    """
+    Clave efectiva del envío: clave del formulario + digest de su contenido.
+
+    Retorna None si el formulario no trae clave (clientes antiguos o API).
+    """
+    client_key = form_data.get(IDEMPOTENCY_FIELD)
+    if not client_key:
+        return None
+
+    digest = hashlib.sha256(f"{user_id}:{assessment_id}:{client_key}".encode())
+    for name, value in sorted(form_data.multi_items()):
+        if name != IDEMPOTENCY_FIELD and isinstance(value, str):
+            digest.update(f"\x00{name}\x01{value}".encode())
+    return digest.hexdigest()[:40]
+
+
+class IdempotencyStore:
+    """Resultados recientes por clave, con espera de los envíos en curso"""
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_keys: int = IDEMPOTENCY_MAX_KEYS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._clock = clock
+        self._results: "OrderedDict[str, tuple]" = OrderedDict()  # clave -> (resultado, expira)
+        self._pending = {}  # clave -> asyncio.Future del envío en curso
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Resultado guardado y vigente de la clave, o None"""
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is None:
+                return None
+            result, expires = entry
+            if expires < self._clock():
+                del self._results[key]
+                return None
+            self._results.move_to_end(key)
+            return result
+
+    def put(self, key: str, result):
+        with self._lock:
+            self._results[key] = (result, self._clock() + self.ttl)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_keys:
+                self._results.popitem(last=False)
+
+    async def execute(self, key: str, operation: Callable[[], Awaitable]):
+        """
+        Ejecutar operation una sola vez por clave.
+
+        Los duplicados reciben el resultado guardado o esperan el del envío en
+        curso. Los errores no se guardan: un reintento posterior vuelve a
+        ejecutar la operación.
+        """
+        result = self.get(key)
+        if result is not None:
+            metrics.increment("ciberseguria_submit_replayed_total", source="memory")
+            return result
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            metrics.increment("ciberseguria_submit_replayed_total", source="in_flight")
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            result = await operation()
+        except Exception as exc:
+            future.set_exception(exc)
+            # Evitar el aviso de excepción no consultada si nadie esperaba
+            future.exception()
+            raise
+        else:
+            self.put(key, result)
+            future.set_result(result)
+            return result
+        finally:
+            self._pending.pop(key, None)
+            if not future.done():
+                future.cancel()
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def __len__(self):
+        return len(self._results)
+
+
+store = IdempotencyStore()
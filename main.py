@@ -2,36 +2,148 @@
 Aplicación Principal FastAPI
 CiberSegurIA - Diagnóstico SGSI Express MVP
 """
+from startup import timer as startup_timer
+
 from fastapi import FastAPI, Request, Depends, HTTPException, Form, status
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
+from fastapi.responses import (
+    HTMLResponse, RedirectResponse, FileResponse, PlainTextResponse, JSONResponse, StreamingResponse
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from typing import Optional
-from datetime import timedelta
+from typing import Optional, Tuple
+from datetime import date, datetime, timedelta
+from contextlib import asynccontextmanager
+import os
+import threading
+from urllib.parse import urlencode
+
+import jinja2
 
 import models
+import answer_sync
 import auth
-from database import engine, get_db
-from pdf_generator import generate_assessment_report
+import catalog
+import events
+import evidence_store
+import export
+import gaps
+import http_cache
+import idempotency
+import metrics
+import portfolio
+import profiling
+import rate_limit
+import records
+import revocation
+import search
+import sharding
+import tracing
+import write_queue
+from database import SHARDING_ENABLED, SessionLocal, engine, get_db, get_read_db, init_db, mark_recent_write, read_engine
+
+# pdf_generator (y con él reportlab) se importa bajo demanda o en el warmup
+# en segundo plano, no durante el arranque del worker
+startup_timer.mark("imports")
+
+# Entorno: en producción se desactiva la recarga automática de templates
+APP_ENV = os.getenv("APP_ENV", "development")
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", ".jinja_cache")
+WARMUP_IN_BACKGROUND = os.getenv("WARMUP_IN_BACKGROUND", "1") != "0"
+
+
+def _warmup():
+    """Importar módulos pesados y compilar templates antes del primer request"""
+    with startup_timer.phase("warmup_pdf"):
+        import pdf_generator
+        pdf_generator.get_report_styles()
+        pdf_generator.get_logo_reader()
+
+    with startup_timer.phase("warmup_templates"):
+        for name in templates.env.list_templates(extensions=["html"]):
+            templates.env.get_template(name)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Inicialización por worker: esquema (si el lanzador no lo hizo) y cachés"""
+    # serve.py crea las tablas una sola vez antes de levantar los workers
+    if os.getenv("CIBERSEGURIA_SCHEMA_READY") != "1":
+        with startup_timer.phase("schema"):
+            init_db()
+
+    # Precalentar cachés del proceso
+    with startup_timer.phase("catalog"):
+        catalog.warm()
+
+    if WARMUP_IN_BACKGROUND:
+        threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+    else:
+        _warmup()
+
+    if write_queue.WRITE_QUEUE_ENABLED:
+        write_queue.writer.start()
+
+    await events.bus.start()
+
+    # Total hasta aceptar requests (incluye esquema y catálogo, ya medidos como fases)
+    startup_timer.total("startup")
+    startup_timer.log_report()
+
+    yield
+
+    # Cerrar los streams de eventos abiertos
+    await events.bus.stop()
+
+    # Confirmar las escrituras encoladas antes de terminar el worker
+    await write_queue.writer.stop()
 
-# Crear tablas en la base de datos
-models.Base.metadata.create_all(bind=engine)
 
 # Inicializar FastAPI
 app = FastAPI(
     title="CiberSegurIA - Diagnóstico SGSI Express",
     description="Plataforma de diagnóstico de cumplimiento Ley 21.663",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Middleware de sesiones (necesario para cookies)
 app.add_middleware(SessionMiddleware, secret_key="ciberseguria-session-secret-changeme")
 
+# Perfilado bajo demanda con token firmado (PROFILE_SECRET)
+app.add_middleware(profiling.ProfilingMiddleware)
+
+# Trazas por request (la más externa: mide también las sesiones)
+app.add_middleware(tracing.TracingMiddleware)
+tracing.instrument_engine(engine, "primary")
+if read_engine is not engine:
+    tracing.instrument_engine(read_engine, "replica")
+
 # Archivos estáticos y templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+templates = Jinja2Templates(
+    directory="templates",
+    auto_reload=APP_ENV != "production",
+    bytecode_cache=jinja2.FileSystemBytecodeCache(JINJA_CACHE_DIR)
+)
+tracing.instrument_templates(templates)
+startup_timer.mark("app_setup")
+
+
+RATE_LIMIT_MESSAGE = "Demasiados intentos. Espere unos minutos e intente nuevamente."
+
+
+def rate_limited_response(template: str, context: dict, retry_after: float):
+    """Respuesta 429 para solicitudes rechazadas por el limitador de tasa"""
+    return templates.TemplateResponse(
+        template,
+        context,
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+    )
 
 
 # ============================================================================
@@ -58,6 +170,13 @@ async def login(
     db: Session = Depends(get_db)
 ):
     """Procesar login"""
+    # Limitar intentos antes de verificar el hash
+    retry_after = rate_limit.login_limiter.check(request.client and request.client.host, rut)
+    if retry_after:
+        return rate_limited_response(
+            "login.html", {"request": request, "error": RATE_LIMIT_MESSAGE}, retry_after
+        )
+
     # Autenticar usuario
     user = auth.authenticate_user(db, rut, password)
 
@@ -90,6 +209,13 @@ async def register(
     db: Session = Depends(get_db)
 ):
     """Procesar registro de nueva empresa"""
+    # Limitar intentos antes de cualquier consulta o hash
+    retry_after = rate_limit.register_limiter.check(request.client and request.client.host, rut)
+    if retry_after:
+        return rate_limited_response(
+            "register.html", {"request": request, "errors": [RATE_LIMIT_MESSAGE]}, retry_after
+        )
+
     # Validaciones
     errors = []
 
@@ -112,30 +238,40 @@ async def register(
             {"request": request, "errors": errors}
         )
 
-    # Crear nuevo usuario
+    # Crear nuevo usuario (el hash se calcula fuera del escritor)
     hashed_password = auth.get_password_hash(password)
+    user_id = await write_queue.run(
+        db, lambda session: _insert_user(session, nombre_empresa, rut, email_contacto, hashed_password)
+    )
+    mark_recent_write(request)
+
+    # Auto-login
+    request.session["user_id"] = user_id
+
+    return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
+
+
+def _insert_user(db: Session, nombre_empresa: str, rut: str, email_contacto: str, hashed_password: str) -> int:
+    """Crear la empresa; retorna su id"""
     new_user = models.User(
         nombre_empresa=nombre_empresa,
         rut=rut,
         email_contacto=email_contacto,
         hashed_password=hashed_password
     )
-
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-
-    # Auto-login
-    request.session["user_id"] = new_user.id
-
-    return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
+    db.flush()
+    return new_user.id
 
 
 @app.get("/logout")
 async def logout(request: Request):
     """Cerrar sesión"""
     request.session.clear()
-    return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
+    # Borrar el cuestionario guardado por el service worker en este navegador
+    return RedirectResponse(
+        url="/login", status_code=status.HTTP_303_SEE_OTHER, headers={"Clear-Site-Data": '"cache"'}
+    )
 
 
 # ============================================================================
@@ -146,13 +282,20 @@ async def logout(request: Request):
 async def dashboard(
     request: Request,
     current_user: models.User = Depends(auth.get_current_user_from_session),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Dashboard principal - Mostrar diagnósticos anteriores"""
-    # Obtener assessments del usuario
-    assessments = db.query(models.Assessment).filter(
-        models.Assessment.user_id == current_user.id
-    ).order_by(models.Assessment.fecha.desc()).all()
+    # Revisión del usuario (rol, menú) y de sus assessments, leída donde viven
+    # (con shards, el archivo de la organización: los envíos no escriben en users)
+    etag = http_cache.make_etag(
+        "dashboard", current_user.id, current_user.revision, *records.assessments_version(db, current_user.id)
+    )
+    cached = http_cache.not_modified(request, etag)
+    if cached:
+        return cached
+
+    # Obtener assessments del usuario (registros de sólo lectura)
+    assessments = records.list_assessments(db, current_user.id)
 
     return templates.TemplateResponse(
         "dashboard.html",
@@ -160,7 +303,8 @@ async def dashboard(
             "request": request,
             "user": current_user,
             "assessments": assessments
-        }
+        },
+        headers=http_cache.cache_headers(etag)
     )
 
 
@@ -171,34 +315,49 @@ async def new_assessment(
     db: Session = Depends(get_db)
 ):
     """Crear un nuevo assessment y redirigir al cuestionario"""
-    # Crear nuevo assessment
-    new_assessment = models.Assessment(
-        user_id=current_user.id,
-        estado="En Progreso"
+    try:
+        current_catalog = catalog.get_catalog(db)
+    except catalog.CatalogError as exc:
+        raise HTTPException(status_code=503, detail=str(exc))
+
+    # Crear nuevo assessment (asociado a la versión vigente del catálogo)
+    user_id = current_user.id
+    assessment_id = await write_queue.run(
+        db, lambda session: _insert_assessment(session, user_id, current_catalog.version)
     )
-    db.add(new_assessment)
-    db.commit()
-    db.refresh(new_assessment)
+    mark_recent_write(request)
 
     return RedirectResponse(
-        url=f"/assessment/{new_assessment.id}",
+        url=f"/assessment/{assessment_id}",
         status_code=status.HTTP_303_SEE_OTHER
     )
 
 
+def _insert_assessment(db: Session, user_id: int, catalog_version: int) -> int:
+    """Crear un assessment en progreso; retorna su id"""
+    new_assessment = models.Assessment(
+        user_id=user_id,
+        estado="En Progreso",
+        catalog_version_id=catalog_version
+    )
+    if SHARDING_ENABLED:
+        # El id lleva la organización (enrutamiento de /assessment/{id})
+        new_assessment.id = sharding.assessment_id_for(db, user_id)
+    db.add(new_assessment)
+    db.flush()
+    return new_assessment.id
+
+
 @app.get("/assessment/{assessment_id}", response_class=HTMLResponse)
 async def assessment_questions(
     request: Request,
     assessment_id: int,
     current_user: models.User = Depends(auth.get_current_user_from_session),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Mostrar cuestionario de assessment"""
-    # Verificar que el assessment pertenece al usuario
-    assessment = db.query(models.Assessment).filter(
-        models.Assessment.id == assessment_id,
-        models.Assessment.user_id == current_user.id
-    ).first()
+    # Verificar que el assessment pertenece al usuario (sin cargar entidades ORM)
+    assessment = records.get_assessment(db, assessment_id, user_id=current_user.id)
 
     if not assessment:
         raise HTTPException(status_code=404, detail="Assessment no encontrado")
@@ -210,26 +369,31 @@ async def assessment_questions(
             status_code=status.HTTP_303_SEE_OTHER
         )
 
-    # Obtener todas las preguntas ordenadas
-    questions = db.query(models.Question).order_by(
-        models.Question.dominio,
-        models.Question.orden
-    ).all()
-
-    # Agrupar preguntas por dominio
-    questions_by_domain = {}
-    for q in questions:
-        if q.dominio not in questions_by_domain:
-            questions_by_domain[q.dominio] = []
-        questions_by_domain[q.dominio].append(q)
-
-    # Obtener respuestas existentes (si las hay)
-    existing_answers = {}
-    for answer in assessment.answers:
-        existing_answers[answer.question_id] = {
-            'respuesta': answer.respuesta.value,
-            'evidencia': answer.evidencia_adjunta or ''
-        }
+    # Índice de la versión del catálogo del assessment; sólo la primera
+    # sección se renderiza aquí
+    current_catalog = catalog.get_assessment_catalog(db, assessment)
+
+    # Respuestas existentes (sólo las columnas necesarias)
+    existing_answers = {
+        answer.question_id: {'respuesta': answer.respuesta.value, 'evidencia': answer.evidencia_adjunta or ''}
+        for answer in records.get_answers(db, assessment_id)
+    }
+
+    # Progreso por dominio con un conteo agrupado en SQL
+    answered_by_domain = dict(
+        db.query(models.Question.dominio, func.count(models.Answer.id))
+        .join(models.Answer, models.Answer.question_id == models.Question.id)
+        .filter(models.Answer.assessment_id == assessment_id)
+        .group_by(models.Question.dominio)
+    )
+    answered_total = sum(answered_by_domain.values())
+
+    # Archivos de evidencia ya adjuntos, por pregunta
+    attachments_by_question = {}
+    for attachment in records.get_attachments(db, assessment_id):
+        attachments_by_question.setdefault(attachment.question_id, []).append(
+            _attachment_json(assessment_id, attachment)
+        )
 
     return templates.TemplateResponse(
         "assessment.html",
@@ -237,13 +401,64 @@ async def assessment_questions(
             "request": request,
             "user": current_user,
             "assessment": assessment,
-            "questions_by_domain": questions_by_domain,
+            "domains": current_catalog.domains,
+            "questions_by_domain": current_catalog.by_domain,
             "existing_answers": existing_answers,
-            "RespuestaEnum": models.RespuestaEnum
+            "answered_by_domain": answered_by_domain,
+            "progress": round(answered_total * 100 / len(current_catalog), 1) if len(current_catalog) else 0,
+            # Un doble click o reintento reenvía la misma clave
+            "idempotency_key": idempotency.new_key(),
+            # Estado que el navegador aplica a las secciones cargadas después
+            "client_state": {
+                "assessment_id": assessment.id,
+                "revision": assessment.revision,
+                "catalog_version": current_catalog.version,
+                "total": len(current_catalog),
+                "domains": [[q.id for q in current_catalog.by_domain[d]] for d in current_catalog.domains],
+                "answers": existing_answers,
+                "attachments": attachments_by_question,
+            },
         }
     )
 
 
+# Fragmentos HTML por (versión de catálogo, dominio): no dependen del assessment
+_domain_fragments = {}
+
+
+@app.get("/assessment/catalog/{version}/domain/{domain_index}", response_class=HTMLResponse)
+async def assessment_domain_fragment(
+    request: Request,
+    version: int,
+    domain_index: int,
+    current_user: models.User = Depends(auth.get_current_user_from_session),
+    db: Session = Depends(get_read_db)
+):
+    """Sección del cuestionario para un dominio (sin estado; se cachea por versión)"""
+    try:
+        version_catalog = catalog.get_catalog(db, version)
+    except catalog.CatalogError:
+        raise HTTPException(status_code=404, detail="Sección no encontrada")
+    if not 0 <= domain_index < len(version_catalog.domains):
+        raise HTTPException(status_code=404, detail="Sección no encontrada")
+
+    key = (version, domain_index)
+    html = _domain_fragments.get(key)
+    if html is None:
+        dominio = version_catalog.domains[domain_index]
+        html = templates.get_template("_domain_section.html").render(
+            dominio=dominio,
+            domain_index=domain_index,
+            questions=version_catalog.by_domain[dominio],
+            existing_answers=None
+        )
+        # Las versiones son inmutables: el fragmento es válido indefinidamente
+        _domain_fragments[key] = html
+
+    # La URL incluye la versión: el contenido nunca cambia para esa URL
+    return HTMLResponse(html, headers={"Cache-Control": "private, max-age=31536000, immutable"})
+
+
 @app.post("/assessment/{assessment_id}/submit")
 async def submit_assessment(
     request: Request,
@@ -252,23 +467,110 @@ async def submit_assessment(
     db: Session = Depends(get_db)
 ):
     """Procesar y guardar respuestas del cuestionario"""
+    # Devolver la conexión al pool antes de esperar (formulario, envío duplicado
+    # en curso o escritor): la sesión se vuelve a abrir sólo si se usa
+    user_id = current_user.id
+    db.close()
+
+    # Obtener datos del formulario
+    form_data = await request.form()
+
+    # Doble click o reintento: misma clave y contenido -> mismo resultado, sin escribir
+    submit_key = idempotency.request_key(user_id, assessment_id, form_data)
+    if submit_key is None:
+        url = await _apply_submission(db, current_user, assessment_id, form_data, None)
+    else:
+        url = await idempotency.store.execute(
+            submit_key,
+            lambda: _apply_submission(db, current_user, assessment_id, form_data, submit_key)
+        )
+
+    mark_recent_write(request)
+
+    # Redirigir a página de éxito/reporte
+    return RedirectResponse(url=url, status_code=status.HTTP_303_SEE_OTHER)
+
+
+async def _apply_submission(
+    db: Session,
+    current_user: models.User,
+    assessment_id: int,
+    form_data,
+    submit_key: Optional[str]
+) -> str:
+    """Guardar respuestas y puntaje (en la cola de escritura si está activa); retorna la URL del reporte"""
+    user_id = current_user.id
+    try:
+        report_url, event = await write_queue.run(
+            db, lambda session: _save_submission(session, user_id, assessment_id, form_data, submit_key)
+        )
+    except idempotency.SubmissionConflict:
+        # Otro envío se aplicó entretanto: este se descartó
+        metrics.increment("ciberseguria_submit_conflicts_total")
+        applied_key = db.query(models.Assessment.submit_key).filter(
+            models.Assessment.id == assessment_id
+        ).scalar()
+        if submit_key is not None and applied_key == submit_key:
+            return f"/assessment/report/{assessment_id}"
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="El diagnóstico fue modificado por otro envío. Recargue la página e intente nuevamente."
+        )
+
+    # Ya confirmado: avisar al cliente y a su consultor
+    if event is not None:
+        events.bus.publish(event)
+    return report_url
+
+
+def _save_submission(
+    db: Session,
+    user_id: int,
+    assessment_id: int,
+    form_data,
+    submit_key: Optional[str]
+) -> Tuple[str, Optional[events.Event]]:
+    """Escribir respuestas y puntaje (sin commit); retorna la URL del reporte y el evento a publicar"""
+    report_url = f"/assessment/report/{assessment_id}"
+
     # Verificar que el assessment pertenece al usuario
     assessment = db.query(models.Assessment).filter(
         models.Assessment.id == assessment_id,
-        models.Assessment.user_id == current_user.id
+        models.Assessment.user_id == user_id
     ).first()
 
     if not assessment:
         raise HTTPException(status_code=404, detail="Assessment no encontrado")
 
-    # Obtener datos del formulario
-    form_data = await request.form()
-
-    # Obtener todas las preguntas
-    questions = db.query(models.Question).all()
-
-    # Borrar respuestas anteriores (si existen)
-    db.query(models.Answer).filter(models.Answer.assessment_id == assessment_id).delete()
+    # Envío duplicado ya aplicado (posiblemente por otro worker)
+    if submit_key is not None and assessment.submit_key == submit_key:
+        metrics.increment("ciberseguria_submit_replayed_total", source="database")
+        return report_url, None
+
+    # Envío compacto: la página sincronizó sus respuestas hasta sync_revision;
+    # si el diagnóstico cambió después (otro equipo o pestaña), debe recargar
+    sync_revision = form_data.get("sync_revision")
+    if sync_revision is not None:
+        try:
+            sync_revision = int(sync_revision)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="sync_revision inválida")
+        if sync_revision != assessment.revision:
+            raise idempotency.SubmissionConflict(assessment_id)
+
+    # Versión leída: el guardado final sólo procede si nadie la cambió entretanto
+    expected_revision = assessment.revision
+    previous_estado, previous_puntaje = assessment.estado, assessment.puntaje_final
+
+    # Preguntas y pesos de la versión del catálogo del assessment
+    questions = catalog.get_assessment_catalog(db, assessment).questions
+
+    # Respuestas guardadas: las preguntas de secciones que no se cargaron en el
+    # navegador no vienen en el formulario y conservan su respuesta anterior
+    existing = {
+        answer.question_id: answer
+        for answer in db.query(models.Answer).filter(models.Answer.assessment_id == assessment_id)
+    }
 
     # Procesar respuestas
     total_weight = 0
@@ -279,23 +581,24 @@ async def submit_assessment(
         evidencia_key = f"evidencia_{question.id}"
 
         respuesta_value = form_data.get(respuesta_key)
-        evidencia_value = form_data.get(evidencia_key, "")
-
-        if not respuesta_value:
+        answer = existing.get(question.id)
+
+        if respuesta_value:
+            # Convertir respuesta a enum
+            respuesta_enum = models.RespuestaEnum(respuesta_value)
+            evidencia_value = form_data.get(evidencia_key, "")
+
+            if answer is None:
+                answer = models.Answer(assessment_id=assessment_id, question_id=question.id)
+                db.add(answer)
+            answer.respuesta = respuesta_enum
+            answer.evidencia_adjunta = evidencia_value if evidencia_value else None
+            answer.updated_at = datetime.utcnow()
+        elif answer is not None:
+            respuesta_enum = answer.respuesta
+        else:
             continue
 
-        # Convertir respuesta a enum
-        respuesta_enum = models.RespuestaEnum(respuesta_value)
-
-        # Crear answer
-        answer = models.Answer(
-            assessment_id=assessment_id,
-            question_id=question.id,
-            respuesta=respuesta_enum,
-            evidencia_adjunta=evidencia_value if evidencia_value else None
-        )
-        db.add(answer)
-
         # Calcular puntaje
         if respuesta_enum != models.RespuestaEnum.NA:
             total_weight += question.peso
@@ -311,28 +614,101 @@ async def submit_assessment(
     else:
         puntaje_final = 0
 
-    # Actualizar assessment
-    assessment.puntaje_final = round(puntaje_final, 1)
-    assessment.estado = "Completado"
+    # Actualizar assessment con bloqueo optimista sobre revision
+    updated = db.query(models.Assessment).filter(
+        models.Assessment.id == assessment_id,
+        models.Assessment.revision == expected_revision
+    ).update({
+        models.Assessment.puntaje_final: round(puntaje_final, 1),
+        models.Assessment.estado: "Completado",
+        models.Assessment.revision: expected_revision + 1,
+        models.Assessment.submit_key: submit_key,
+    }, synchronize_session=False)
+
+    if not updated:
+        # Se revierte lo escrito por este envío (rollback o SAVEPOINT del lote)
+        raise idempotency.SubmissionConflict(assessment_id)
+
+    # Sólo lectura de users: con shards, escribir ahí tomaría el lock de la base principal
+    user = db.get(models.User, user_id)
+
+    puntaje = round(puntaje_final, 1)
+    if previous_estado != "Completado":
+        tipo = "assessment.completed"
+    elif previous_puntaje != puntaje:
+        tipo = "assessment.score_changed"
+    else:
+        return report_url, None
+    return report_url, events.Event(tipo, user_id, user.consultor_id, {
+        "assessment_id": assessment_id,
+        "empresa": user.nombre_empresa,
+        "puntaje": puntaje,
+        "puntaje_anterior": previous_puntaje if previous_estado == "Completado" else None,
+        "url": report_url,
+    })
+
+
+@app.post("/api/assessment/{assessment_id}/answers")
+async def sync_answers(
+    request: Request,
+    assessment_id: int,
+    current_user: models.User = Depends(auth.get_current_user_from_session),
+    db: Session = Depends(get_db)
+):
+    """Cambios de respuestas de la cola local del navegador (lote con hora por cambio)"""
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON inválido")
+
+    user_id = current_user.id
+    try:
+        deltas = answer_sync.parse_deltas(payload)
+        result = await write_queue.run(
+            db, lambda session: answer_sync.apply_deltas(session, user_id, assessment_id, deltas)
+        )
+    except answer_sync.AnswerSyncError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except answer_sync.AssessmentCompleted:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="El diagnóstico ya fue enviado")
 
-    db.commit()
+    if result is None:
+        raise HTTPException(status_code=404, detail="Assessment no encontrado")
+    if result.applied:
+        mark_recent_write(request)
+    return result.to_dict()
 
-    # Redirigir a página de éxito/reporte
-    return RedirectResponse(
-        url=f"/assessment/report/{assessment_id}",
-        status_code=status.HTTP_303_SEE_OTHER
+
+@app.get("/sw.js", include_in_schema=False)
+async def service_worker():
+    """Service worker del cuestionario (servido en la raíz para controlar /assessment/)"""
+    return FileResponse(
+        "static/sw.js", media_type="application/javascript", headers={"Cache-Control": "no-cache"}
     )
 
 
-@app.get("/assessment/report/{assessment_id}", response_class=HTMLResponse)
-async def view_report(
+def _attachment_json(assessment_id: int, attachment: models.EvidenceAttachment) -> dict:
+    return {
+        "id": attachment.id,
+        "question_id": attachment.question_id,
+        "filename": attachment.filename,
+        "content_type": attachment.content_type,
+        "size_bytes": attachment.size_bytes,
+        "digest": attachment.digest,
+        "url": f"/assessment/{assessment_id}/evidence/file/{attachment.id}"
+    }
+
+
+@app.post("/assessment/{assessment_id}/evidence/{question_id}")
+async def upload_evidence(
     request: Request,
     assessment_id: int,
+    question_id: int,
     current_user: models.User = Depends(auth.get_current_user_from_session),
     db: Session = Depends(get_db)
 ):
-    """Ver página de reporte con opción de descargar PDF"""
-    # Verificar que el assessment pertenece al usuario
+    """Subir archivos de evidencia para una pregunta (multipart, procesado por bloques)"""
+    # Verificar que el assessment pertenece al usuario y sigue abierto
     assessment = db.query(models.Assessment).filter(
         models.Assessment.id == assessment_id,
         models.Assessment.user_id == current_user.id
@@ -341,40 +717,629 @@ async def view_report(
     if not assessment:
         raise HTTPException(status_code=404, detail="Assessment no encontrado")
 
+    if assessment.estado == "Completado":
+        raise HTTPException(status_code=409, detail="El assessment ya fue completado")
+
+    if question_id not in catalog.get_assessment_catalog(db, assessment).by_id:
+        raise HTTPException(status_code=404, detail="Pregunta no encontrada")
+
+    # Rechazar de inmediato cuerpos que superan el máximo posible
+    content_length = request.headers.get("content-length")
+    max_body = evidence_store.EVIDENCE_MAX_FILES * (evidence_store.EVIDENCE_MAX_BYTES + 64 * 1024)
+    if content_length and content_length.isdigit() and int(content_length) > max_body:
+        raise HTTPException(status_code=413, detail="Solicitud demasiado grande")
+
+    try:
+        _, blobs = await evidence_store.receive_multipart(
+            request.headers.get("content-type", ""),
+            request.stream()
+        )
+    except evidence_store.EvidenceError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.message)
+
+    attachments = []
+    for blob in blobs:
+        attachment = models.EvidenceAttachment(
+            assessment_id=assessment_id,
+            question_id=question_id,
+            digest=blob.digest,
+            filename=blob.filename,
+            content_type=blob.content_type,
+            size_bytes=blob.size
+        )
+        db.add(attachment)
+        attachments.append(attachment)
+
+    assessment.bump_revision()
+    db.commit()
+    mark_recent_write(request)
+
+    return JSONResponse(
+        {
+            "attachments": [_attachment_json(assessment_id, a) for a in attachments],
+            "revision": assessment.revision
+        },
+        status_code=status.HTTP_201_CREATED
+    )
+
+
+@app.get("/assessment/{assessment_id}/evidence/file/{attachment_id}")
+async def download_evidence(
+    assessment_id: int,
+    attachment_id: int,
+    current_user: models.User = Depends(auth.get_current_user_from_session),
+    db: Session = Depends(get_read_db)
+):
+    """Descargar un archivo de evidencia"""
+    attachment = db.query(models.EvidenceAttachment).join(models.Assessment).filter(
+        models.EvidenceAttachment.id == attachment_id,
+        models.EvidenceAttachment.assessment_id == assessment_id,
+        models.Assessment.user_id == current_user.id
+    ).first()
+
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+
+    return FileResponse(
+        evidence_store.get_store().path_for(attachment.digest),
+        media_type=attachment.content_type,
+        filename=attachment.filename
+    )
+
+
+@app.post("/assessment/{assessment_id}/evidence/file/{attachment_id}/delete")
+async def delete_evidence(
+    request: Request,
+    assessment_id: int,
+    attachment_id: int,
+    current_user: models.User = Depends(auth.get_current_user_from_session),
+    db: Session = Depends(get_db)
+):
+    """Quitar un archivo de evidencia (el blob se conserva: puede estar referenciado por otros)"""
+    attachment = db.query(models.EvidenceAttachment).join(models.Assessment).filter(
+        models.EvidenceAttachment.id == attachment_id,
+        models.EvidenceAttachment.assessment_id == assessment_id,
+        models.Assessment.user_id == current_user.id,
+        models.Assessment.estado != "Completado"
+    ).first()
+
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+
+    assessment = attachment.assessment
+    assessment.bump_revision()
+    db.delete(attachment)
+    db.commit()
+    mark_recent_write(request)
+
+    return {"deleted": attachment_id, "revision": assessment.revision}
+
+
+def _get_report_assessment(db: Session, assessment_id: int, current_user: models.User) -> records.AssessmentRecord:
+    """Assessment del usuario o, para un consultor, de uno de sus clientes"""
+    assessment = records.get_report_assessment(db, assessment_id, current_user)
+    if not assessment:
+        raise HTTPException(status_code=404, detail="Assessment no encontrado")
+    return assessment
+
+
+@app.get("/assessment/report/{assessment_id}", response_class=HTMLResponse)
+async def view_report(
+    request: Request,
+    assessment_id: int,
+    current_user: models.User = Depends(auth.get_current_user_from_session),
+    db: Session = Depends(get_read_db)
+):
+    """Ver página de reporte con opción de descargar PDF"""
+    assessment = _get_report_assessment(db, assessment_id, current_user)
+
+    etag = http_cache.make_etag(
+        "report", assessment.id, assessment.revision, current_user.id, current_user.revision
+    )
+    cached = http_cache.not_modified(request, etag)
+    if cached:
+        return cached
+
     return templates.TemplateResponse(
         "success.html",
         {
             "request": request,
             "user": current_user,
             "assessment": assessment
-        }
+        },
+        headers=http_cache.cache_headers(etag)
     )
 
 
 @app.get("/assessment/report/{assessment_id}/download")
 async def download_report(
+    request: Request,
     assessment_id: int,
     current_user: models.User = Depends(auth.get_current_user_from_session),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Generar y descargar PDF del reporte"""
-    # Verificar que el assessment pertenece al usuario
-    assessment = db.query(models.Assessment).filter(
-        models.Assessment.id == assessment_id,
-        models.Assessment.user_id == current_user.id
-    ).first()
+    assessment = _get_report_assessment(db, assessment_id, current_user)
 
-    if not assessment:
-        raise HTTPException(status_code=404, detail="Assessment no encontrado")
+    # Import diferido: reportlab sólo se carga cuando se necesita
+    import pdf_generator
+
+    # El PDF depende sólo del assessment (respuestas, evidencias) y del modo de salida
+    etag = http_cache.make_etag("pdf", assessment.id, assessment.revision, pdf_generator.PDF_COMPACT)
+    cached = http_cache.not_modified(request, etag)
+    if cached:
+        return cached
 
     # Generar PDF
-    pdf_path = generate_assessment_report(assessment_id, db)
+    pdf_path = pdf_generator.generate_assessment_report(assessment_id, db)
+
+    # El dueño y su consultor ven que hay un PDF de esta revisión
+    owner_is_viewer = assessment.user_id == current_user.id
+    events.bus.publish(events.Event(
+        "report.ready",
+        assessment.user_id,
+        current_user.consultor_id if owner_is_viewer else current_user.id,
+        {
+            "assessment_id": assessment.id,
+            "empresa": assessment.empresa,
+            "revision": assessment.revision,
+            "url": f"/assessment/report/{assessment.id}/download",
+        }
+    ))
 
     # Retornar archivo
     return FileResponse(
         pdf_path,
         media_type="application/pdf",
-        filename=f"Reporte_SGSI_{current_user.nombre_empresa}_{assessment_id}.pdf"
+        filename=f"Reporte_SGSI_{assessment.empresa}_{assessment_id}.pdf",
+        headers=http_cache.cache_headers(etag)
+    )
+
+
+# ============================================================================
+# PORTAFOLIO DE CONSULTORES
+# ============================================================================
+
+def get_portfolio_db(
+    current_user: models.User = Depends(auth.get_current_consultant_from_session),
+    db: Session = Depends(get_read_db)
+):
+    """Sesión del portafolio; con shards, reúne el último diagnóstico de cada cliente"""
+    if not SHARDING_ENABLED:
+        yield db
+        return
+    client_ids = db.execute(
+        select(models.User.id).where(models.User.consultor_id == current_user.id)
+    ).scalars().all()
+    with sharding.gathered_session(client_ids) as gathered:
+        yield gathered
+
+
+def _portfolio_filters(
+    q: Optional[str],
+    puntaje_min: Optional[float],
+    puntaje_max: Optional[float],
+    desde: Optional[date],
+    hasta: Optional[date],
+    sort: str,
+    order: str,
+    limit: int,
+    cursor: Optional[str]
+) -> portfolio.PortfolioFilters:
+    filters = portfolio.PortfolioFilters(
+        q=q or None, puntaje_min=puntaje_min, puntaje_max=puntaje_max,
+        desde=desde, hasta=hasta, sort=sort, order=order, limit=limit, cursor=cursor or None
+    )
+    # Validar orden y cursor antes de consultar
+    try:
+        portfolio.build_portfolio_query(0, filters)
+    except portfolio.PortfolioError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return filters
+
+
+def _portfolio_query_string(filters: portfolio.PortfolioFilters, **overrides) -> str:
+    params = {
+        "q": filters.q, "puntaje_min": filters.puntaje_min, "puntaje_max": filters.puntaje_max,
+        "desde": filters.desde, "hasta": filters.hasta, "sort": filters.sort, "order": filters.order,
+    }
+    params.update(overrides)
+    return urlencode({k: v for k, v in params.items() if v not in (None, "")})
+
+
+@app.get("/portfolio", response_class=HTMLResponse)
+async def portfolio_page(
+    request: Request,
+    q: Optional[str] = None,
+    puntaje_min: Optional[float] = None,
+    puntaje_max: Optional[float] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    sort: str = "puntaje",
+    order: str = "asc",
+    cursor: Optional[str] = None,
+    current_user: models.User = Depends(auth.get_current_consultant_from_session),
+    db: Session = Depends(get_portfolio_db)
+):
+    """Portafolio del consultor: último diagnóstico, puntaje y brechas por cliente"""
+    filters = _portfolio_filters(
+        q, puntaje_min, puntaje_max, desde, hasta, sort, order, portfolio.PORTFOLIO_PAGE_SIZE, cursor
+    )
+    rows, next_cursor = portfolio.get_portfolio_page(db, current_user.id, filters)
+
+    def sort_url(field: str) -> str:
+        # Repetir el mismo campo invierte el sentido; un campo nuevo parte ascendente
+        new_order = "desc" if filters.sort == field and filters.order == "asc" else "asc"
+        return "/portfolio?" + _portfolio_query_string(filters, sort=field, order=new_order)
+
+    return templates.TemplateResponse(
+        "portfolio.html",
+        {
+            "request": request,
+            "user": current_user,
+            "rows": rows,
+            "summary": portfolio.get_portfolio_summary(db, current_user.id),
+            "filters": filters,
+            "sort_url": sort_url,
+            "first_query": _portfolio_query_string(filters),
+            "next_query": _portfolio_query_string(filters, cursor=next_cursor) if next_cursor else None,
+        }
+    )
+
+
+@app.get("/api/portfolio")
+async def portfolio_api(
+    q: Optional[str] = None,
+    puntaje_min: Optional[float] = None,
+    puntaje_max: Optional[float] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    sort: str = "puntaje",
+    order: str = "asc",
+    limit: int = portfolio.PORTFOLIO_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    current_user: models.User = Depends(auth.get_current_consultant_from_session),
+    db: Session = Depends(get_portfolio_db)
+):
+    """Portafolio en JSON con paginación por cursor (next_cursor)"""
+    filters = _portfolio_filters(q, puntaje_min, puntaje_max, desde, hasta, sort, order, limit, cursor)
+    rows, next_cursor = portfolio.get_portfolio_page(db, current_user.id, filters)
+    return {
+        "items": [row.to_dict() for row in rows],
+        "next_cursor": next_cursor,
+    }
+
+
+# ============================================================================
+# BRECHAS (GAP ANALYSIS)
+# ============================================================================
+
+def _gap_filters(
+    dominio: Optional[str],
+    prioridad: Optional[str],
+    marco: Optional[str],
+    control: Optional[str],
+    limit: int
+) -> gaps.GapFilters:
+    filters = gaps.GapFilters(
+        dominio=dominio or None, prioridad=prioridad or None, marco=marco or None,
+        control=control or None, limit=limit
+    )
+    try:
+        filters.validate()
+    except gaps.GapQueryError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return filters
+
+
+@app.get("/api/gaps/{assessment_id}")
+async def assessment_gaps_api(
+    assessment_id: int,
+    dominio: Optional[str] = None,
+    prioridad: Optional[str] = None,
+    marco: Optional[str] = None,
+    control: Optional[str] = None,
+    limit: int = gaps.GAPS_DEFAULT_LIMIT,
+    current_user: models.User = Depends(auth.get_current_user_from_session),
+    db: Session = Depends(get_read_db)
+):
+    """Brechas de un assessment (propio o de un cliente del consultor) por peso"""
+    filters = _gap_filters(dominio, prioridad, marco, control, limit)
+    assessment = _get_report_assessment(db, assessment_id, current_user)
+    return {
+        "assessment_id": assessment.id,
+        "items": [row.to_dict() for row in gaps.top_gaps(db, assessment.id, filters)],
+    }
+
+
+@app.get("/api/portfolio/gaps")
+async def portfolio_gaps_api(
+    dominio: Optional[str] = None,
+    prioridad: Optional[str] = None,
+    marco: Optional[str] = None,
+    control: Optional[str] = None,
+    limit: int = gaps.GAPS_DEFAULT_LIMIT,
+    current_user: models.User = Depends(auth.get_current_consultant_from_session),
+    db: Session = Depends(get_portfolio_db)
+):
+    """Controles con brechas en el último diagnóstico de los clientes del consultor"""
+    filters = _gap_filters(dominio, prioridad, marco, control, limit)
+    return {
+        "items": [row.to_dict() for row in gaps.top_portfolio_gaps(db, current_user.id, filters)],
+    }
+
+
+# ============================================================================
+# BÚSQUEDA DE TEXTO COMPLETO
+# ============================================================================
+
+def _search_client_shard(current_user: models.User, filters: search.SearchFilters):
+    """Con shards, un consultor busca en el shard de un cliente a la vez"""
+    if filters.user_id is None:
+        raise search.SearchError("Con shards por organización, indique user_id (cliente) para buscar")
+    client_db = sharding.router.session(filters.user_id, create=False)
+    if client_db is None:
+        return [], None
+    try:
+        return search.search(client_db, current_user, filters)
+    finally:
+        client_db.close()
+
+
+@app.get("/api/search")
+async def search_api(
+    q: str,
+    en: str = "todo",
+    respuesta: Optional[str] = None,
+    user_id: Optional[int] = None,
+    dominio: Optional[str] = None,
+    marco: Optional[str] = None,
+    control: Optional[str] = None,
+    limit: int = search.SEARCH_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    current_user: models.User = Depends(auth.get_current_user_from_session),
+    db: Session = Depends(get_read_db)
+):
+    """Respuestas (propias o de los clientes del consultor) por texto de evidencia o de control"""
+    try:
+        filters = search.SearchFilters(
+            q=q, en=en, respuestas=search.parse_respuestas(respuesta), user_id=user_id,
+            dominio=dominio or None, marco=marco or None, control=control or None,
+            limit=limit, cursor=cursor or None
+        )
+        if SHARDING_ENABLED and current_user.es_consultor:
+            hits, next_cursor = _search_client_shard(current_user, filters)
+        else:
+            hits, next_cursor = search.search(db, current_user, filters)
+    except search.SearchError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except search.SearchUnavailable:
+        raise HTTPException(status_code=503, detail="Búsqueda no disponible en esta base de datos")
+    return {
+        "items": [hit.to_dict() for hit in hits],
+        "next_cursor": next_cursor,
+    }
+
+
+@app.post("/admin/consultants/{user_id}")
+async def admin_set_consultant(
+    request: Request,
+    user_id: int,
+    es_consultor: bool = True,
+    db: Session = Depends(get_db)
+):
+    """Habilitar o deshabilitar a un usuario como consultor (X-Admin-Token)"""
+    if not auth.is_admin_request(request):
+        raise HTTPException(status_code=403, detail="Token de administración inválido")
+
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+    role_changed = bool(user.es_consultor) != es_consultor
+    user.es_consultor = es_consultor
+    user.bump_revision()  # El menú de navegación cambia
+    if role_changed:
+        # Los tokens de API llevan el rol: los emitidos antes dejan de valer
+        auth.revoke_user_tokens(db, user.id)
+    db.commit()
+    if role_changed:
+        revocation.revocations.refresh(force=True)
+    return {"user_id": user.id, "es_consultor": user.es_consultor}
+
+
+@app.post("/admin/consultants/{consultor_id}/clients/{user_id}")
+async def admin_assign_client(
+    request: Request,
+    consultor_id: int,
+    user_id: int,
+    db: Session = Depends(get_db)
+):
+    """Asignar un cliente a un consultor (X-Admin-Token)"""
+    if not auth.is_admin_request(request):
+        raise HTTPException(status_code=403, detail="Token de administración inválido")
+
+    consultor = db.query(models.User).filter(
+        models.User.id == consultor_id,
+        models.User.es_consultor.is_(True)
+    ).first()
+    client = db.query(models.User).filter(models.User.id == user_id).first()
+    if not consultor or not client:
+        raise HTTPException(status_code=404, detail="Consultor o cliente no encontrado")
+
+    client.consultor_id = consultor.id
+    db.commit()
+    return {"user_id": client.id, "consultor_id": client.consultor_id}
+
+
+# ============================================================================
+# API CON TOKEN (INTEGRACIONES)
+# ============================================================================
+
+def _rate_limited_json(retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        {"detail": RATE_LIMIT_MESSAGE},
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+    )
+
+
+def _token_response(user: models.User) -> dict:
+    return {
+        "access_token": auth.create_user_token(user),
+        "token_type": "bearer",
+        "expires_in": auth.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+
+@app.post("/api/token")
+async def api_token(
+    request: Request,
+    rut: str = Form(...),
+    password: str = Form(...),
+    db: Session = Depends(get_db)
+):
+    """Emitir un token de API (Bearer) con los datos del usuario"""
+    retry_after = rate_limit.login_limiter.check(request.client and request.client.host, rut)
+    if retry_after:
+        return _rate_limited_json(retry_after)
+
+    user = auth.authenticate_user(db, rut, password)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="RUT o contraseña incorrectos")
+    return _token_response(user)
+
+
+@app.get("/api/me")
+async def api_me(token_user: auth.TokenUser = Depends(auth.get_current_user_from_token)):
+    """Datos del usuario del token (sin consultar la base)"""
+    return {
+        "id": token_user.id,
+        "rut": token_user.rut,
+        "nombre_empresa": token_user.nombre_empresa,
+        "es_consultor": token_user.es_consultor,
+        "expires_at": token_user.expires_at.isoformat() + "Z",
+    }
+
+
+@app.post("/api/logout")
+async def api_logout(
+    token_user: auth.TokenUser = Depends(auth.get_current_user_from_token),
+    db: Session = Depends(get_db)
+):
+    """Revocar el token de la solicitud"""
+    await write_queue.run(
+        db, lambda session: revocation.record(
+            session, token_user.id, token_user.expires_at, jti=token_user.jti
+        )
+    )
+    # Efecto inmediato en este proceso; los demás lo ven en REVOCATION_REFRESH_SECONDS
+    revocation.revocations.refresh(force=True)
+    return {"detail": "Token revocado"}
+
+
+@app.post("/api/password")
+async def api_change_password(
+    request: Request,
+    password_actual: str = Form(...),
+    password_nueva: str = Form(...),
+    token_user: auth.TokenUser = Depends(auth.get_current_user_from_token),
+    db: Session = Depends(get_db)
+):
+    """Cambiar la contraseña: revoca todos los tokens anteriores y entrega uno nuevo"""
+    retry_after = rate_limit.login_limiter.check(request.client and request.client.host, token_user.rut)
+    if retry_after:
+        return _rate_limited_json(retry_after)
+
+    user = db.get(models.User, token_user.id)
+    if user is None or not auth.verify_password(password_actual, user.hashed_password):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Contraseña actual incorrecta")
+
+    hashed_password = auth.get_password_hash(password_nueva)
+    user_id = user.id
+    await write_queue.run(db, lambda session: auth.change_password(session, user_id, hashed_password))
+    revocation.revocations.refresh(force=True)
+    mark_recent_write(request)
+    return _token_response(db.get(models.User, user_id))
+
+
+# ============================================================================
+# EVENTOS EN VIVO (SSE)
+# ============================================================================
+
+@app.get("/api/events")
+async def event_stream(request: Request):
+    """Eventos de los diagnósticos propios y, para consultores, de sus clientes (text/event-stream)"""
+    # Sesión breve: el stream dura mientras la página esté abierta y no debe
+    # retener una conexión del pool (get_db se cerraría recién al terminar)
+    db = SessionLocal()
+    try:
+        user_id = (await auth.get_current_user_from_session(request, db)).id
+    finally:
+        db.close()
+
+    try:
+        subscription = await events.bus.subscribe(user_id)
+    except events.TooManySubscribers:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Demasiadas conexiones de eventos",
+            headers={"Retry-After": "30"}
+        )
+
+    async def body():
+        try:
+            async for message in events.stream(subscription, request.is_disconnected):
+                yield message
+        finally:
+            events.bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        # Sin caché ni buffer en proxies (nginx): cada evento sale de inmediato
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ============================================================================
+# EXPORTACIÓN
+# ============================================================================
+
+@app.get("/export/assessments.{formato}")
+async def export_assessments(
+    request: Request,
+    formato: str,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    user_id: Optional[int] = None,
+    estado: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Exportar assessments, respuestas y metadatos de preguntas (CSV, JSONL o XLSX).
+
+    Con X-Admin-Token se exportan todos los clientes; con sesión de usuario,
+    sólo los assessments propios.
+    """
+    if not auth.is_admin_request(request):
+        current_user = await auth.get_current_user_from_session(request, db)
+        user_id = current_user.id
+
+    try:
+        export.check_format(formato)
+    except export.ExportError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    filters = export.ExportFilters(desde=desde, hasta=hasta, user_id=user_id, estado=estado)
+
+    return StreamingResponse(
+        export.stream_export(
+            formato, filters,
+            sessions=sharding.tenant_sessions(filters.user_id) if SHARDING_ENABLED else None
+        ),
+        media_type=export.EXPORT_FORMATS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{export.export_filename(formato)}"'}
     )
 
 
@@ -388,6 +1353,19 @@ async def health_check():
     return {"status": "ok", "service": "CiberSegurIA SGSI Express MVP"}
 
 
+@app.get("/health/startup")
+async def startup_report():
+    """Desglose de tiempos de arranque del worker que atiende la solicitud"""
+    return startup_timer.report()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Métricas internas en formato Prometheus"""
+    return metrics.render()
+
+
 if __name__ == "__main__":
+    # Modo desarrollo (un proceso con recarga). Para producción usar serve.py
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,51 @@
+"""
+Métricas en Memoria (formato de texto Prometheus)
+CiberSegurIA - Diagnóstico SGSI Express MVP
+"""
+import threading
+from collections import defaultdict
+from typing import Dict, Tuple
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = defaultdict(dict)
+_help: Dict[str, str] = {}
+
+
+def describe(name: str, help_text: str):
+    """Registrar el texto de ayuda de una métrica"""
+    _help[name] = help_text
+
+
+def increment(name: str, value: float = 1, **labels):
+    """Incrementar un contador, opcionalmente con etiquetas"""
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        series = _counters[name]
+        series[key] = series.get(key, 0) + value
+
+
+def get_value(name: str, **labels) -> float:
+    """Obtener el valor actual de un contador"""
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        return _counters.get(name, {}).get(key, 0)
+
+
+def render() -> str:
+    """Exportar todas las métricas en formato de texto Prometheus"""
+    lines = []
+    with _lock:
+        snapshot = {name: dict(series) for name, series in _counters.items()}
+
+    for name in sorted(snapshot):
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in sorted(snapshot[name].items()):
+            if key:
+                label_str = ",".join(f'{k}="{v}"' for k, v in key)
+                lines.append(f"{name}{{{label_str}}} {value:g}")
+            else:
+                lines.append(f"{name} {value:g}")
+
+    return "\n".join(lines) + "\n"
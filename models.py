@@ -2,7 +2,7 @@
 Modelos de Base de Datos - SQLAlchemy ORM
 CiberSegurIA - Diagnóstico SGSI Express MVP
 """
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text, Enum
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text, Enum, Index, Boolean
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -27,9 +27,25 @@ class User(Base):
     email_contacto = Column(String(255), unique=True, index=True, nullable=False)
     hashed_password = Column(String(255), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    es_consultor = Column(Boolean, nullable=False, default=False, server_default="0")
+    consultor_id = Column(Integer, ForeignKey("users.id"))  # Consultor a cargo del cliente
+    revision = Column(Integer, nullable=False, default=1, server_default="1")  # Cambios del usuario (rol, menú): ETags
+    # Va en los tokens de API; al subirla quedan revocados los emitidos antes
+    token_version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    __table_args__ = (
+        # Clientes de un consultor ordenados por nombre (portafolio)
+        Index("ix_users_consultor_nombre", "consultor_id", "nombre_empresa"),
+    )
 
     # Relaciones
     assessments = relationship("Assessment", back_populates="user")
+    consultor = relationship("User", remote_side=[id], back_populates="clientes")
+    clientes = relationship("User", back_populates="consultor")
+
+    def bump_revision(self):
+        """Invalidar los ETags derivados de este usuario (incremento en SQL)"""
+        self.revision = User.revision + 1
 
     def __repr__(self):
         return f"<User {self.nombre_empresa} - {self.rut}>"
@@ -44,20 +60,85 @@ class Assessment(Base):
     fecha = Column(DateTime, default=datetime.utcnow)
     puntaje_final = Column(Float, default=0.0)  # Porcentaje 0-100
     estado = Column(String(50), default="En Progreso")  # En Progreso, Completado
+    catalog_version_id = Column(Integer, ForeignKey("catalog_versions.id"), index=True)  # Catálogo con que se evalúa
+    revision = Column(Integer, nullable=False, default=1, server_default="1")  # Base del ETag del reporte
+    submit_key = Column(String(40))  # Clave de idempotencia del último envío aplicado
+
+    __table_args__ = (
+        # Último assessment completado por cliente (dashboard y portafolio)
+        Index("ix_assessments_user_estado_fecha", "user_id", "estado", "fecha"),
+    )
 
     # Relaciones
     user = relationship("User", back_populates="assessments")
+    catalog_version = relationship("CatalogVersion")
     answers = relationship("Answer", back_populates="assessment", cascade="all, delete-orphan")
+    attachments = relationship("EvidenceAttachment", back_populates="assessment", cascade="all, delete-orphan")
+
+    def bump_revision(self):
+        """Invalidar los ETags del reporte y del PDF (y del dashboard, que suma las revisiones)"""
+        self.revision = Assessment.revision + 1
 
     def __repr__(self):
         return f"<Assessment {self.id} - {self.puntaje_final}%>"
 
 
+class Framework(Base):
+    """Marco normativo o estándar (ISO 27001, Ley 21.663, Ley 21.096)"""
+    __tablename__ = "frameworks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    codigo = Column(String(50), unique=True, nullable=False)  # Ej: "ISO27001"
+    nombre = Column(String(255), nullable=False)
+
+    def __repr__(self):
+        return f"<Framework {self.codigo}>"
+
+
+class CatalogVersion(Base):
+    """Versión inmutable del catálogo de preguntas"""
+    __tablename__ = "catalog_versions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    etiqueta = Column(String(100), nullable=False)  # Ej: "2025.1"
+    vigente = Column(Boolean, nullable=False, default=False, server_default="0")  # Versión para nuevos assessments
+    indice = Column(Text)  # Índice precompilado (JSON): orden, pesos y mapeos
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Relaciones
+    questions = relationship("Question", back_populates="catalog_version")
+
+    def __repr__(self):
+        return f"<CatalogVersion {self.id} - {self.etiqueta}>"
+
+
+class ControlMapping(Base):
+    """Control de un marco normativo cubierto por una pregunta"""
+    __tablename__ = "control_mappings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    question_id = Column(Integer, ForeignKey("questions.id"), nullable=False, index=True)
+    framework_id = Column(Integer, ForeignKey("frameworks.id"), nullable=False)
+    control_ref = Column(String(100), nullable=False)  # Ej: "A.5.1", "Art. 4"
+
+    __table_args__ = (
+        Index("ix_control_mappings_framework_ref", "framework_id", "control_ref"),
+    )
+
+    # Relaciones
+    question = relationship("Question", back_populates="mappings")
+    framework = relationship("Framework")
+
+    def __repr__(self):
+        return f"<ControlMapping Question:{self.question_id} -> {self.framework_id}:{self.control_ref}>"
+
+
 class Question(Base):
     """Modelo de Pregunta del Checklist"""
     __tablename__ = "questions"
 
     id = Column(Integer, primary_key=True, index=True)
+    catalog_version_id = Column(Integer, ForeignKey("catalog_versions.id"), index=True)
     dominio = Column(String(100), nullable=False)  # Ej: "A.5 Políticas de Seguridad"
     subdominio = Column(String(100))  # Ej: "A.5.1 Dirección de la Gestión"
     pregunta = Column(Text, nullable=False)
@@ -67,6 +148,8 @@ class Question(Base):
     referencia_legal = Column(String(255))  # Ej: "Art. 4 Ley 21.663"
 
     # Relaciones
+    catalog_version = relationship("CatalogVersion", back_populates="questions")
+    mappings = relationship("ControlMapping", back_populates="question", cascade="all, delete-orphan")
     answers = relationship("Answer", back_populates="question")
 
     def __repr__(self):
@@ -83,10 +166,74 @@ class Answer(Base):
     respuesta = Column(Enum(RespuestaEnum), nullable=False)
     evidencia_adjunta = Column(Text)  # Texto opcional con evidencia/comentarios
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Hora (UTC, del servidor) del último cambio de la respuesta
+    updated_at = Column(DateTime)
+
+    __table_args__ = (
+        # Conteo de brechas por assessment sin leer las filas
+        Index("ix_answers_assessment_respuesta", "assessment_id", "respuesta"),
+        # Brechas por control a través de assessments (gaps.py)
+        Index("ix_answers_respuesta_question", "respuesta", "question_id"),
+        # Respuestas de un control dentro de los assessments visibles (search.py)
+        Index("ix_answers_assessment_question", "assessment_id", "question_id"),
+    )
 
     # Relaciones
     assessment = relationship("Assessment", back_populates="answers")
     question = relationship("Question", back_populates="answers")
+    # Archivos de evidencia de la misma pregunta en el mismo assessment
+    attachments = relationship(
+        "EvidenceAttachment",
+        primaryjoin="and_(Answer.assessment_id == foreign(EvidenceAttachment.assessment_id), "
+                    "Answer.question_id == foreign(EvidenceAttachment.question_id))",
+        viewonly=True,
+        order_by="EvidenceAttachment.id"
+    )
 
     def __repr__(self):
         return f"<Answer Assessment:{self.assessment_id} Question:{self.question_id} - {self.respuesta}>"
+
+
+class EvidenceAttachment(Base):
+    """Archivo de evidencia adjunto a una respuesta (referencia a un blob por SHA-256)"""
+    __tablename__ = "evidence_attachments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    assessment_id = Column(Integer, ForeignKey("assessments.id"), nullable=False)
+    question_id = Column(Integer, ForeignKey("questions.id"), nullable=False)
+    digest = Column(String(64), nullable=False, index=True)  # SHA-256 del contenido
+    filename = Column(String(255), nullable=False)  # Nombre original (sólo para mostrar)
+    content_type = Column(String(100), nullable=False)
+    size_bytes = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_evidence_assessment_question", "assessment_id", "question_id"),
+    )
+
+    # Relaciones
+    assessment = relationship("Assessment", back_populates="attachments")
+
+    @property
+    def is_image(self) -> bool:
+        return self.content_type.startswith("image/")
+
+    def __repr__(self):
+        return f"<EvidenceAttachment {self.filename} - {self.digest[:12]}>"
+
+
+class TokenRevocation(Base):
+    """Revocación de tokens de API: uno (jti) o todos los de un usuario bajo una versión"""
+    __tablename__ = "token_revocations"
+    # Ids siempre crecientes: cada proceso lee sólo las filas nuevas (revocation.py)
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    jti = Column(String(32))  # Token revocado (logout)
+    token_version = Column(Integer)  # Versión mínima válida (cambio de contraseña o de rol)
+    expires_at = Column(DateTime, nullable=False, index=True)  # Desde aquí no queda token que revocar
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<TokenRevocation User:{self.user_id} - {self.jti or f'v<{self.token_version}'}>"
@@ -6,73 +6,245 @@ from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Image
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Image, Flowable
 from reportlab.graphics.shapes import Drawing
 from reportlab.graphics.charts.piecharts import Pie
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_JUSTIFY
+from reportlab.lib.utils import ImageReader
 from datetime import datetime
 from sqlalchemy.orm import Session
+from xml.sax.saxutils import escape
+import catalog
+import evidence_store
+import gaps
+import logging
+import metrics
 import models
 import os
+import records
+import threading
+import time
+import tracing
+
+
+def _build_report_styles():
+    """Construir la hoja de estilos base más los estilos personalizados"""
+    styles = getSampleStyleSheet()
+
+    # Título principal
+    styles.add(ParagraphStyle(
+        name='CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#1e3a8a'),
+        spaceAfter=30,
+        alignment=TA_CENTER,
+        fontName='Helvetica-Bold'
+    ))
+
+    # Subtítulo
+    styles.add(ParagraphStyle(
+        name='CustomSubtitle',
+        parent=styles['Heading2'],
+        fontSize=16,
+        textColor=colors.HexColor('#3b82f6'),
+        spaceAfter=12,
+        spaceBefore=12,
+        fontName='Helvetica-Bold'
+    ))
+
+    # Texto normal justificado
+    styles.add(ParagraphStyle(
+        name='Justified',
+        parent=styles['Normal'],
+        alignment=TA_JUSTIFY,
+        fontSize=10,
+        leading=14
+    ))
+
+    return styles
+
+
+_report_styles = None
+_report_styles_lock = threading.Lock()
+
+# Modo compacto: compresión de los streams de página (PDF más liviano para archivo)
+PDF_COMPACT = os.getenv("PDF_COMPACT", "1") != "0"
+LOGO_PATH = "static/img/logo.png"
+
+# Anexo: caracteres por bloque de evidencia (una fila de tabla por bloque) y
+# flowables que se generan por adelantado mientras doc.build consume la story
+PDF_EVIDENCE_CHUNK = int(os.getenv("PDF_EVIDENCE_CHUNK", "1500"))
+PDF_STORY_LOOKAHEAD = 16
+
+_logo_reader = None
+_logo_checked = False
+
+logger = logging.getLogger("ciberseguria.pdf")
+
+metrics.describe("ciberseguria_pdf_reports_total", "Reportes PDF generados")
+metrics.describe("ciberseguria_pdf_bytes_total", "Bytes de PDF generados")
+metrics.describe("ciberseguria_pdf_build_seconds_total", "Segundos acumulados generando PDFs")
+
+
+def get_report_styles():
+    """
+    Hoja de estilos compartida por todos los reportes del proceso.
+
+    Los estilos no se modifican durante la generación, por lo que se
+    construyen una sola vez por proceso en lugar de una vez por reporte.
+    """
+    global _report_styles
+    if _report_styles is None:
+        with _report_styles_lock:
+            if _report_styles is None:
+                _report_styles = _build_report_styles()
+    return _report_styles
+
+
+def get_logo_reader():
+    """
+    Logo decodificado una sola vez por proceso.
+
+    Todos los reportes reutilizan el mismo ImageReader en lugar de abrir y
+    decodificar el PNG en cada generación. Retorna None si no hay logo.
+    """
+    global _logo_reader, _logo_checked
+    if not _logo_checked:
+        with _report_styles_lock:
+            if not _logo_checked:
+                if os.path.exists(LOGO_PATH):
+                    reader = ImageReader(LOGO_PATH)
+                    reader.getRGBData()  # forzar la decodificación ahora
+                    _logo_reader = reader
+                _logo_checked = True
+    return _logo_reader
+
+
+def _annex_table_style(color_hex: str) -> TableStyle:
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor(color_hex)),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        ('TOPPADDING', (0, 0), (-1, -1), 6),
+        ('BOX', (0, 0), (-1, -1), 0.5, colors.HexColor('#cbd5e1'))
+    ])
+
+
+# Estilo de tabla y texto del anexo por respuesta (compartidos entre todas las filas)
+ANNEX_STATES = {
+    models.RespuestaEnum.SI: (_annex_table_style('#d1fae5'), '✓ Sí'),
+    models.RespuestaEnum.NO: (_annex_table_style('#fee2e2'), '✗ No'),
+    models.RespuestaEnum.PARCIAL: (_annex_table_style('#fef3c7'), '◐ Parcial'),
+    models.RespuestaEnum.NA: (_annex_table_style('#f1f5f9'), '− N/A'),
+}
+
+
+def chunk_text(text: str, size: int = PDF_EVIDENCE_CHUNK):
+    """Dividir un texto en bloques de hasta size caracteres, cortando en espacios"""
+    start = 0
+    while start < len(text):
+        end = start + size
+        if end < len(text):
+            cut = text.rfind(" ", start, end)
+            if cut > start:
+                end = cut
+        yield text[start:end].strip()
+        start = end
+
+
+class ReaderImage(Flowable):
+    """Imagen dibujada desde un ImageReader ya decodificado (canvas.drawImage)"""
+
+    def __init__(self, reader: ImageReader, width: float, height: float, hAlign: str = 'CENTER'):
+        super().__init__()
+        self.reader = reader
+        self.width = width
+        self.height = height
+        self.hAlign = hAlign
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.reader, 0, 0, self.width, self.height, mask='auto')
+
+
+class LazyStory(list):
+    """
+    Story que se rellena desde un generador a medida que doc.build la consume.
+
+    doc.build sólo mira el inicio de la lista (flowables[0], keepWithNext y
+    los fragmentos que reinserta al dividir), así que basta mantener unos
+    pocos flowables por delante: el anexo nunca está completo en memoria.
+    """
+
+    def __init__(self, head, source, lookahead: int = PDF_STORY_LOOKAHEAD):
+        super().__init__(head)
+        self._source = iter(source)
+        self._lookahead = lookahead
+
+    def _fill(self, size: int):
+        while self._source is not None and list.__len__(self) < size:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+
+    def __len__(self):
+        self._fill(self._lookahead)
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and index >= 0:
+            self._fill(index + 1)
+        elif isinstance(index, slice) and index.stop is not None and index.stop >= 0:
+            self._fill(index.stop)
+        else:
+            self._fill(float("inf"))
+        return list.__getitem__(self, index)
 
 
 class PDFReportGenerator:
     """Generador de reportes de cumplimiento en PDF"""
 
-    def __init__(self, assessment_id: int, db: Session):
+    def __init__(self, assessment_id: int, db: Session, compact: bool = None):
         self.assessment_id = assessment_id
         self.db = db
+        self.compact = PDF_COMPACT if compact is None else compact
+        self.build_stats = {}
+        self.annex_seconds = 0.0  # Tiempo propio del anexo (intercalado en doc.build)
         self.assessment = None
         self.user = None
         self.answers = []
-        self.questions = []
-        self.styles = getSampleStyleSheet()
-        self._setup_custom_styles()
-
-    def _setup_custom_styles(self):
-        """Configurar estilos personalizados"""
-        # Título principal
-        self.styles.add(ParagraphStyle(
-            name='CustomTitle',
-            parent=self.styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#1e3a8a'),
-            spaceAfter=30,
-            alignment=TA_CENTER,
-            fontName='Helvetica-Bold'
-        ))
-
-        # Subtítulo
-        self.styles.add(ParagraphStyle(
-            name='CustomSubtitle',
-            parent=self.styles['Heading2'],
-            fontSize=16,
-            textColor=colors.HexColor('#3b82f6'),
-            spaceAfter=12,
-            spaceBefore=12,
-            fontName='Helvetica-Bold'
-        ))
-
-        # Texto normal justificado
-        self.styles.add(ParagraphStyle(
-            name='Justified',
-            parent=self.styles['Normal'],
-            alignment=TA_JUSTIFY,
-            fontSize=10,
-            leading=14
-        ))
+        self.catalog = None
+        self.attachments = {}
+        self.styles = get_report_styles()
 
     def _load_data(self):
-        """Cargar datos del assessment desde la BD"""
-        self.assessment = self.db.query(models.Assessment).filter(
-            models.Assessment.id == self.assessment_id
-        ).first()
+        """Cargar datos del assessment desde la BD (registros de sólo lectura, sin ORM)"""
+        self.assessment = records.get_assessment(self.db, self.assessment_id)
 
         if not self.assessment:
             raise ValueError(f"Assessment {self.assessment_id} no encontrado")
 
-        self.user = self.assessment.user
-        self.answers = self.assessment.answers
+        self.user = records.get_company(self.db, self.assessment.user_id)
+
+        # Índice de la versión del catálogo con que se evaluó: textos, pesos y
+        # orden salen de ahí, sin consultar las preguntas por cada respuesta
+        self.catalog = catalog.get_assessment_catalog(self.db, self.assessment)
+        order = {q.id: position for position, q in enumerate(self.catalog.questions)}
+        # Sólo estado por respuesta: la evidencia se lee en streaming al armar el anexo
+        self.answers = sorted(
+            (a for a in records.get_answer_states(self.db, self.assessment_id) if a.question_id in self.catalog.by_id),
+            key=lambda a: order[a.question_id]
+        )
+
+        # Archivos de evidencia agrupados por pregunta
+        self.attachments = {}
+        for attachment in records.get_attachments(self.db, self.assessment_id):
+            self.attachments.setdefault(attachment.question_id, []).append(attachment)
 
     def _calculate_statistics(self):
         """Calcular estadísticas del assessment"""
@@ -110,11 +282,10 @@ class PDFReportGenerator:
 
     def _create_cover_page(self, story):
         """Crear portada del reporte"""
-        # Logo (placeholder - si existe)
-        logo_path = "static/img/logo.png"
-        if os.path.exists(logo_path):
-            logo = Image(logo_path, width=2*inch, height=1*inch)
-            story.append(logo)
+        # Logo (placeholder - si existe), decodificado una vez por proceso
+        logo_reader = get_logo_reader()
+        if logo_reader is not None:
+            story.append(ReaderImage(logo_reader, width=2*inch, height=1*inch))
             story.append(Spacer(1, 0.5*inch))
 
         # Título principal
@@ -133,7 +304,8 @@ class PDFReportGenerator:
             ['RUT:', self.user.rut],
             ['Contacto:', self.user.email_contacto],
             ['Fecha de Evaluación:', self.assessment.fecha.strftime('%d/%m/%Y')],
-            ['ID de Reporte:', f'SGSI-{self.assessment.id:04d}']
+            ['ID de Reporte:', f'SGSI-{self.assessment.id:04d}'],
+            ['Versión del Catálogo:', self.catalog.etiqueta]
         ]
 
         empresa_table = Table(empresa_data, colWidths=[2*inch, 4*inch])
@@ -267,14 +439,11 @@ class PDFReportGenerator:
         story.append(intro)
         story.append(Spacer(1, 0.3*inch))
 
-        # Filtrar respuestas No y Parcial
-        brechas = [
-            a for a in self.answers
-            if a.respuesta in [models.RespuestaEnum.NO, models.RespuestaEnum.PARCIAL]
-        ]
-
-        # Ordenar por peso de la pregunta (más críticas primero)
-        brechas_sorted = sorted(brechas, key=lambda x: x.question.peso, reverse=True)[:10]
+        # Top 10 brechas (No y Parcial) por peso, desde el índice de la versión
+        # del catálogo (self.answers ya viene en su orden, que desempata)
+        by_id = self.catalog.by_id
+        brechas = [a for a in self.answers if a.respuesta in gaps.BRECHA_RESPUESTAS]
+        brechas_sorted = sorted(brechas, key=lambda a: by_id[a.question_id].peso, reverse=True)[:10]
 
         if not brechas_sorted:
             story.append(Paragraph("¡Felicitaciones! No se identificaron brechas críticas.", self.styles['Normal']))
@@ -282,15 +451,15 @@ class PDFReportGenerator:
             gap_data = [['#', 'CONTROL', 'DOMINIO', 'ESTADO', 'PRIORIDAD']]
 
             for idx, answer in enumerate(brechas_sorted, 1):
+                question = by_id[answer.question_id]
                 estado = "No Implementado" if answer.respuesta == models.RespuestaEnum.NO else "Parcial"
-                prioridad = "ALTA" if answer.question.peso >= 4 else "MEDIA" if answer.question.peso >= 2 else "BAJA"
 
                 gap_data.append([
                     str(idx),
-                    Paragraph(answer.question.pregunta[:100] + "...", self.styles['Normal']),
-                    answer.question.dominio,
+                    Paragraph(question.pregunta[:100] + "...", self.styles['Normal']),
+                    question.dominio,
                     estado,
-                    prioridad
+                    gaps.prioridad(question.peso)
                 ])
 
             gap_table = Table(gap_data, colWidths=[0.3*inch, 3*inch, 1.2*inch, 0.8*inch, 0.7*inch])
@@ -380,62 +549,102 @@ class PDFReportGenerator:
         story.append(cta)
         story.append(PageBreak())
 
-    def _create_detailed_results(self, story):
-        """Crear anexo con resultados detallados"""
-        story.append(Paragraph("ANEXO: DETALLE COMPLETO DE EVALUACIÓN", self.styles['CustomTitle']))
-        story.append(Spacer(1, 0.2*inch))
+    def _create_detailed_results(self):
+        """
+        Anexo flowable por flowable, acumulando en annex_seconds el tiempo del
+        generador: doc.build lo consume de a poco, así que no cabe en un span.
+        """
+        flowables = self._detailed_results_flowables()
+        while True:
+            started = time.perf_counter()
+            try:
+                flowable = next(flowables)
+            except StopIteration:
+                return
+            finally:
+                self.annex_seconds += time.perf_counter() - started
+            yield flowable
+
+    def _detailed_results_flowables(self):
+        """
+        Generar el anexo con resultados detallados, flowable por flowable.
+
+        Las respuestas (con su evidencia) se leen por lotes en el orden del
+        índice del catálogo, así que la memoria no crece con el número de controles.
+        """
+        yield Paragraph("ANEXO: DETALLE COMPLETO DE EVALUACIÓN", self.styles['CustomTitle'])
+        yield Spacer(1, 0.2*inch)
+
+        by_id = self.catalog.by_id
+        dominio_actual = None
+        question_ids = [state.question_id for state in self.answers]
+        for answer in records.iter_answers(self.db, self.assessment_id, question_ids):
+            question = by_id.get(answer.question_id)
+            if question is None:
+                continue
+
+            # Encabezado al comenzar cada dominio (vienen agrupados por el orden)
+            if question.dominio != dominio_actual:
+                if dominio_actual is not None:
+                    yield Spacer(1, 0.2*inch)
+                dominio_actual = question.dominio
+                yield Paragraph(question.dominio, self.styles['CustomSubtitle'])
+                yield Spacer(1, 0.1*inch)
+
+            # Estilo según respuesta
+            table_style, estado_text = ANNEX_STATES[answer.respuesta]
+
+            data = [
+                [Paragraph(f"<b>{question.pregunta}</b>", self.styles['Normal'])],
+                [Paragraph(f"<b>Estado:</b> {estado_text}", self.styles['Normal'])],
+            ]
 
-        # Agrupar por dominio
-        dominios = {}
-        for answer in self.answers:
-            dominio = answer.question.dominio
-            if dominio not in dominios:
-                dominios[dominio] = []
-            dominios[dominio].append(answer)
-
-        for dominio, answers in dominios.items():
-            story.append(Paragraph(dominio, self.styles['CustomSubtitle']))
-            story.append(Spacer(1, 0.1*inch))
-
-            for answer in answers:
-                # Color según respuesta
-                if answer.respuesta == models.RespuestaEnum.SI:
-                    color_bg = colors.HexColor('#d1fae5')
-                    estado_text = '✓ Sí'
-                elif answer.respuesta == models.RespuestaEnum.NO:
-                    color_bg = colors.HexColor('#fee2e2')
-                    estado_text = '✗ No'
-                elif answer.respuesta == models.RespuestaEnum.PARCIAL:
-                    color_bg = colors.HexColor('#fef3c7')
-                    estado_text = '◐ Parcial'
-                else:
-                    color_bg = colors.HexColor('#f1f5f9')
-                    estado_text = '− N/A'
-
-                data = [
-                    [Paragraph(f"<b>{answer.question.pregunta}</b>", self.styles['Normal'])],
-                    [Paragraph(f"<b>Estado:</b> {estado_text}", self.styles['Normal'])],
-                ]
-
-                if answer.evidencia_adjunta:
-                    data.append([Paragraph(f"<b>Evidencia:</b> {answer.evidencia_adjunta}", self.styles['Normal'])])
-
-                detail_table = Table(data, colWidths=[6*inch])
-                detail_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, -1), color_bg),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('FONTSIZE', (0, 0), (-1, -1), 9),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-                    ('TOPPADDING', (0, 0), (-1, -1), 6),
-                    ('BOX', (0, 0), (-1, -1), 0.5, colors.HexColor('#cbd5e1'))
-                ]))
-                story.append(detail_table)
-                story.append(Spacer(1, 0.1*inch))
-
-            story.append(Spacer(1, 0.2*inch))
+            # Controles cubiertos en cada marco normativo
+            refs = self.catalog.mappings.get(answer.question_id)
+            if refs:
+                controles = " · ".join(
+                    f"{catalog.FRAMEWORKS.get(ref.framework, ref.framework)} {ref.control}" for ref in refs
+                )
+                data.append([Paragraph(f"<b>Controles:</b> {escape(controles)}", self.styles['Normal'])])
+
+            # Evidencia larga en varias filas: la tabla puede partirse entre páginas
+            if answer.evidencia_adjunta:
+                for position, chunk in enumerate(chunk_text(answer.evidencia_adjunta)):
+                    prefix = "<b>Evidencia:</b> " if position == 0 else ""
+                    data.append([Paragraph(prefix + escape(chunk), self.styles['Normal'])])
+
+            for attachment in self.attachments.get(answer.question_id, []):
+                data.extend(self._attachment_rows(attachment))
+
+            detail_table = Table(data, colWidths=[6*inch])
+            detail_table.setStyle(table_style)
+            yield detail_table
+            yield Spacer(1, 0.1*inch)
+
+        if dominio_actual is not None:
+            yield Spacer(1, 0.2*inch)
+
+    def _attachment_rows(self, attachment):
+        """Filas del anexo para un archivo adjunto (con miniatura si es imagen)"""
+        rows = [[Paragraph(
+            f"<b>Archivo adjunto:</b> {escape(attachment.filename)} "
+            f"({attachment.size_bytes / 1024:.1f} KB, SHA-256 {attachment.digest[:16]}…)",
+            self.styles['Normal']
+        )]]
+
+        if attachment.is_image:
+            # La miniatura se genera una vez por blob y queda en disco;
+            # el archivo original nunca se carga completo en memoria
+            thumb_path = evidence_store.get_store().thumbnail(attachment.digest)
+            if thumb_path:
+                rows.append([Image(thumb_path, width=1.5*inch, height=1.5*inch, kind='proportional')])
+
+        return rows
 
     def generate_pdf(self, output_path: str = None) -> str:
         """Generar el PDF completo"""
+        started = time.perf_counter()
+
         if not output_path:
             output_path = f"reports/reporte_sgsi_{self.assessment_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
 
@@ -443,10 +652,12 @@ class PDFReportGenerator:
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
         # Cargar datos
-        self._load_data()
+        with tracing.span("pdf.load_data"):
+            self._load_data()
 
         # Calcular estadísticas
-        stats = self._calculate_statistics()
+        with tracing.span("pdf.statistics"):
+            stats = self._calculate_statistics()
 
         # Crear documento PDF
         doc = SimpleDocTemplate(
@@ -455,26 +666,57 @@ class PDFReportGenerator:
             rightMargin=0.75*inch,
             leftMargin=0.75*inch,
             topMargin=0.75*inch,
-            bottomMargin=0.75*inch
+            bottomMargin=0.75*inch,
+            pageCompression=1 if self.compact else 0
         )
 
-        # Story (contenido del PDF)
+        # Story (contenido del PDF): secciones iniciales completas; el anexo
+        # se genera mientras doc.build la consume
         story = []
 
         # Agregar secciones
-        self._create_cover_page(story)
-        self._create_executive_summary(story, stats)
-        self._create_gap_analysis(story, stats)
-        self._create_recommendations(story, stats)
-        self._create_detailed_results(story)
-
-        # Construir PDF
-        doc.build(story)
+        with tracing.span("pdf.cover_page"):
+            self._create_cover_page(story)
+        with tracing.span("pdf.executive_summary"):
+            self._create_executive_summary(story, stats)
+        with tracing.span("pdf.gap_analysis"):
+            self._create_gap_analysis(story, stats)
+        with tracing.span("pdf.recommendations"):
+            self._create_recommendations(story, stats)
+        story = LazyStory(story, self._create_detailed_results())
+
+        # Construir PDF (incluye la generación del anexo)
+        with tracing.span("pdf.build") as build_span:
+            doc.build(story)
+            build_span.set(pages=doc.page)
+        # Parte de pdf.build que corresponde a armar el anexo
+        tracing.record_span("pdf.detailed_results", self.annex_seconds, dentro_de="pdf.build")
+
+        self._record_build_stats(output_path, doc.page, time.perf_counter() - started)
 
         return output_path
 
+    def _record_build_stats(self, output_path: str, pages: int, seconds: float):
+        """Registrar tamaño y tiempo de generación del reporte"""
+        size = os.path.getsize(output_path)
+        self.build_stats = {
+            'bytes': size,
+            'pages': pages,
+            'seconds': round(seconds, 3),
+            'annex_seconds': round(self.annex_seconds, 3),
+            'compact': self.compact
+        }
+
+        metrics.increment("ciberseguria_pdf_reports_total", compact=str(self.compact).lower())
+        metrics.increment("ciberseguria_pdf_bytes_total", size)
+        metrics.increment("ciberseguria_pdf_build_seconds_total", seconds)
+        logger.info(
+            "Reporte %s: %d bytes, %d páginas, %.3fs (compacto=%s)",
+            self.assessment_id, size, pages, seconds, self.compact
+        )
+
 
-def generate_assessment_report(assessment_id: int, db: Session) -> str:
+def generate_assessment_report(assessment_id: int, db: Session, compact: bool = None) -> str:
     """Función helper para generar reporte"""
-    generator = PDFReportGenerator(assessment_id, db)
+    generator = PDFReportGenerator(assessment_id, db, compact=compact)
     return generator.generate_pdf()
@@ -0,0 +1,223 @@
+"""
+Portafolio de Clientes para Consultores
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Lista los clientes de un consultor con su último diagnóstico completado,
+puntaje y cantidad de brechas. Filtros, orden y paginación (keyset) se
+resuelven en SQL, de modo que el costo por página no depende del número de
+clientes.
+"""
+import base64
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import func, or_, select, tuple_
+from sqlalchemy.orm import Session, aliased
+
+import models
+
+PORTFOLIO_PAGE_SIZE = 50
+PORTFOLIO_MAX_PAGE_SIZE = 200
+
+# Campos de orden permitidos
+PORTFOLIO_SORTS = ("puntaje", "fecha", "nombre", "brechas")
+
+# Valores centinela para clientes sin diagnóstico completado
+_NO_SCORE = -1.0
+_NO_DATE = datetime(1900, 1, 1)
+
+BRECHA_RESPUESTAS = (models.RespuestaEnum.NO, models.RespuestaEnum.PARCIAL)
+
+
+class PortfolioError(Exception):
+    """Parámetros de portafolio inválidos"""
+
+
+@dataclass
+class PortfolioFilters:
+    q: Optional[str] = None  # Texto en nombre de empresa o RUT
+    puntaje_min: Optional[float] = None
+    puntaje_max: Optional[float] = None
+    desde: Optional[date] = None  # Fecha del último diagnóstico
+    hasta: Optional[date] = None
+    sort: str = "puntaje"
+    order: str = "asc"
+    limit: int = PORTFOLIO_PAGE_SIZE
+    cursor: Optional[str] = None
+
+
+@dataclass
+class PortfolioRow:
+    user_id: int
+    nombre_empresa: str
+    rut: str
+    assessment_id: Optional[int]
+    fecha: Optional[datetime]
+    puntaje: Optional[float]
+    brechas: int
+
+    def to_dict(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "nombre_empresa": self.nombre_empresa,
+            "rut": self.rut,
+            "assessment_id": self.assessment_id,
+            "fecha": self.fecha.isoformat(timespec="seconds") if self.fecha else None,
+            "puntaje": self.puntaje,
+            "brechas": self.brechas,
+        }
+
+
+def encode_cursor(sort_value, user_id: int) -> str:
+    if isinstance(sort_value, datetime):
+        sort_value = {"dt": sort_value.isoformat()}
+    raw = json.dumps([sort_value, user_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, user_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise PortfolioError("Cursor inválido")
+    if isinstance(sort_value, dict) and "dt" in sort_value:
+        sort_value = datetime.fromisoformat(sort_value["dt"])
+    return sort_value, int(user_id)
+
+
+def latest_completed_id(user_id_column):
+    """
+    Id del último assessment completado de cada cliente (subconsulta correlacionada).
+
+    Se resuelve con una búsqueda en ix_assessments_user_estado_fecha por
+    cliente, en lugar de numerar todos los assessments del portafolio.
+    """
+    return (
+        select(models.Assessment.id)
+        .where(
+            models.Assessment.user_id == user_id_column,
+            models.Assessment.estado == "Completado"
+        )
+        .order_by(models.Assessment.fecha.desc(), models.Assessment.id.desc())
+        .limit(1)
+        .correlate_except(models.Assessment)
+        .scalar_subquery()
+    )
+
+
+def build_portfolio_query(consultor_id: int, filters: PortfolioFilters):
+    """Consulta del portafolio con filtros, orden y cursor aplicados en SQL"""
+    if filters.sort not in PORTFOLIO_SORTS:
+        raise PortfolioError(f"Orden no soportado: {filters.sort}")
+    if filters.order not in ("asc", "desc"):
+        raise PortfolioError("order debe ser 'asc' o 'desc'")
+
+    latest = aliased(models.Assessment, name="latest")
+
+    # Brechas del último diagnóstico (usa ix_answers_assessment_respuesta)
+    brechas = (
+        select(func.count(models.Answer.id))
+        .where(
+            models.Answer.assessment_id == latest.id,
+            models.Answer.respuesta.in_(BRECHA_RESPUESTAS)
+        )
+        .correlate(latest)
+        .scalar_subquery()
+    )
+
+    sort_expr = {
+        "puntaje": func.coalesce(latest.puntaje_final, _NO_SCORE),
+        "fecha": func.coalesce(latest.fecha, _NO_DATE),
+        "nombre": models.User.nombre_empresa,
+        "brechas": brechas,
+    }[filters.sort]
+
+    stmt = (
+        select(
+            models.User.id,
+            models.User.nombre_empresa,
+            models.User.rut,
+            latest.id.label("assessment_id"),
+            latest.fecha,
+            latest.puntaje_final.label("puntaje"),
+            brechas.label("brechas"),
+            sort_expr.label("sort_value"),
+        )
+        .outerjoin(latest, latest.id == latest_completed_id(models.User.id))
+        .where(models.User.consultor_id == consultor_id)
+    )
+
+    if filters.q:
+        pattern = f"%{filters.q.strip()}%"
+        stmt = stmt.where(or_(
+            models.User.nombre_empresa.ilike(pattern),
+            models.User.rut.ilike(pattern)
+        ))
+    if filters.puntaje_min is not None:
+        stmt = stmt.where(latest.puntaje_final >= filters.puntaje_min)
+    if filters.puntaje_max is not None:
+        stmt = stmt.where(latest.puntaje_final <= filters.puntaje_max)
+    if filters.desde:
+        stmt = stmt.where(latest.fecha >= datetime.combine(filters.desde, datetime.min.time()))
+    if filters.hasta:
+        stmt = stmt.where(latest.fecha < datetime.combine(filters.hasta + timedelta(days=1), datetime.min.time()))
+
+    # Keyset: continuar después de (valor de orden, id) del último elemento
+    if filters.cursor:
+        sort_value, last_id = decode_cursor(filters.cursor)
+        key = tuple_(sort_expr, models.User.id)
+        bound = tuple_(sort_value, last_id)
+        stmt = stmt.where(key > bound if filters.order == "asc" else key < bound)
+
+    if filters.order == "asc":
+        stmt = stmt.order_by(sort_expr.asc(), models.User.id.asc())
+    else:
+        stmt = stmt.order_by(sort_expr.desc(), models.User.id.desc())
+
+    return stmt
+
+
+def get_portfolio_page(db: Session, consultor_id: int, filters: PortfolioFilters):
+    """Obtener una página del portafolio: (filas, cursor siguiente o None)"""
+    limit = max(1, min(filters.limit, PORTFOLIO_MAX_PAGE_SIZE))
+    stmt = build_portfolio_query(consultor_id, filters).limit(limit + 1)
+    result = db.execute(stmt).all()
+
+    rows: List[PortfolioRow] = [
+        PortfolioRow(
+            user_id=r.id,
+            nombre_empresa=r.nombre_empresa,
+            rut=r.rut,
+            assessment_id=r.assessment_id,
+            fecha=r.fecha,
+            puntaje=r.puntaje,
+            brechas=r.brechas,
+        )
+        for r in result[:limit]
+    ]
+
+    next_cursor = None
+    if len(result) > limit:
+        last = result[limit - 1]
+        next_cursor = encode_cursor(last.sort_value, last.id)
+
+    return rows, next_cursor
+
+
+def get_portfolio_summary(db: Session, consultor_id: int) -> dict:
+    """Totales del portafolio (clientes y promedio del último puntaje)"""
+    latest = aliased(models.Assessment, name="latest")
+    clientes, evaluados, promedio = db.execute(
+        select(func.count(models.User.id), func.count(latest.id), func.avg(latest.puntaje_final))
+        .outerjoin(latest, latest.id == latest_completed_id(models.User.id))
+        .where(models.User.consultor_id == consultor_id)
+    ).one()
+
+    return {
+        "clientes": clientes,
+        "evaluados": evaluados,
+        "puntaje_promedio": round(promedio, 1) if promedio is not None else None,
+    }
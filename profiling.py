@@ -0,0 +1,321 @@
+"""
+Perfilado Bajo Demanda de un Request
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Un operador puede perfilar un request puntual en producción enviando un token
+firmado (header X-Profile-Token o parámetro ?profile_token=). El token se firma
+con HMAC-SHA256 usando PROFILE_SECRET y queda atado a la ruta, al modo y a una
+fecha de expiración:
+
+    python profiling.py sign /assessment/report/12/download --modo sample
+
+Modos:
+- sample:  muestreo estadístico; escribe un archivo .folded (stacks
+           colapsados) listo para flamegraph.pl o speedscope
+- cprofile: perfilado determinista; escribe un .pstats (snakeviz, gprof2dot)
+
+El event loop intercala a todos los requests del worker en un mismo hilo, así
+que el perfilador sólo está activo mientras corre un paso de la tarea del
+request perfilado (ver TaskScoped): los demás requests no entran al perfil.
+No se incluye lo que el request delega a otros hilos o tareas (threadpool,
+cola de escritura, cuerpo de un StreamingResponse).
+
+Los perfiles se guardan en PROFILE_DIR, que se poda a PROFILE_MAX_FILES, y
+sólo PROFILE_MAX_CONCURRENT requests se perfilan a la vez.
+"""
+import argparse
+import cProfile
+import hashlib
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+from urllib.parse import parse_qs
+
+import metrics
+
+logger = logging.getLogger("ciberseguria.profiling")
+
+# Configuración (sin PROFILE_SECRET el perfilado queda desactivado)
+PROFILE_SECRET = os.getenv("PROFILE_SECRET")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "1"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))  # Segundos
+PROFILE_MAX_TTL = 3600  # Vigencia máxima de un token (segundos)
+
+PROFILE_MODES = ("sample", "cprofile")
+
+metrics.describe("ciberseguria_profiles_total", "Requests perfilados bajo demanda por resultado")
+
+_slots = threading.BoundedSemaphore(PROFILE_MAX_CONCURRENT)
+_dir_lock = threading.Lock()
+
+
+# ============================================================================
+# Tokens firmados
+# ============================================================================
+
+def _signature(secret: str, expires: int, mode: str, path: str) -> str:
+    message = f"{expires}:{mode}:{path}".encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def sign_token(path: str, mode: str = "sample", ttl: int = 300, secret: Optional[str] = None) -> str:
+    """Crear un token "<expira>.<modo>.<firma>" para perfilar la ruta indicada"""
+    secret = secret or PROFILE_SECRET
+    if not secret:
+        raise ValueError("PROFILE_SECRET no está configurado")
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Modo no soportado: {mode}")
+    expires = int(time.time()) + min(ttl, PROFILE_MAX_TTL)
+    return f"{expires}.{mode}.{_signature(secret, expires, mode, path)}"
+
+
+def verify_token(token: str, path: str, secret: Optional[str] = None) -> Optional[str]:
+    """Retorna el modo si el token es válido para la ruta, o None"""
+    secret = secret or PROFILE_SECRET
+    if not secret or not token:
+        return None
+    try:
+        expires_str, mode, signature = token.split(".", 2)
+        expires = int(expires_str)
+    except ValueError:
+        return None
+
+    if mode not in PROFILE_MODES or expires < time.time() or expires > time.time() + PROFILE_MAX_TTL:
+        return None
+    if not hmac.compare_digest(signature, _signature(secret, expires, mode, path)):
+        return None
+    return mode
+
+
+def _request_token(scope) -> Optional[str]:
+    for name, value in scope.get("headers", []):
+        if name == b"x-profile-token":
+            return value.decode("latin-1")
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    values = query.get("profile_token")
+    return values[0] if values else None
+
+
+# ============================================================================
+# Perfiladores
+# ============================================================================
+
+class StackSampler:
+    """
+    Muestrea el stack de un hilo a intervalo fijo y acumula stacks colapsados.
+
+    Sólo cuenta las muestras tomadas entre resume() y pause().
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._active = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._active = False
+        self._stop.set()
+        self._thread.join()
+
+    def resume(self):
+        self._active = True
+
+    def pause(self):
+        self._active = False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self._active:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                # co_qualname sólo existe desde Python 3.11
+                name = getattr(code, "co_qualname", code.co_name)
+                names.append(f"{name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as fh:
+            for stack, count in self.stacks.most_common():
+                fh.write(f"{stack} {count}\n")
+
+
+class _DeterministicProfiler:
+    """cProfile activo sólo entre resume() y pause()"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.profile.disable()
+
+    def resume(self):
+        self.profile.enable()
+
+    def pause(self):
+        self.profile.disable()
+
+    def write(self, path: str):
+        self.profile.dump_stats(path)
+
+
+def _new_profiler(mode: str):
+    if mode == "cprofile":
+        return _DeterministicProfiler(), ".pstats"
+    return StackSampler(threading.get_ident()), ".folded"
+
+
+class TaskScoped:
+    """
+    Ejecuta una corrutina activando el perfilador sólo durante sus pasos.
+
+    Cada vez que la tarea del request retoma (send/throw) se llama a
+    profiler.resume(), y al volver al event loop a profiler.pause(): el tiempo
+    de otras tareas del mismo hilo no se mide.
+    """
+
+    def __init__(self, coro, profiler):
+        self.coro = coro
+        self.profiler = profiler
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.profiler.resume()
+            try:
+                if error is not None:
+                    yielded = self.coro.throw(error)
+                else:
+                    yielded = self.coro.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profiler.pause()
+            try:
+                value, error = (yield yielded), None
+            except BaseException as exc:
+                value, error = None, exc
+
+
+def _prune(directory: str, max_files: int):
+    """Conservar sólo los max_files perfiles más recientes"""
+    entries = [os.path.join(directory, name) for name in os.listdir(directory)]
+    entries = [p for p in entries if os.path.isfile(p)]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for stale in entries[max_files:]:
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+
+
+# ============================================================================
+# Middleware ASGI
+# ============================================================================
+
+class ProfilingMiddleware:
+    """Perfila los requests que traen un token firmado válido"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILE_SECRET:
+            await self.app(scope, receive, send)
+            return
+
+        token = _request_token(scope)
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+
+        mode = verify_token(token, scope["path"])
+        if mode is None:
+            metrics.increment("ciberseguria_profiles_total", result="rejected")
+            await self.app(scope, receive, send)
+            return
+
+        if not _slots.acquire(blocking=False):
+            metrics.increment("ciberseguria_profiles_total", result="busy")
+            await self.app(scope, receive, self._with_header(send, b"x-profile", b"busy"))
+            return
+
+        try:
+            profiler, extension = _new_profiler(mode)
+            filename = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}_{mode}{extension}"
+            profiler.start()
+            try:
+                await TaskScoped(
+                    self.app(scope, receive, self._with_header(send, b"x-profile-file", filename.encode())),
+                    profiler
+                )
+            finally:
+                profiler.stop()
+                self._save(profiler, filename, mode, scope["path"])
+        finally:
+            _slots.release()
+
+    @staticmethod
+    def _with_header(send, name: bytes, value: bytes):
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(name, value)]
+            await send(message)
+        return send_wrapper
+
+    @staticmethod
+    def _save(profiler, filename: str, mode: str, path: str):
+        try:
+            with _dir_lock:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                profiler.write(os.path.join(PROFILE_DIR, filename))
+                _prune(PROFILE_DIR, PROFILE_MAX_FILES)
+            metrics.increment("ciberseguria_profiles_total", result="saved", mode=mode)
+            logger.info("Perfil de %s guardado en %s", path, filename)
+        except OSError:
+            logger.exception("No se pudo guardar el perfil de %s", path)
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Firmar un token de perfilado para una ruta")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+    sign = subparsers.add_parser("sign", help="Generar un token para X-Profile-Token")
+    sign.add_argument("ruta", help="Ruta exacta del request (ej. /assessment/report/12/download)")
+    sign.add_argument("--modo", choices=PROFILE_MODES, default="sample")
+    sign.add_argument("--ttl", type=int, default=300, help="Vigencia en segundos (máx. 3600)")
+    args = parser.parse_args()
+
+    try:
+        print(sign_token(args.ruta, args.modo, args.ttl))
+    except ValueError as exc:
+        parser.error(str(exc))
+
+
+if __name__ == "__main__":
+    main()
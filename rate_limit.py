@@ -0,0 +1,170 @@
+"""
+Limitación de Tasa (Token Bucket en Memoria)
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Protege /login y /register frente a password spraying y reintentos
+descontrolados: las solicitudes excedentes se rechazan antes de cualquier
+hash bcrypt.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import metrics
+
+# Configuración de límites: "<solicitudes>/<segundos>"
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+RATE_LIMIT_LOGIN_IP = os.getenv("RATE_LIMIT_LOGIN_IP", "20/60")
+RATE_LIMIT_LOGIN_RUT = os.getenv("RATE_LIMIT_LOGIN_RUT", "5/60")
+RATE_LIMIT_REGISTER_IP = os.getenv("RATE_LIMIT_REGISTER_IP", "10/300")
+RATE_LIMIT_REGISTER_RUT = os.getenv("RATE_LIMIT_REGISTER_RUT", "3/300")
+RATE_LIMIT_SWEEP_SECONDS = float(os.getenv("RATE_LIMIT_SWEEP_SECONDS", "60"))
+
+metrics.describe(
+    "ciberseguria_rate_limit_rejected_total",
+    "Solicitudes rechazadas por el limitador de tasa"
+)
+
+
+def parse_rate(spec: str) -> Tuple[int, float]:
+    """Convertir '<solicitudes>/<segundos>' en (capacidad, tokens por segundo)"""
+    try:
+        requests, seconds = spec.split("/", 1)
+        capacity = int(requests)
+        period = float(seconds)
+    except ValueError:
+        raise ValueError(f"Límite de tasa inválido: {spec!r} (formato esperado: '20/60')")
+
+    if capacity <= 0 or period <= 0:
+        raise ValueError(f"Límite de tasa inválido: {spec!r}")
+
+    return capacity, capacity / period
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket por clave.
+
+    Cada clave ocupa una tupla (tokens, último_instante). Las claves inactivas
+    el tiempo suficiente para rellenar el bucket se eliminan en barridos
+    periódicos, de modo que la memoria depende sólo de los clientes recientes.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        refill_rate: float,
+        sweep_interval: float = RATE_LIMIT_SWEEP_SECONDS,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.capacity = float(capacity)
+        self.refill_rate = refill_rate
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = clock()
+        # Tiempo tras el cual un bucket inactivo ya está lleno y puede descartarse
+        self._idle_ttl = self.capacity / self.refill_rate
+
+    @classmethod
+    def from_spec(cls, spec: str, **kwargs) -> "TokenBucketLimiter":
+        """Crear limitador desde una especificación '<solicitudes>/<segundos>'"""
+        capacity, refill_rate = parse_rate(spec)
+        return cls(capacity, refill_rate, **kwargs)
+
+    def _refilled(self, key: str, now: float) -> float:
+        tokens, last = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - last) * self.refill_rate)
+
+    def acquire(self, key: str) -> float:
+        """
+        Consumir un token para la clave.
+
+        Retorna 0 si la solicitud está permitida, o los segundos de espera
+        sugeridos (Retry-After) si debe rechazarse.
+        """
+        now = self._clock()
+        with self._lock:
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+
+            tokens = self._refilled(key, now)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.refill_rate
+
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
+
+    def _sweep(self, now: float):
+        """Eliminar buckets inactivos (ya rellenados por completo)"""
+        expired = [
+            key for key, (_, last) in self._buckets.items()
+            if now - last >= self._idle_ttl
+        ]
+        for key in expired:
+            del self._buckets[key]
+        self._last_sweep = now
+
+    def reset(self):
+        """Vaciar todos los buckets"""
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def normalize_rut(rut: str) -> str:
+    """Normalizar RUT para usarlo como clave (sin puntos, guiones ni espacios)"""
+    return "".join(ch for ch in rut.upper() if ch.isalnum())
+
+
+class EndpointLimiter:
+    """Par de limitadores por IP y por RUT para un endpoint"""
+
+    def __init__(self, endpoint: str, ip_spec: str, rut_spec: str):
+        self.endpoint = endpoint
+        self.by_ip = TokenBucketLimiter.from_spec(ip_spec)
+        self.by_rut = TokenBucketLimiter.from_spec(rut_spec)
+
+    def check(self, client_ip: Optional[str], rut: Optional[str]) -> float:
+        """
+        Verificar ambos buckets. Retorna 0 si se permite la solicitud o los
+        segundos de espera si se rechaza.
+
+        El bucket por RUT sólo se consume si el de IP lo permite, para que un
+        atacante no agote los intentos de una cuenta ajena desde IPs bloqueadas.
+        """
+        if not RATE_LIMIT_ENABLED:
+            return 0.0
+
+        ip_key = client_ip or "unknown"
+        retry_after = self.by_ip.acquire(ip_key)
+        if retry_after:
+            metrics.increment(
+                "ciberseguria_rate_limit_rejected_total",
+                endpoint=self.endpoint, key="ip"
+            )
+            return retry_after
+
+        if rut:
+            retry_after = self.by_rut.acquire(normalize_rut(rut))
+            if retry_after:
+                metrics.increment(
+                    "ciberseguria_rate_limit_rejected_total",
+                    endpoint=self.endpoint, key="rut"
+                )
+                return retry_after
+
+        return 0.0
+
+    def reset(self):
+        self.by_ip.reset()
+        self.by_rut.reset()
+
+
+login_limiter = EndpointLimiter("login", RATE_LIMIT_LOGIN_IP, RATE_LIMIT_LOGIN_RUT)
+register_limiter = EndpointLimiter("register", RATE_LIMIT_REGISTER_IP, RATE_LIMIT_REGISTER_RUT)
@@ -0,0 +1,177 @@
+"""
+Registros de Sólo Lectura
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Las páginas que no escriben (dashboard, cuestionario, reporte y PDF) leen aquí
+sólo las columnas que usan, con consultas Core, y las guardan en objetos con
+__slots__. No pasan por el identity map ni por el seguimiento de cambios del
+ORM, así que cada request crea menos objetos y el GC trabaja menos.
+
+Las rutas que modifican datos siguen usando los modelos de models.py.
+"""
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import models
+
+
+class _Record:
+    """Base: un atributo por columna, en el orden de COLUMNS"""
+
+    __slots__ = ()
+    COLUMNS = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class AssessmentRecord(_Record):
+    __slots__ = ("id", "user_id", "fecha", "puntaje_final", "estado", "catalog_version_id", "revision", "empresa")
+    COLUMNS = (
+        models.Assessment.id,
+        models.Assessment.user_id,
+        models.Assessment.fecha,
+        models.Assessment.puntaje_final,
+        models.Assessment.estado,
+        models.Assessment.catalog_version_id,
+        models.Assessment.revision,
+        models.User.nombre_empresa,
+    )
+
+
+class CompanyRecord(_Record):
+    __slots__ = ("id", "nombre_empresa", "rut", "email_contacto")
+    COLUMNS = (
+        models.User.id,
+        models.User.nombre_empresa,
+        models.User.rut,
+        models.User.email_contacto,
+    )
+
+
+class AnswerRecord(_Record):
+    __slots__ = ("question_id", "respuesta", "evidencia_adjunta")
+    COLUMNS = (
+        models.Answer.question_id,
+        models.Answer.respuesta,
+        models.Answer.evidencia_adjunta,
+    )
+
+
+class AnswerStateRecord(_Record):
+    """Respuesta sin el texto de evidencia (estadísticas y brechas)"""
+    __slots__ = ("question_id", "respuesta")
+    COLUMNS = (
+        models.Answer.question_id,
+        models.Answer.respuesta,
+    )
+
+
+class AttachmentRecord(_Record):
+    __slots__ = ("id", "question_id", "digest", "filename", "content_type", "size_bytes")
+    COLUMNS = (
+        models.EvidenceAttachment.id,
+        models.EvidenceAttachment.question_id,
+        models.EvidenceAttachment.digest,
+        models.EvidenceAttachment.filename,
+        models.EvidenceAttachment.content_type,
+        models.EvidenceAttachment.size_bytes,
+    )
+
+    @property
+    def is_image(self) -> bool:
+        return self.content_type.startswith("image/")
+
+
+def _assessment_select():
+    return select(*AssessmentRecord.COLUMNS).join(models.User, models.User.id == models.Assessment.user_id)
+
+
+def get_assessment(db: Session, assessment_id: int, user_id: Optional[int] = None) -> Optional[AssessmentRecord]:
+    """Assessment por ID (opcionalmente, sólo si pertenece al usuario)"""
+    stmt = _assessment_select().where(models.Assessment.id == assessment_id)
+    if user_id is not None:
+        stmt = stmt.where(models.Assessment.user_id == user_id)
+    row = db.execute(stmt).first()
+    return AssessmentRecord(*row) if row else None
+
+
+def get_report_assessment(db: Session, assessment_id: int, user: models.User) -> Optional[AssessmentRecord]:
+    """Assessment del usuario o, para un consultor, de uno de sus clientes"""
+    stmt = _assessment_select().where(models.Assessment.id == assessment_id)
+    if user.es_consultor:
+        stmt = stmt.where((models.Assessment.user_id == user.id) | (models.User.consultor_id == user.id))
+    else:
+        stmt = stmt.where(models.Assessment.user_id == user.id)
+    row = db.execute(stmt).first()
+    return AssessmentRecord(*row) if row else None
+
+
+def list_assessments(db: Session, user_id: int) -> List[AssessmentRecord]:
+    """Assessments de un usuario, del más reciente al más antiguo"""
+    stmt = _assessment_select().where(
+        models.Assessment.user_id == user_id
+    ).order_by(models.Assessment.fecha.desc())
+    return [AssessmentRecord(*row) for row in db.execute(stmt)]
+
+
+def assessments_version(db: Session, user_id: int) -> Tuple[int, int, int]:
+    """
+    (cantidad, suma de revisiones, id máximo) de los assessments del usuario:
+    cambia al crear uno o al modificar cualquiera (base del ETag del dashboard).
+    """
+    row = db.execute(
+        select(
+            func.count(models.Assessment.id),
+            func.coalesce(func.sum(models.Assessment.revision), 0),
+            func.coalesce(func.max(models.Assessment.id), 0),
+        ).where(models.Assessment.user_id == user_id)
+    ).one()
+    return tuple(row)
+
+
+def get_company(db: Session, user_id: int) -> Optional[CompanyRecord]:
+    row = db.execute(select(*CompanyRecord.COLUMNS).where(models.User.id == user_id)).first()
+    return CompanyRecord(*row) if row else None
+
+
+def get_answers(db: Session, assessment_id: int) -> List[AnswerRecord]:
+    stmt = select(*AnswerRecord.COLUMNS).where(models.Answer.assessment_id == assessment_id)
+    return [AnswerRecord(*row) for row in db.execute(stmt)]
+
+
+def get_answer_states(db: Session, assessment_id: int) -> List[AnswerStateRecord]:
+    stmt = select(*AnswerStateRecord.COLUMNS).where(models.Answer.assessment_id == assessment_id)
+    return [AnswerStateRecord(*row) for row in db.execute(stmt)]
+
+
+def iter_answers(db: Session, assessment_id: int, question_ids: Sequence[int],
+                 batch_size: int = 200) -> Iterator[AnswerRecord]:
+    """
+    Respuestas con evidencia de question_ids, en ese mismo orden (el del índice
+    del catálogo), leídas por lotes: nunca están todas en memoria a la vez.
+    """
+    for start in range(0, len(question_ids), batch_size):
+        batch = question_ids[start:start + batch_size]
+        stmt = select(*AnswerRecord.COLUMNS).where(
+            models.Answer.assessment_id == assessment_id,
+            models.Answer.question_id.in_(batch)
+        )
+        rows = {row.question_id: AnswerRecord(*row) for row in db.execute(stmt)}
+        for question_id in batch:
+            if question_id in rows:
+                yield rows[question_id]
+
+
+def get_attachments(db: Session, assessment_id: int) -> List[AttachmentRecord]:
+    stmt = select(*AttachmentRecord.COLUMNS).where(
+        models.EvidenceAttachment.assessment_id == assessment_id
+    ).order_by(models.EvidenceAttachment.id)
+    return [AttachmentRecord(*row) for row in db.execute(stmt)]
@@ -0,0 +1,134 @@
+"""
+Revocación de Tokens de API
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Los tokens JWT llevan los datos que usan las rutas (id, RUT, empresa, si es
+consultor y la versión de token del usuario), así que se validan sin
+consultar la base. Para que cerrar sesión o cambiar la contraseña surtan
+efecto igual, cada proceso mantiene en memoria las revocaciones vigentes:
+
+- jti revocados (logout de un token)
+- versión mínima de token por usuario (cambio de contraseña o de rol: todos
+  los tokens emitidos antes quedan inválidos)
+
+Cada REVOCATION_REFRESH_SECONDS se leen sólo las filas nuevas de
+token_revocations; el proceso que revoca recarga de inmediato. Una revocación
+se descarta (en memoria y en la base) cuando ya expiraron los tokens que cubre,
+así que la lista no crece más allá de la duración de un token.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+import metrics
+import models
+from database import SessionLocal
+
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "5"))
+
+logger = logging.getLogger("ciberseguria.revocation")
+
+metrics.describe("ciberseguria_tokens_revoked_total", "Revocaciones de tokens de API, por motivo")
+metrics.describe("ciberseguria_tokens_rejected_total", "Tokens de API válidos rechazados por estar revocados")
+
+
+def record(db: Session, user_id: int, expires_at: datetime, jti: Optional[str] = None,
+           token_version: Optional[int] = None):
+    """
+    Registrar una revocación (sin commit): un token por su jti, o todos los
+    tokens del usuario con versión menor a token_version.
+    """
+    # Las revocaciones vencidas ya no cubren ningún token
+    db.query(models.TokenRevocation).filter(
+        models.TokenRevocation.expires_at < datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.add(models.TokenRevocation(user_id=user_id, jti=jti, token_version=token_version, expires_at=expires_at))
+    metrics.increment("ciberseguria_tokens_revoked_total", motivo="token" if jti else "version")
+
+
+class RevocationList:
+    """jti revocados y versión mínima por usuario, al día con token_revocations"""
+
+    def __init__(self, session_factory=SessionLocal, refresh_seconds: float = REVOCATION_REFRESH_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.session_factory = session_factory
+        self.refresh_seconds = refresh_seconds
+        self._clock = clock
+        self._jtis: Dict[str, datetime] = {}  # jti -> expiración
+        self._min_versions: Dict[int, Tuple[int, datetime]] = {}  # user_id -> (versión mínima, expiración)
+        self._last_id = 0
+        self._checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def is_revoked(self, user_id: int, token_version: int, jti: str) -> bool:
+        self.refresh()
+        if jti in self._jtis:
+            return True
+        entry = self._min_versions.get(user_id)
+        return entry is not None and token_version < entry[0]
+
+    def _due(self) -> bool:
+        return self._checked_at is None or self._clock() - self._checked_at >= self.refresh_seconds
+
+    def refresh(self, force: bool = False):
+        """Leer las revocaciones nuevas (a lo más una vez por intervalo, salvo force)"""
+        if not force and not self._due():
+            return
+        with self._lock:
+            if not force and not self._due():
+                return
+            now = datetime.utcnow()
+            db = self.session_factory()
+            try:
+                rows = db.query(
+                    models.TokenRevocation.id,
+                    models.TokenRevocation.user_id,
+                    models.TokenRevocation.jti,
+                    models.TokenRevocation.token_version,
+                    models.TokenRevocation.expires_at,
+                ).filter(
+                    models.TokenRevocation.id > self._last_id,
+                    models.TokenRevocation.expires_at > now
+                ).order_by(models.TokenRevocation.id).all()
+            except SQLAlchemyError:
+                # Se sigue con la lista anterior y se reintenta en el próximo intervalo
+                logger.warning("No se pudieron leer las revocaciones de tokens", exc_info=True)
+                self._checked_at = self._clock()
+                return
+            finally:
+                db.close()
+
+            for row_id, user_id, jti, token_version, expires_at in rows:
+                if jti:
+                    self._jtis[jti] = expires_at
+                if token_version is not None:
+                    current = self._min_versions.get(user_id)
+                    if current is None or token_version >= current[0]:
+                        self._min_versions[user_id] = (token_version, expires_at)
+                self._last_id = row_id
+
+            # Revocaciones cuyos tokens ya expiraron
+            self._jtis = {jti: expires for jti, expires in self._jtis.items() if expires > now}
+            self._min_versions = {
+                user_id: entry for user_id, entry in self._min_versions.items() if entry[1] > now
+            }
+            self._checked_at = self._clock()
+
+    def clear(self):
+        with self._lock:
+            self._jtis.clear()
+            self._min_versions.clear()
+            self._last_id = 0
+            self._checked_at = None
+
+    def __len__(self):
+        return len(self._jtis) + len(self._min_versions)
+
+
+revocations = RevocationList()
@@ -0,0 +1,377 @@
+"""
+Búsqueda de Texto Completo (SQLite FTS5)
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Índices FTS5 sobre el texto de los controles (dominio, subdominio, pregunta,
+descripción y referencia legal) y sobre la evidencia de las respuestas. Son
+tablas de contenido externo: el texto sigue viviendo en questions y answers, y
+los triggers mantienen el índice al insertar, modificar o eliminar filas, sin
+que las rutas que escriben tengan que hacer nada.
+
+La búsqueda retorna respuestas (cliente, assessment y control), ordenadas por
+relevancia bm25, con filtros por estado de la respuesta, cliente y control, y
+paginación por cursor.
+"""
+import logging
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import column, func, inspect, literal, literal_column, or_, select, table, tuple_, union_all
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import gaps
+import models
+from portfolio import PortfolioError, decode_cursor, encode_cursor
+
+logger = logging.getLogger("ciberseguria.search")
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_MAX_RESULTS = 1000  # Coincidencias alcanzables por búsqueda (por índice)
+SEARCH_MAX_TERMS = 16
+SEARCH_SNIPPET_TOKENS = 12
+
+# Dónde buscar: evidencia de las respuestas, texto de los controles o ambos
+SEARCH_SCOPES = ("todo", "evidencia", "control")
+
+# Pesos bm25 por columna de questions_fts (mismo orden que QUESTION_COLUMNS)
+QUESTION_COLUMNS = ("dominio", "subdominio", "pregunta", "descripcion", "referencia_legal")
+QUESTION_WEIGHTS = (1.0, 1.0, 4.0, 2.0, 3.0)
+
+# "Políticas" encuentra "politicas" y viceversa
+_TOKENIZER = "unicode61 remove_diacritics 2"
+
+_RESPUESTAS = {respuesta.value.lower().replace("/", ""): respuesta for respuesta in models.RespuestaEnum}
+
+# Tabla de contenido -> (índice FTS5, columnas indexadas)
+FTS_INDEXES = {
+    "questions": ("questions_fts", QUESTION_COLUMNS),
+    "answers": ("answers_fts", ("evidencia_adjunta",)),
+}
+
+
+def _schema(fts: str, source: str, columns: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Índice de contenido externo y triggers que replican en él los cambios"""
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{name}" for name in columns)
+    old = ", ".join(f"old.{name}" for name in columns)
+    insert = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});"
+    delete = f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    return (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{names}, content='{source}', content_rowid='id', tokenize='{_TOKENIZER}')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {names} ON {source} "
+        f"BEGIN {delete} {insert} END",
+    )
+
+
+# Tablas FTS para las consultas Core (rowid = id de la fila de contenido)
+questions_fts = table("questions_fts", column("rowid"), *(column(name) for name in QUESTION_COLUMNS))
+answers_fts = table("answers_fts", column("rowid"), column("evidencia_adjunta"))
+
+
+class SearchError(Exception):
+    """Parámetros de búsqueda inválidos"""
+
+
+class SearchUnavailable(Exception):
+    """La base de datos no tiene los índices FTS5 (SQLite sin FTS5 u otro motor)"""
+
+
+# ============================================================================
+# ESQUEMA
+# ============================================================================
+
+def install(connection, sources: Tuple[str, ...] = tuple(FTS_INDEXES)):
+    """
+    Crear índices y triggers si no existen (idempotente, lo llama init_db).
+
+    sources limita las tablas indexadas (un shard sólo tiene answers). Un índice
+    recién creado se llena con 'rebuild' desde su tabla de contenido; en una
+    base grande esto ocurre una sola vez, en el primer arranque.
+    """
+    if connection.dialect.name != "sqlite":
+        logger.info("Búsqueda de texto completo deshabilitada: requiere SQLite con FTS5")
+        return
+
+    existing = set(inspect(connection).get_table_names())
+    for source in sources:
+        fts, columns = FTS_INDEXES[source]
+        create_table, *triggers = _schema(fts, source, columns)
+        try:
+            connection.exec_driver_sql(create_table)
+        except OperationalError as exc:
+            logger.warning("Búsqueda de texto completo deshabilitada: %s", exc.orig)
+            return
+        for ddl in triggers:
+            connection.exec_driver_sql(ddl)
+
+        if fts not in existing:
+            started = time.perf_counter()
+            connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+            logger.info("Índice %s construido en %.1fs", fts, time.perf_counter() - started)
+
+
+# ============================================================================
+# CONSULTA
+# ============================================================================
+
+def match_expression(q: str) -> str:
+    """
+    Consulta FTS5 a partir del texto del usuario.
+
+    Cada palabra (o "frase entre comillas") se busca literal y todas deben
+    aparecer; un * final busca por prefijo (ej. respal*). Así la sintaxis de
+    FTS5 (AND, NEAR, paréntesis, columnas) nunca produce errores de consulta.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', q or ""):
+        term = phrase if phrase else word
+        prefix = not phrase and term.endswith("*")
+        term = term.replace('"', "").strip("*").strip()
+        if term:
+            terms.append(f'"{term}"' + ("*" if prefix else ""))
+    if not terms:
+        raise SearchError("Ingrese un texto para buscar")
+    if len(terms) > SEARCH_MAX_TERMS:
+        raise SearchError(f"La búsqueda admite hasta {SEARCH_MAX_TERMS} términos")
+    return " ".join(terms)
+
+
+def parse_respuestas(value: Optional[str]) -> Tuple[models.RespuestaEnum, ...]:
+    """Estados separados por coma: si, no, parcial, na (o "Parcial", "N/A")"""
+    if not value:
+        return ()
+    respuestas = []
+    for item in value.split(","):
+        key = item.strip().lower().replace("/", "")
+        if key not in _RESPUESTAS:
+            raise SearchError(f"Respuesta inválida: {item.strip()} (si, no, parcial o na)")
+        respuestas.append(_RESPUESTAS[key])
+    return tuple(respuestas)
+
+
+@dataclass
+class SearchFilters:
+    q: str
+    en: str = "todo"
+    respuestas: Tuple[models.RespuestaEnum, ...] = ()
+    user_id: Optional[int] = None  # Cliente
+    dominio: Optional[str] = None
+    marco: Optional[str] = None
+    control: Optional[str] = None  # Prefijo del control, requiere marco
+    limit: int = SEARCH_PAGE_SIZE
+    cursor: Optional[str] = None
+
+    def validate(self):
+        if self.en not in SEARCH_SCOPES:
+            raise SearchError(f"Ámbito inválido: {self.en} ({', '.join(SEARCH_SCOPES)})")
+        if not 1 <= self.limit <= SEARCH_MAX_PAGE_SIZE:
+            raise SearchError(f"limit debe estar entre 1 y {SEARCH_MAX_PAGE_SIZE}")
+        try:
+            gaps.GapFilters(dominio=self.dominio, marco=self.marco, control=self.control).validate()
+        except gaps.GapQueryError as exc:
+            raise SearchError(str(exc))
+        match_expression(self.q)
+        self.decoded_cursor()
+
+    def decoded_cursor(self) -> Optional[Tuple[float, int]]:
+        if not self.cursor:
+            return None
+        try:
+            rank, answer_id = decode_cursor(self.cursor)
+            return float(rank), answer_id
+        except (PortfolioError, TypeError, ValueError):
+            raise SearchError("Cursor inválido")
+
+
+@dataclass
+class SearchHit:
+    answer_id: int
+    assessment_id: int
+    fecha: Optional[datetime]
+    user_id: int
+    nombre_empresa: str
+    question_id: int
+    dominio: str
+    pregunta: str
+    referencia_legal: Optional[str]
+    respuesta: models.RespuestaEnum
+    coincidencia: str  # "evidencia" o "control"
+    fragmento: Optional[str]
+    rank: float
+
+    def to_dict(self) -> dict:
+        return {
+            "answer_id": self.answer_id,
+            "assessment_id": self.assessment_id,
+            "fecha": self.fecha.isoformat(timespec="seconds") if self.fecha else None,
+            "user_id": self.user_id,
+            "nombre_empresa": self.nombre_empresa,
+            "question_id": self.question_id,
+            "dominio": self.dominio,
+            "pregunta": self.pregunta,
+            "referencia_legal": self.referencia_legal,
+            "respuesta": self.respuesta.value,
+            "coincidencia": self.coincidencia,
+            "fragmento": self.fragmento,
+            "score": round(-self.rank, 4),
+        }
+
+
+def _visible_assessments(user: models.User, filters: SearchFilters):
+    """Ids de los assessments visibles para el usuario (propios o de sus clientes)"""
+    stmt = select(models.Assessment.id).join(models.User, models.User.id == models.Assessment.user_id)
+    if user.es_consultor:
+        stmt = stmt.where(or_(models.User.id == user.id, models.User.consultor_id == user.id))
+    else:
+        stmt = stmt.where(models.User.id == user.id)
+    if filters.user_id is not None:
+        stmt = stmt.where(models.User.id == filters.user_id)
+    return stmt
+
+
+def _answer_conditions(user: models.User, filters: SearchFilters) -> list:
+    """
+    Alcance y filtros sobre answers (y questions, que cada rama une).
+
+    El alcance va como assessment_id IN (subconsulta): SQLite materializa la
+    lista de assessments visibles y la cruza con ix_answers_assessment_question,
+    en vez de recorrer todas las respuestas de un control.
+    """
+    conditions = [models.Answer.assessment_id.in_(_visible_assessments(user, filters))]
+    if filters.respuestas:
+        conditions.append(models.Answer.respuesta.in_(filters.respuestas))
+    conditions.extend(gaps.question_filters(
+        gaps.GapFilters(dominio=filters.dominio, marco=filters.marco, control=filters.control)
+    ))
+    return conditions
+
+
+def _evidence_branch(match: str, conditions: list, snippet_args: tuple):
+    """Respuestas cuya evidencia coincide (el índice de evidencia manda)"""
+    fts = literal_column("answers_fts")
+    rank = func.bm25(fts)
+    return (
+        select(
+            models.Answer.id.label("answer_id"),
+            rank.label("rank"),
+            func.snippet(fts, 0, *snippet_args).label("fragmento"),
+            literal("evidencia").label("coincidencia"),
+        )
+        .select_from(answers_fts)
+        .join(models.Answer, models.Answer.id == answers_fts.c.rowid)
+        .join(models.Question, models.Question.id == models.Answer.question_id)
+        .where(fts.op("MATCH")(match), *conditions)
+        .order_by(rank)
+        .limit(SEARCH_MAX_RESULTS)
+    )
+
+
+def _control_branch(match: str, conditions: list, snippet_args: tuple):
+    """Respuestas a los controles cuyo texto coincide"""
+    fts = literal_column("questions_fts")
+    rank = func.bm25(fts, *QUESTION_WEIGHTS)
+    # Controles coincidentes primero (bm25() y snippet() deben evaluarse en la
+    # consulta del MATCH; el LIMIT evita que SQLite aplane la subconsulta)
+    matched = (
+        select(
+            questions_fts.c.rowid.label("question_id"),
+            rank.label("rank"),
+            func.snippet(fts, -1, *snippet_args).label("fragmento"),
+        )
+        .where(fts.op("MATCH")(match))
+        .order_by(rank)
+        .limit(SEARCH_MAX_RESULTS)
+        .subquery("matched")
+    )
+    return (
+        select(
+            models.Answer.id.label("answer_id"),
+            matched.c.rank,
+            matched.c.fragmento,
+            literal("control").label("coincidencia"),
+        )
+        .select_from(matched)
+        .join(models.Answer, models.Answer.question_id == matched.c.question_id)
+        .join(models.Question, models.Question.id == models.Answer.question_id)
+        .where(*conditions)
+        .order_by(matched.c.rank, models.Answer.id)
+        .limit(SEARCH_MAX_RESULTS)
+    )
+
+
+def build_search_query(user: models.User, filters: SearchFilters):
+    """Consulta de búsqueda con alcance, filtros, orden bm25 y cursor en SQL"""
+    filters.validate()
+    match = match_expression(filters.q)
+    conditions = _answer_conditions(user, filters)
+    snippet_args = ("«", "»", "…", SEARCH_SNIPPET_TOKENS)
+
+    branches = []
+    if filters.en in ("todo", "evidencia"):
+        branches.append(_evidence_branch(match, conditions, snippet_args))
+    if filters.en in ("todo", "control"):
+        branches.append(_control_branch(match, conditions, snippet_args))
+
+    hits = union_all(*(branch.subquery().select() for branch in branches)).subquery("hits")
+    # Una fila por respuesta: con min() SQLite toma las demás columnas de la
+    # fila con mejor rank (la coincidencia más relevante)
+    best = select(
+        hits.c.answer_id,
+        func.min(hits.c.rank).label("rank"),
+        hits.c.fragmento,
+        hits.c.coincidencia,
+    ).group_by(hits.c.answer_id).subquery("best")
+
+    stmt = (
+        select(
+            models.Answer.id,
+            models.Assessment.id,
+            models.Assessment.fecha,
+            models.User.id,
+            models.User.nombre_empresa,
+            models.Question.id,
+            models.Question.dominio,
+            models.Question.pregunta,
+            models.Question.referencia_legal,
+            models.Answer.respuesta,
+            best.c.coincidencia,
+            best.c.fragmento,
+            best.c.rank,
+        )
+        .select_from(best)
+        .join(models.Answer, models.Answer.id == best.c.answer_id)
+        .join(models.Assessment, models.Assessment.id == models.Answer.assessment_id)
+        .join(models.User, models.User.id == models.Assessment.user_id)
+        .join(models.Question, models.Question.id == models.Answer.question_id)
+        .order_by(best.c.rank, best.c.answer_id)
+        .limit(filters.limit + 1)
+    )
+    cursor = filters.decoded_cursor()
+    if cursor is not None:
+        stmt = stmt.where(tuple_(best.c.rank, best.c.answer_id) > tuple_(*cursor))
+    return stmt
+
+
+def search(db: Session, user: models.User, filters: SearchFilters) -> Tuple[List[SearchHit], Optional[str]]:
+    """Página de resultados y cursor de la siguiente (None si es la última)"""
+    stmt = build_search_query(user, filters)
+    try:
+        hits = [SearchHit(*row) for row in db.execute(stmt)]
+    except OperationalError as exc:
+        if "fts" in str(exc.orig) or "no such module" in str(exc.orig):
+            raise SearchUnavailable(str(exc.orig))
+        raise
+
+    next_cursor = None
+    if len(hits) > filters.limit:
+        hits = hits[:filters.limit]
+        next_cursor = encode_cursor(hits[-1].rank, hits[-1].answer_id)
+    return hits, next_cursor
@@ -9,29 +9,33 @@ Carga preguntas iniciales basadas en:
 
 Ejecutar con: python seed.py
 """
-from database import SessionLocal, engine
+from datetime import datetime
+
+from database import SessionLocal, init_db
+import catalog
 import models
 
-# Crear tablas si no existen
-models.Base.metadata.create_all(bind=engine)
+# Crear tablas si no existen (y migrar un catálogo anterior sin versión)
+init_db()
 
 
 def seed_questions():
-    """Poblar la base de datos con preguntas del cuestionario SGSI"""
+    """Crear una versión del catálogo de preguntas del cuestionario SGSI"""
     db = SessionLocal()
 
-    # Verificar si ya existen preguntas
-    existing_count = db.query(models.Question).count()
-    if existing_count > 0:
-        print(f"⚠️  Ya existen {existing_count} preguntas en la base de datos.")
-        response = input("¿Deseas eliminar todas y recargar? (s/N): ")
+    # Verificar si ya existe un catálogo vigente
+    vigente = db.query(models.CatalogVersion).filter(models.CatalogVersion.vigente.is_(True)).first()
+    if vigente is not None:
+        existing_count = db.query(models.Question).filter(
+            models.Question.catalog_version_id == vigente.id
+        ).count()
+        print(f"⚠️  Ya existe el catálogo vigente '{vigente.etiqueta}' con {existing_count} preguntas.")
+        response = input("¿Deseas crear una nueva versión del catálogo? (s/N): ")
         if response.lower() != 's':
             print("Operación cancelada.")
             return
-        # Eliminar todas las preguntas existentes
-        db.query(models.Question).delete()
-        db.commit()
-        print("✓ Preguntas anteriores eliminadas.")
+        # Las versiones anteriores se conservan: los assessments existentes
+        # siguen evaluándose y reportándose con su propia versión
 
     # Lista de preguntas basadas en ISO 27001 y Ley 21.663
     questions = [
@@ -362,24 +366,20 @@ def seed_questions():
         }
     ]
 
-    # Insertar preguntas
-    print("📝 Insertando preguntas en la base de datos...")
-    for q_data in questions:
-        question = models.Question(**q_data)
-        db.add(question)
-
-    db.commit()
-    print(f"✅ {len(questions)} preguntas insertadas correctamente.")
+    # Insertar preguntas como una versión nueva del catálogo
+    print("📝 Creando versión del catálogo en la base de datos...")
+    etiqueta = datetime.now().strftime("%Y.%m.%d-%H%M")
+    version = catalog.create_version(db, etiqueta, questions)
+    print(f"✅ Versión '{version.etiqueta}' creada con {len(questions)} preguntas.")
     print("\n📊 Resumen por dominio:")
 
-    # Contar por dominio
-    dominios = db.query(models.Question.dominio, models.Question).all()
-    dominio_count = {}
-    for dominio, _ in dominios:
-        dominio_count[dominio] = dominio_count.get(dominio, 0) + 1
+    index = catalog.get_catalog(db, version.id)
+    for dominio in sorted(index.domains):
+        print(f"   {dominio}: {len(index.by_domain[dominio])} preguntas")
 
-    for dominio, count in sorted(dominio_count.items()):
-        print(f"   {dominio}: {count} preguntas")
+    print("\n🔗 Controles mapeados por marco:")
+    for codigo, question_ids in index.by_framework.items():
+        print(f"   {catalog.FRAMEWORKS[codigo]}: {len(question_ids)} preguntas")
 
     db.close()
 
@@ -0,0 +1,58 @@
+"""
+Lanzador de Producción Multi-Proceso
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Crea el esquema de la base de datos una sola vez y luego levanta N workers
+de uvicorn, de modo que los workers no compiten creando tablas al arrancar.
+
+Ejecutar con: python serve.py [--workers N] [--host 0.0.0.0] [--port 8000]
+"""
+import argparse
+import os
+
+import uvicorn
+
+from database import init_db
+
+# Espera máxima a las conexiones abiertas al detener un worker: los streams de
+# /api/events no terminan solos (el navegador se reconecta tras el corte)
+GRACEFUL_SHUTDOWN_SECONDS = float(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "10"))
+
+
+def default_workers() -> int:
+    """Número de workers: WEB_CONCURRENCY o la cantidad de CPUs disponibles"""
+    configured = os.getenv("WEB_CONCURRENCY")
+    if configured:
+        return max(1, int(configured))
+
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    return max(1, cpus)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor multi-proceso de CiberSegurIA")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=default_workers())
+    args = parser.parse_args()
+
+    # Esquema una sola vez, antes de crear los workers
+    init_db()
+    os.environ["CIBERSEGURIA_SCHEMA_READY"] = "1"
+
+    print(f"🚀 Iniciando CiberSegurIA con {args.workers} worker(s) en {args.host}:{args.port}")
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        proxy_headers=True,
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS
+    )
+
+
+if __name__ == "__main__":
+    main()
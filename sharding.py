@@ -0,0 +1,404 @@
+"""
+Shards por Organización (SQLite)
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Modo opcional (SHARDING_ENABLED=1). La base principal (DATABASE_URL) conserva
+usuarios y catálogo, y los assessments, respuestas y adjuntos de cada
+organización viven en su propio archivo (SHARD_DIR/org_<user_id>.db). Cada
+archivo tiene su propio lock de escritura, de modo que los envíos de clientes
+distintos ya no se esperan entre sí, y respaldar o eliminar los datos de un
+cliente es copiar o borrar un archivo.
+
+- Las conexiones de un shard adjuntan la base principal (ATTACH): los nombres
+  sin esquema resuelven primero en el shard (assessments, answers) y luego en
+  la principal (users, questions), así que las consultas no cambian.
+- Los ids de assessment llevan la organización: id // SHARD_ID_SPAN = user_id.
+  Las rutas /assessment/{id} se enrutan sin consultar la base.
+- El router mantiene un LRU acotado de engines abiertos (SHARD_MAX_OPEN).
+- Las vistas que cruzan clientes (portafolio) copian el último diagnóstico
+  completado de cada cliente a tablas TEMP de una conexión a la principal y
+  ejecutan la misma consulta.
+
+Uso:
+    python sharding.py migrar                 # Mover los assessments existentes a sus shards
+    python sharding.py listar
+    python sharding.py respaldar 42 org_42.bak.db
+    python sharding.py eliminar 42
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from fastapi import Request
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+import metrics
+import models
+import search
+import tracing
+from database import SQLALCHEMY_DATABASE_URL, Base, add_missing_columns
+from portfolio import BRECHA_RESPUESTAS
+
+SHARD_DIR = os.getenv("SHARD_DIR", "shards")
+SHARD_MAX_OPEN = int(os.getenv("SHARD_MAX_OPEN", "64"))  # Engines abiertos a la vez (LRU)
+SHARD_POOL_SIZE = int(os.getenv("SHARD_POOL_SIZE", "2"))
+SHARD_MAX_OVERFLOW = int(os.getenv("SHARD_MAX_OVERFLOW", "4"))
+
+# Rango de ids de assessment por organización: user_id * SHARD_ID_SPAN + n
+SHARD_ID_SPAN = 1_000_000_000
+
+# Tablas que viven en el shard; el resto queda en la base principal
+SHARDED_TABLES = ("assessments", "answers", "evidence_attachments")
+MAIN_ALIAS = "principal"
+
+_SHARD_FILE = re.compile(r"^org_(\d+)\.db$")
+
+metrics.describe("ciberseguria_shard_engines_opened_total", "Engines de shard abiertos")
+metrics.describe("ciberseguria_shard_engines_evicted_total", "Engines de shard cerrados por el LRU")
+
+
+class ShardError(Exception):
+    """Configuración o uso inválido de los shards"""
+
+
+def main_database_path() -> str:
+    """Archivo de la base principal (los shards requieren SQLite en archivo)"""
+    url = make_url(SQLALCHEMY_DATABASE_URL)
+    if url.get_backend_name() != "sqlite" or not url.database or url.database == ":memory:":
+        raise ShardError("SHARDING_ENABLED requiere una DATABASE_URL de SQLite en archivo")
+    return os.path.abspath(url.database)
+
+
+def tenant_of(assessment_id: int) -> Optional[int]:
+    """Organización dueña de un assessment (None para ids anteriores a los shards)"""
+    return assessment_id // SHARD_ID_SPAN or None
+
+
+def assessment_id_for(db: Session, tenant_id: int) -> Optional[int]:
+    """
+    Id explícito para el primer assessment del shard.
+
+    Los siguientes los asigna SQLite (max(id) + 1), que ya queda dentro del
+    rango de la organización.
+    """
+    if db.execute(select(models.Assessment.id).limit(1)).first() is None:
+        return tenant_id * SHARD_ID_SPAN + 1
+    return None
+
+
+def _table_columns(name: str) -> str:
+    return ", ".join(column.name for column in Base.metadata.tables[name].columns)
+
+
+def _shifted_columns(name: str, id_column: str) -> str:
+    """Columnas de la tabla con el id de assessment llevado al rango de la organización"""
+    return ", ".join(
+        f"{column.name} + :offset" if column.name == id_column else column.name
+        for column in Base.metadata.tables[name].columns
+    )
+
+
+# ============================================================================
+# ROUTER
+# ============================================================================
+
+class ShardRouter:
+    """Engines de los shards, abiertos bajo demanda y cerrados por LRU"""
+
+    def __init__(self, directory: str = SHARD_DIR, max_open: int = SHARD_MAX_OPEN):
+        self.directory = directory
+        self.max_open = max_open
+        self._engines: "OrderedDict[int, object]" = OrderedDict()
+        self._initialized = set()  # Shards con el esquema verificado en este proceso
+        self._lock = threading.Lock()
+
+    def path(self, tenant_id: int) -> str:
+        return os.path.join(self.directory, f"org_{tenant_id}.db")
+
+    def exists(self, tenant_id: int) -> bool:
+        return os.path.exists(self.path(tenant_id))
+
+    def tenants(self) -> List[int]:
+        """Organizaciones con shard, en orden de id"""
+        if not os.path.isdir(self.directory):
+            return []
+        found = (_SHARD_FILE.match(name) for name in os.listdir(self.directory))
+        return sorted(int(match.group(1)) for match in found if match)
+
+    def _init_schema(self, tenant_id: int):
+        """
+        Tablas, índices y búsqueda del shard (idempotente).
+
+        Se hace sin la base principal adjunta: con ella, la verificación de
+        tablas existentes vería las de la principal y no crearía las del shard.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        init_engine = create_engine(f"sqlite:///{self.path(tenant_id)}", poolclass=NullPool)
+        try:
+            with init_engine.begin() as connection:
+                Base.metadata.create_all(connection, tables=[Base.metadata.tables[name] for name in SHARDED_TABLES])
+                add_missing_columns(connection)
+                search.install(connection, sources=("answers",))
+        finally:
+            init_engine.dispose()
+
+    def ensure_schema(self, tenant_id: int):
+        """Poner al día el esquema del shard una vez por proceso (columnas nuevas del modelo)"""
+        if tenant_id not in self._initialized:
+            self._init_schema(tenant_id)
+            self._initialized.add(tenant_id)
+
+    def _open(self, tenant_id: int):
+        self.ensure_schema(tenant_id)
+
+        main_path = main_database_path()
+        shard_engine = create_engine(
+            f"sqlite:///{self.path(tenant_id)}",
+            connect_args={"check_same_thread": False},
+            pool_size=SHARD_POOL_SIZE,
+            max_overflow=SHARD_MAX_OVERFLOW,
+        )
+
+        @event.listens_for(shard_engine, "connect")
+        def _attach_main(dbapi_connection, connection_record):
+            dbapi_connection.execute(f"ATTACH DATABASE ? AS {MAIN_ALIAS}", (main_path,))
+
+        tracing.instrument_engine(shard_engine, "shard")
+        metrics.increment("ciberseguria_shard_engines_opened_total")
+        return shard_engine
+
+    def engine(self, tenant_id: int, create: bool = True):
+        """Engine del shard; con create=False, None si el shard no existe"""
+        evicted = []
+        with self._lock:
+            shard_engine = self._engines.get(tenant_id)
+            if shard_engine is not None:
+                self._engines.move_to_end(tenant_id)
+                return shard_engine
+            if not create and not self.exists(tenant_id):
+                return None
+
+            shard_engine = self._open(tenant_id)
+            self._engines[tenant_id] = shard_engine
+            while len(self._engines) > self.max_open:
+                evicted.append(self._engines.popitem(last=False)[1])
+
+        # Las conexiones en uso siguen válidas y se cierran al devolverse
+        for old in evicted:
+            old.dispose()
+            metrics.increment("ciberseguria_shard_engines_evicted_total")
+        return shard_engine
+
+    def session(self, tenant_id: int, create: bool = True) -> Optional[Session]:
+        shard_engine = self.engine(tenant_id, create=create)
+        if shard_engine is None:
+            return None
+        return Session(bind=shard_engine, autoflush=False)
+
+    def close(self, tenant_id: int):
+        with self._lock:
+            shard_engine = self._engines.pop(tenant_id, None)
+            self._initialized.discard(tenant_id)
+        if shard_engine is not None:
+            shard_engine.dispose()
+
+    def backup(self, tenant_id: int, destination: str):
+        """Copia consistente del shard (API de respaldo de SQLite, en caliente)"""
+        if not self.exists(tenant_id):
+            raise ShardError(f"La organización {tenant_id} no tiene shard")
+        source = sqlite3.connect(self.path(tenant_id))
+        target = sqlite3.connect(destination)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    def drop(self, tenant_id: int):
+        """Eliminar los datos de la organización (borra su archivo)"""
+        self.close(tenant_id)
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            path = self.path(tenant_id) + suffix
+            if os.path.exists(path):
+                os.remove(path)
+
+
+router = ShardRouter()
+
+
+def session_for_request(request: Request) -> Optional[Session]:
+    """
+    Sesión del shard que corresponde a la request.
+
+    Las rutas con {assessment_id} van al shard del dueño del assessment (un
+    consultor viendo el reporte de un cliente); las demás, al de la
+    organización con sesión iniciada. Sólo el shard propio se crea si no existe;
+    sin shard ni sesión se usa la base principal.
+    """
+    user_id = request.session.get("user_id")
+    tenant_id = user_id
+    raw_id = request.path_params.get("assessment_id")
+    if raw_id is not None and str(raw_id).isdigit():
+        tenant_id = tenant_of(int(raw_id)) or user_id
+    if tenant_id is None:
+        return None
+    return router.session(tenant_id, create=tenant_id == user_id)
+
+
+# ============================================================================
+# CONSULTAS ENTRE CLIENTES
+# ============================================================================
+
+@contextmanager
+def gathered_session(tenant_ids: List[int]) -> Iterator[Session]:
+    """
+    Sesión sobre la base principal con el último diagnóstico completado de
+    cada organización (y sus brechas) en tablas TEMP assessments y answers.
+
+    TEMP resuelve antes que la base principal, así que las consultas del
+    portafolio corren sin cambios. La conexión no va al pool: al cerrarla se
+    descartan las tablas TEMP. El costo crece con el número de clientes.
+    """
+    gather_engine = create_engine(f"sqlite:///{main_database_path()}", poolclass=NullPool)
+    connection = gather_engine.connect()
+    raw = connection.connection.dbapi_connection
+    brechas = ", ".join(f"'{respuesta.name}'" for respuesta in BRECHA_RESPUESTAS)
+    try:
+        # ATTACH/DETACH no pueden ocurrir dentro de una transacción
+        raw.isolation_level = None
+        for name in ("assessments", "answers"):
+            raw.execute(f"CREATE TEMP TABLE {name} AS SELECT {_table_columns(name)} FROM main.{name} WHERE 0")
+        raw.execute("CREATE INDEX temp.ix_gathered_assessments ON assessments (user_id, estado, fecha)")
+        raw.execute("CREATE INDEX temp.ix_gathered_answers ON answers (assessment_id, respuesta)")
+
+        for tenant_id in tenant_ids:
+            if not router.exists(tenant_id):
+                continue
+            router.ensure_schema(tenant_id)
+            raw.execute("ATTACH DATABASE ? AS shard", (router.path(tenant_id),))
+            try:
+                raw.execute(
+                    f"INSERT INTO temp.assessments SELECT {_table_columns('assessments')} FROM shard.assessments "
+                    "WHERE user_id = ? AND estado = 'Completado' ORDER BY fecha DESC, id DESC LIMIT 1",
+                    (tenant_id,)
+                )
+                raw.execute(
+                    f"INSERT INTO temp.answers SELECT {_table_columns('answers')} FROM shard.answers "
+                    f"WHERE assessment_id IN (SELECT id FROM temp.assessments WHERE user_id = ?) "
+                    f"AND respuesta IN ({brechas})",
+                    (tenant_id,)
+                )
+            finally:
+                raw.execute("DETACH DATABASE shard")
+        raw.isolation_level = ""
+
+        db = Session(bind=connection, autoflush=False)
+        try:
+            yield db
+        finally:
+            db.close()
+    finally:
+        connection.close()
+        gather_engine.dispose()
+
+
+def tenant_sessions(user_id: Optional[int] = None):
+    """Fábricas de sesión de los shards (uno o todos), para recorrerlos en orden"""
+    tenants = [user_id] if user_id is not None else router.tenants()
+    return [lambda tenant_id=tenant_id: router.session(tenant_id, create=False) for tenant_id in tenants]
+
+
+# ============================================================================
+# MIGRACIÓN Y ADMINISTRACIÓN
+# ============================================================================
+
+def migrate(verbose: bool = True) -> int:
+    """
+    Mover los assessments de la base principal a los shards de sus dueños.
+
+    Los ids de assessment se renumeran al rango de la organización
+    (user_id * SHARD_ID_SPAN + id anterior); cada organización se mueve en una
+    transacción que abarca ambos archivos. Retorna el número de assessments.
+    """
+    connection = sqlite3.connect(main_database_path(), isolation_level=None)
+    moved = 0
+    try:
+        owners = [row[0] for row in connection.execute(
+            "SELECT DISTINCT user_id FROM main.assessments WHERE id < ? ORDER BY user_id", (SHARD_ID_SPAN,)
+        )]
+        for tenant_id in owners:
+            router.engine(tenant_id)  # Crea el shard con su esquema
+            connection.execute("ATTACH DATABASE ? AS shard", (router.path(tenant_id),))
+            params = {"offset": tenant_id * SHARD_ID_SPAN, "tenant": tenant_id, "span": SHARD_ID_SPAN}
+            owned = "SELECT id FROM main.assessments WHERE user_id = :tenant AND id < :span"
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                count = connection.execute(
+                    f"INSERT INTO shard.assessments ({_table_columns('assessments')}) "
+                    f"SELECT {_shifted_columns('assessments', 'id')} FROM main.assessments WHERE id IN ({owned})",
+                    params
+                ).rowcount
+                for name in ("answers", "evidence_attachments"):
+                    connection.execute(
+                        f"INSERT INTO shard.{name} ({_table_columns(name)}) "
+                        f"SELECT {_shifted_columns(name, 'assessment_id')} FROM main.{name} "
+                        f"WHERE assessment_id IN ({owned})",
+                        params
+                    )
+                    connection.execute(f"DELETE FROM main.{name} WHERE assessment_id IN ({owned})", params)
+                connection.execute(f"DELETE FROM main.assessments WHERE id IN ({owned})", params)
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            finally:
+                connection.execute("DETACH DATABASE shard")
+            moved += count
+            if verbose:
+                print(f"   org {tenant_id}: {count} assessments -> {router.path(tenant_id)}")
+    finally:
+        connection.close()
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Administrar los shards por organización")
+    commands = parser.add_subparsers(dest="comando", required=True)
+    commands.add_parser("migrar", help="Mover los assessments de la base principal a los shards")
+    commands.add_parser("listar", help="Listar los shards y su tamaño")
+    backup_parser = commands.add_parser("respaldar", help="Copia en caliente del shard de una organización")
+    backup_parser.add_argument("user_id", type=int)
+    backup_parser.add_argument("destino")
+    drop_parser = commands.add_parser("eliminar", help="Borrar los datos de una organización")
+    drop_parser.add_argument("user_id", type=int)
+    args = parser.parse_args()
+
+    try:
+        if args.comando == "migrar":
+            moved = migrate()
+            print(f"✅ {moved} assessments movidos a {SHARD_DIR}/")
+        elif args.comando == "listar":
+            for tenant_id in router.tenants():
+                print(f"{tenant_id:>10}  {os.path.getsize(router.path(tenant_id)):>12} bytes  {router.path(tenant_id)}")
+        elif args.comando == "respaldar":
+            router.backup(args.user_id, args.destino)
+            print(f"✅ Shard de la organización {args.user_id} respaldado en {args.destino}")
+        else:
+            router.drop(args.user_id)
+            print(f"✅ Datos de la organización {args.user_id} eliminados")
+    except ShardError as exc:
+        print(f"❌ {exc}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
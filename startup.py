@@ -0,0 +1,73 @@
+"""
+Medición de Tiempos de Arranque
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Registra cuánto tarda cada fase del arranque de un worker (imports, esquema,
+cachés, warmup en segundo plano) para saber dónde se va el cold start.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger("ciberseguria.startup")
+
+
+class StartupTimer:
+    """Acumula la duración de las fases de arranque del proceso"""
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._last_mark = self._origin
+        self._phases: List[Tuple[str, float]] = []
+        self._totals: Dict[str, float] = {}  # Hitos: tiempo desde el import, incluye las fases previas
+        self._lock = threading.Lock()
+
+    def _record(self, name: str, seconds: float):
+        with self._lock:
+            self._phases.append((name, seconds))
+
+    def mark(self, name: str):
+        """Registrar como fase el tiempo transcurrido desde la marca anterior"""
+        now = time.perf_counter()
+        self._record(name, now - self._last_mark)
+        self._last_mark = now
+
+    def total(self, name: str):
+        """Registrar un hito con el tiempo acumulado desde el import (no es una fase)"""
+        with self._lock:
+            self._totals[name] = time.perf_counter() - self._origin
+
+    @contextmanager
+    def phase(self, name: str):
+        """Medir un bloque como fase independiente"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - start)
+
+    def report(self) -> Dict:
+        """Resumen de fases en milisegundos"""
+        with self._lock:
+            phases = list(self._phases)
+            totals = dict(self._totals)
+        return {
+            "pid": os.getpid(),
+            "since_import_ms": round((time.perf_counter() - self._origin) * 1000, 1),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in phases},
+            "totals_ms": {name: round(seconds * 1000, 1) for name, seconds in totals.items()}
+        }
+
+    def log_report(self):
+        """Escribir el resumen en el log"""
+        report = self.report()
+        breakdown = ", ".join(f"{name}={ms}ms" for name, ms in report["phases_ms"].items())
+        totals = ", ".join(f"{name}={ms}ms" for name, ms in report["totals_ms"].items())
+        logger.info("Arranque worker %s: %s (total: %s)", report["pid"], breakdown, totals)
+
+
+# Temporizador global del proceso (se crea en el primer import)
+timer = StartupTimer()
@@ -0,0 +1,109 @@
+/*
+ * Service worker del cuestionario - CiberSegurIA
+ *
+ * - /static/: se responde desde caché y se actualiza en segundo plano.
+ * - Secciones del catálogo (/assessment/catalog/{versión}/domain/{n}): son
+ *   inmutables por versión, se responden desde caché; la página pide guardar
+ *   todas las de su versión al abrirse.
+ * - Página del cuestionario (/assessment/{id}): red primero y, sin conexión,
+ *   la última copia guardada.
+ *
+ * Las respuestas pendientes no pasan por aquí: viven en la cola local de la
+ * página y se sincronizan con /api/assessment/{id}/answers.
+ */
+const CACHE = 'ciberseguria-v1';
+const PRECACHE = ['/static/css/style.css'];
+
+const CATALOG_PATH = /^\/assessment\/catalog\/\d+\/domain\/\d+$/;
+const QUESTIONNAIRE_PATH = /^\/assessment\/\d+$/;
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE)
+            .then(cache => cache.addAll(PRECACHE))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    // Descartar las cachés de versiones anteriores del service worker
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys.filter(key => key !== CACHE).map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('message', event => {
+    const data = event.data || {};
+    if (data.type !== 'precache' || !Array.isArray(data.urls)) return;
+
+    event.waitUntil(caches.open(CACHE).then(async cache => {
+        for (const url of data.urls) {
+            if (await cache.match(url)) continue;
+            try {
+                await cache.add(url);
+            } catch (err) {
+                // Sin conexión: se reintenta la próxima vez que se abra el cuestionario
+            }
+        }
+    }));
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+
+    if (CATALOG_PATH.test(url.pathname)) {
+        event.respondWith(cacheFirst(request));
+    } else if (url.pathname.startsWith('/static/')) {
+        event.respondWith(staleWhileRevalidate(request, event));
+    } else if (request.mode === 'navigate' && QUESTIONNAIRE_PATH.test(url.pathname)) {
+        event.respondWith(networkFirst(request));
+    }
+});
+
+async function cacheFirst(request) {
+    const cached = await caches.match(request);
+    if (cached) return cached;
+    const response = await fetch(request);
+    if (response.ok) {
+        const cache = await caches.open(CACHE);
+        await cache.put(request, response.clone());
+    }
+    return response;
+}
+
+async function staleWhileRevalidate(request, event) {
+    const cache = await caches.open(CACHE);
+    const cached = await cache.match(request);
+    const update = fetch(request).then(response => {
+        if (response.ok) return cache.put(request, response.clone()).then(() => response);
+        return response;
+    });
+    if (cached) {
+        event.waitUntil(update.catch(() => {}));
+        return cached;
+    }
+    return update;
+}
+
+async function networkFirst(request) {
+    const cache = await caches.open(CACHE);
+    try {
+        const response = await fetch(request);
+        if (response.ok && response.type === 'basic') {
+            await cache.put(request, response.clone());
+        } else {
+            // Redirección al reporte (ya enviado) o al login: no servir la copia vieja
+            await cache.delete(request);
+        }
+        return response;
+    } catch (err) {
+        const cached = await cache.match(request);
+        if (cached) return cached;
+        throw err;
+    }
+}
@@ -0,0 +1,287 @@
+"""
+Trazas por Etapa de Cada Request
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+Registra spans livianos (autenticación, consultas SQL, render de templates,
+secciones del PDF) dentro de cada request y los escribe como una línea JSON
+por request en un archivo local. La decisión de guardar se toma al final: los
+requests lentos se guardan siempre y los rápidos sólo una fracción (muestreo).
+
+Uso:
+    with tracing.span("pdf.build", pages=12):
+        ...
+Fuera de un request trazado, span() no hace nada.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger("ciberseguria.tracing")
+
+# Configuración
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") != "0"
+TRACE_FILE = os.getenv("TRACE_FILE", "traces/traces.jsonl")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))  # Rotación a .1
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))  # Siempre se guardan
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))  # Fracción de requests rápidos
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "2000"))  # Por request
+TRACE_SQL_CHARS = 300  # Largo máximo del SQL guardado en cada span
+
+metrics.describe("ciberseguria_traces_exported_total", "Trazas de requests escritas al archivo local")
+
+
+class Trace:
+    """Spans de un request en curso"""
+
+    __slots__ = ("trace_id", "started", "spans", "dropped", "_next_id")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans: List[Dict] = []
+        self.dropped = 0
+        self._next_id = 0
+
+    def new_span_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("ciberseguria_trace", default=None)
+_current_span: ContextVar[Optional[int]] = ContextVar("ciberseguria_span", default=None)
+
+
+class _Span:
+    """Context manager de un span (no hace nada si no hay traza activa)"""
+
+    __slots__ = ("name", "attrs", "trace", "span_id", "parent", "start", "_token")
+
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+        self.trace = _current_trace.get()
+
+    def __enter__(self):
+        trace = self.trace
+        if trace is None:
+            return self
+        self.span_id = trace.new_span_id()
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self.span_id)
+        self.start = time.perf_counter()
+        return self
+
+    def set(self, **attrs):
+        """Agregar atributos al span (ej. resultados conocidos al final)"""
+        self.attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb):
+        trace = self.trace
+        if trace is None:
+            return False
+        end = time.perf_counter()
+        _current_span.reset(self._token)
+
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _record(trace, self.name, self.span_id, self.parent, self.start, end, self.attrs)
+        return False
+
+
+def _record(trace: Trace, name: str, span_id: int, parent: Optional[int], start: float, end: float, attrs: Dict):
+    if len(trace.spans) >= TRACE_MAX_SPANS:
+        trace.dropped += 1
+        return
+    trace.spans.append({
+        "id": span_id,
+        "parent": parent,
+        "name": name,
+        "start_ms": round((start - trace.started) * 1000, 3),
+        "duration_ms": round((end - start) * 1000, 3),
+        "attrs": attrs,
+    })
+
+
+def span(name: str, **attrs) -> _Span:
+    """Abrir un span hijo del span actual"""
+    return _Span(name, attrs)
+
+
+def record_span(name: str, seconds: float, **attrs):
+    """
+    Registrar como span un tiempo ya medido que termina ahora (ej. trabajo
+    intercalado dentro de otro span); no hace nada si no hay traza activa.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    end = time.perf_counter()
+    _record(trace, name, trace.new_span_id(), _current_span.get(), end - seconds, end, attrs)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+@contextmanager
+def capture():
+    """Trazar un bloque fuera de un request (scripts y benchmarks); entrega la Trace"""
+    trace = Trace()
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+# ============================================================================
+# Exportador JSONL
+# ============================================================================
+
+class JsonlExporter:
+    """Agrega una línea JSON por traza; rota el archivo al superar max_bytes"""
+
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = TRACE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def export(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            try:
+                if os.path.getsize(self.path) + len(line) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+            except FileNotFoundError:
+                pass
+            with open(self.path, "a", encoding="utf-8") as fh:
+                fh.write(line)
+
+
+exporter = JsonlExporter()
+
+
+def should_keep(duration_ms: float, slow_ms: float = None, sample_rate: float = None) -> Optional[str]:
+    """Motivo para guardar una traza ("slow" o "sampled"), o None para descartarla"""
+    slow_ms = TRACE_SLOW_MS if slow_ms is None else slow_ms
+    sample_rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if duration_ms >= slow_ms:
+        return "slow"
+    if sample_rate > 0 and random.random() < sample_rate:
+        return "sampled"
+    return None
+
+
+# ============================================================================
+# Middleware ASGI
+# ============================================================================
+
+class TracingMiddleware:
+    """Abre una traza por request HTTP y la exporta al terminar la respuesta"""
+
+    def __init__(self, app, exporter: JsonlExporter = None):
+        self.app = app
+        self.exporter = exporter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(None)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-trace-id", trace.trace_id.encode()))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            self._finish(trace, scope, status["code"])
+
+    def _finish(self, trace: Trace, scope, status_code: int):
+        duration_ms = (time.perf_counter() - trace.started) * 1000
+        reason = should_keep(duration_ms)
+        if reason is None:
+            return
+
+        route = scope.get("route")
+        record = {
+            "trace_id": trace.trace_id,
+            "ts": time.time(),
+            "method": scope.get("method"),
+            "path": scope.get("path"),
+            "route": getattr(route, "path", None),
+            "status": status_code,
+            "duration_ms": round(duration_ms, 3),
+            "reason": reason,
+            "dropped_spans": trace.dropped,
+            "spans": trace.spans,
+        }
+        try:
+            (self.exporter or exporter).export(record)
+            metrics.increment("ciberseguria_traces_exported_total", reason=reason)
+        except OSError:
+            logger.exception("No se pudo escribir la traza %s", trace.trace_id)
+
+
+# ============================================================================
+# Instrumentación
+# ============================================================================
+
+def instrument_engine(engine, label: str = "primary"):
+    """Un span por consulta SQL ejecutada en el engine"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current_trace.get() is not None:
+            conn.info.setdefault("ciberseguria_span_starts", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        trace = _current_trace.get()
+        starts = conn.info.get("ciberseguria_span_starts")
+        if trace is None or not starts:
+            return
+        start = starts.pop()
+        _record(
+            trace, "db.query", trace.new_span_id(), _current_span.get(), start, time.perf_counter(),
+            {"db": label, "sql": " ".join(statement.split())[:TRACE_SQL_CHARS], "rows": cursor.rowcount}
+        )
+
+
+def instrument_templates(templates):
+    """Un span por cada render de Jinja2Templates.TemplateResponse"""
+    original = templates.TemplateResponse
+
+    def traced_template_response(name, *args, **kwargs):
+        with span("template.render", template=name):
+            return original(name, *args, **kwargs)
+
+    templates.TemplateResponse = traced_template_response
+    return templates
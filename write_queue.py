@@ -0,0 +1,190 @@
+"""
+Cola de Escritura con un Solo Escritor
+CiberSegurIA - Diagnóstico SGSI Express MVP
+
+SQLite admite un solo escritor a la vez: con varias requests escribiendo en
+paralelo (registro, nuevo diagnóstico, envío del cuestionario) cada una abre
+su transacción y las demás esperan en el busy timeout o fallan con
+"database is locked".
+
+Con WRITE_QUEUE_ENABLED=1 esas mutaciones se encolan y una sola tarea
+escritora por proceso las aplica en lotes: tras la primera operación espera
+WRITE_QUEUE_WINDOW_MS por otras, abre una transacción (BEGIN IMMEDIATE),
+ejecuta cada operación en su SAVEPOINT y confirma todo con un solo COMMIT
+(un fsync por lote). Cada request recibe el resultado o la excepción de su
+propia operación; un error revierte sólo esa operación.
+
+Las operaciones son funciones síncronas op(session) -> resultado: no hacen
+commit ni rollback y retornan valores simples (ids, URLs), no entidades de la
+sesión del escritor. Con shards (SHARDING_ENABLED) la cola no se usa: cada
+organización ya escribe en su propio archivo.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, sessionmaker
+
+import metrics
+from database import (
+    SHARDING_ENABLED, SQLALCHEMY_DATABASE_URL, SessionLocal, is_memory_sqlite, create_db_engine
+)
+
+WRITE_QUEUE_ENABLED = os.getenv("WRITE_QUEUE_ENABLED", "0") == "1" and not SHARDING_ENABLED
+WRITE_QUEUE_WINDOW_MS = float(os.getenv("WRITE_QUEUE_WINDOW_MS", "2"))  # Espera para juntar un lote
+WRITE_QUEUE_MAX_BATCH = int(os.getenv("WRITE_QUEUE_MAX_BATCH", "64"))  # Operaciones por transacción
+
+logger = logging.getLogger("ciberseguria.write_queue")
+
+metrics.describe("ciberseguria_write_batches_total", "Transacciones confirmadas por la cola de escritura")
+metrics.describe("ciberseguria_write_operations_total", "Operaciones de la cola de escritura, por resultado")
+
+Operation = Callable[[Session], object]
+
+
+def writer_session_factory():
+    """
+    Sesiones del escritor sobre una conexión propia: no espera por el pool de
+    las requests (que pueden estar todas esperando al escritor).
+    """
+    if is_memory_sqlite(SQLALCHEMY_DATABASE_URL):
+        return SessionLocal
+    writer_engine = create_db_engine(SQLALCHEMY_DATABASE_URL, pool_size=1, max_overflow=0)
+    return sessionmaker(autocommit=False, autoflush=False, bind=writer_engine)
+
+
+class WriteQueue:
+    """Tarea escritora única que agrupa operaciones en transacciones"""
+
+    def __init__(self, session_factory=None, window_ms: float = WRITE_QUEUE_WINDOW_MS,
+                 max_batch: int = WRITE_QUEUE_MAX_BATCH):
+        self.session_factory = session_factory  # None: writer_session_factory() al iniciar
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self):
+        """Iniciar la tarea escritora en el event loop actual (si no corre ya)"""
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        if self.session_factory is None:
+            self.session_factory = writer_session_factory()
+        if self._executor is None:
+            # Un solo hilo: todas las transacciones del escritor salen de él
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._task = loop.create_task(self._run(), name="sqlite-writer")
+
+    async def stop(self):
+        """Aplicar las operaciones pendientes y detener la tarea escritora"""
+        if self._task is None:
+            return
+        if not self._task.done():
+            self._queue.put_nowait(None)
+            await self._task
+        self._task = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def submit(self, operation: Operation):
+        """Encolar operation y esperar su resultado (ya confirmado)"""
+        self.start()
+        future = self._loop.create_future()
+        self._queue.put_nowait((operation, future))
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            # Ventana corta para que las escrituras concurrentes compartan COMMIT
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+            batch = [item]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            # Requests canceladas antes de aplicar: su operación no se ejecuta
+            batch = [(operation, future) for operation, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                outcomes = await self._loop.run_in_executor(
+                    self._executor, self._apply, [operation for operation, _ in batch]
+                )
+            except Exception as exc:
+                outcomes = [(False, exc)] * len(batch)
+            for (_, future), (ok, value) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _apply(self, operations: List[Operation]) -> List[Tuple[bool, object]]:
+        """Aplicar un lote en una sola transacción (en el hilo escritor)"""
+        outcomes = []
+        db = self.session_factory()
+        try:
+            connection = db.connection()
+            if connection.dialect.name == "sqlite":
+                # Tomar el lock de escritura al inicio y no a mitad del lote
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+            for operation in operations:
+                savepoint = db.begin_nested()
+                try:
+                    result = operation(db)
+                    savepoint.commit()
+                except Exception as exc:
+                    savepoint.rollback()
+                    outcomes.append((False, exc))
+                else:
+                    outcomes.append((True, result))
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            logger.exception("Falló la transacción de un lote de %d escrituras", len(operations))
+            metrics.increment("ciberseguria_write_operations_total", len(operations), result="failed")
+            return [(False, exc)] * len(operations)
+        finally:
+            db.close()
+
+        metrics.increment("ciberseguria_write_batches_total")
+        for ok, _ in outcomes:
+            metrics.increment("ciberseguria_write_operations_total", result="ok" if ok else "error")
+        return outcomes
+
+
+writer = WriteQueue()
+
+
+async def run(db: Session, operation: Operation):
+    """
+    Aplicar operation y confirmarla: en la cola si está activa, o si no en la
+    sesión de la request con su propio commit.
+    """
+    if WRITE_QUEUE_ENABLED:
+        # Devolver la conexión de la request al pool mientras espera el escritor
+        db.close()
+        return await writer.submit(operation)
+    try:
+        result = operation(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return result